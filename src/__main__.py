@@ -1,16 +1,48 @@
+import signal
 import threading
 from os import getenv
-from time import sleep
+from time import monotonic, sleep
 
 from .alert_processes import CEXAlertProcess, TechnicalAlertProcess
 from .telegram import TelegramBot
+from .price_cache import PriceCache
+from .alert_store import AlertStore
+from .trigger_store import get_trigger_store
+from .delivery import DeliveryQueue
+from . import http_client
 from .user_configuration import get_whitelist
 from .utils import handle_env
 from .indicators import TaapiioProcess
 from .logger import logger
 from .setup import do_setup
 
+
+class StartupTimer:
+    """Measures the startup phases, to log a breakdown of the time until the alert processes are running"""
+
+    def __init__(self):
+        self.started = self.last = monotonic()
+        self.phases = []  # [(phase, seconds)]
+
+    def phase(self, name: str) -> None:
+        """Mark the end of a phase"""
+        now = monotonic()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def log(self) -> None:
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        logger.info(f"Started in {monotonic() - self.started:.2f}s ({breakdown})")
+
+
+def on_sigterm(signum, frame):
+    """Stop gracefully (flushing pending writes) when the container is stopped"""
+    raise KeyboardInterrupt
+
+
 if __name__ == "__main__":
+    startup = StartupTimer()
+
     # Process environment variables
     handle_env()
 
@@ -19,39 +51,161 @@ if __name__ == "__main__":
         do_setup()
         logger.info("Waiting for initialization ...")
         sleep(5)
+    startup.phase("environment")
+
+    # Number of worker processes to evaluate the alerts in (1 evaluates them in this process)
+    shards = int(getenv("SHARDS", "1"))
+
+    # Share the users with the other instances running against the same database
+    cluster = None
+    if getenv("CLUSTER", "false").lower() == "true":
+        if shards > 1:
+            logger.warn("SHARDS is not used together with CLUSTER - ignoring it")
+            shards = 1
+        from .cluster import ClusterMember
+
+        listener = None
+
+        def on_leader_change(is_leader: bool) -> None:
+            """Only the leader listens to the Telegram commands"""
+            global listener
+            if not is_leader:
+                telegram_bot.stop()
+                return
+            if listener is not None:
+                listener.join()
+            listener = threading.Thread(target=telegram_bot.run, daemon=True)
+            listener.start()
+
+        cluster = ClusterMember(on_leader_change=on_leader_change)
+
+    alert_store = None
+    if shards == 1 and cluster is None:
+        # Load every user's alerts & configuration into memory and write changes back in the background.
+        # Not used with shards or in a cluster, as the alerts are also written from other processes.
+        alert_store = AlertStore()
+        alert_store.load()
+        threading.Thread(target=alert_store.run, daemon=True).start()
+        startup.phase("alert store")
 
     taapiio_process = None
     if getenv("TAAPIIO_APIKEY"):
         # Create global Taapi.io process for the aggregator and telegram bot to sync calls
-        taapiio_process = TaapiioProcess(taapiio_apikey=getenv("TAAPIIO_APIKEY"))
+        taapiio_process = TaapiioProcess(
+            taapiio_apikey=getenv("TAAPIIO_APIKEY"),
+            alert_store=alert_store,
+            cluster=cluster,
+        )
+
+    # Create the price cache shared by the Telegram bot and the CEX alert process
+    price_cache = PriceCache()
 
     # Create the Telegram bot to listen to commands and send messages
     telegram_bot = TelegramBot(
-        bot_token=getenv("TELEGRAM_BOT_TOKEN"), taapiio_process=taapiio_process
+        bot_token=getenv("TELEGRAM_BOT_TOKEN"),
+        taapiio_process=taapiio_process,
+        price_cache=price_cache,
+        alert_store=alert_store,
     )
 
-    # Run the TG bot in a daemon thread
-    threading.Thread(target=telegram_bot.run, daemon=True).start()
+    # Create the Telegram delivery queue shared by the alert processes
+    delivery_queue = DeliveryQueue(telegram_bot)
+    startup.phase("telegram bot")
+
+    if cluster is None:
+        # Run the TG bot in a daemon thread
+        threading.Thread(target=telegram_bot.run, daemon=True).start()
+    else:
+        # Lease this instance's partitions (and possibly the leader lease) before the alert processes load
+        # their users, then keep them renewed
+        cluster.heartbeat()
+        threading.Thread(target=cluster.run, daemon=True).start()
+        startup.phase("cluster")
+
+    shard_coordinator = None
+    trigger_store = None
+    if shards > 1:
+        from .sharding import ShardCoordinator
+
+        # Evaluate the alerts in worker processes, with the prices & TA aggregate fetched once in this process
+        shard_coordinator = ShardCoordinator(
+            shards,
+            delivery_queue,
+            price_cache=price_cache,
+            taapiio_process=taapiio_process,
+        )
+        threading.Thread(target=shard_coordinator.run, daemon=True).start()
+
+        if taapiio_process:
+            # Run the Taapi.io process in a daemon thread
+            threading.Thread(target=taapiio_process.run, daemon=True).start()
+    else:
+        # Write the trigger states of the alert processes in the background
+        trigger_store = get_trigger_store()
+        threading.Thread(target=trigger_store.run, daemon=True).start()
+
+        cex_process = CEXAlertProcess(
+            telegram_bot=telegram_bot,
+            price_cache=price_cache,
+            streaming=getenv("CEX_PRICE_FEED", "poll").lower() == "stream",
+            alert_store=alert_store,
+            delivery_queue=delivery_queue,
+            cluster=cluster,
+        )
+
+        if (
+            getenv("POLLING_ENGINE", "thread").lower() == "async"
+            and not cex_process.streaming
+        ):
+            # Run the CEX and Taapi.io polling on a single asyncio event loop in a daemon thread
+            from .async_engine import AsyncEngine
+
+            threading.Thread(
+                target=AsyncEngine(cex_process, taapiio_process=taapiio_process).run,
+                daemon=True,
+            ).start()
+        else:
+            # Run the CEXAlertProcess in a daemon thread
+            threading.Thread(target=cex_process.run, daemon=True).start()
 
-    # Run the CEXAlertProcess in a daemon thread
-    threading.Thread(
-        target=CEXAlertProcess(telegram_bot=telegram_bot).run, daemon=True
-    ).start()
+            if taapiio_process:
+                # Run the Taapi.io process in a daemon thread
+                threading.Thread(target=taapiio_process.run, daemon=True).start()
 
-    if taapiio_process:
-        # Run the Taapi.io process in a daemon thread
-        threading.Thread(target=taapiio_process.run, daemon=True).start()
+        if taapiio_process:
+            # Run the TechnicalAlertProcess in a daemon thread
+            threading.Thread(
+                target=TechnicalAlertProcess(
+                    telegram_bot=telegram_bot,
+                    alert_store=alert_store,
+                    delivery_queue=delivery_queue,
+                    cluster=cluster,
+                ).run,
+                daemon=True,
+            ).start()
 
-        # Run the TechnicalAlertProcess in a daemon thread
-        threading.Thread(
-            target=TechnicalAlertProcess(telegram_bot=telegram_bot).run, daemon=True
-        ).start()
+    startup.phase("alert processes")
+    startup.log()
 
     # Keep the main thread alive to listen to interrupt
+    signal.signal(signal.SIGTERM, on_sigterm)
     logger.info("Bot started - use Ctrl+C to stop the bot.")
     while True:
         try:
             sleep(0.5)
         except KeyboardInterrupt:
+            if cluster is not None:
+                cluster.close()
+            if shard_coordinator is not None:
+                shard_coordinator.close()
+            if alert_store is not None:
+                alert_store.close()
+            if trigger_store is not None:
+                trigger_store.close()
+            if taapiio_process is not None:
+                # Warm the next start with the latest indicator values
+                taapiio_process.agg_cli.ta_aggregate.checkpoint(force=True)
+            delivery_queue.close()
+            http_client.close()
             logger.info("Bot stopped")
             exit(1)
@@ -1,6 +1,14 @@
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import Future
 
 from ..telegram import TelegramBot
+from ..alert_store import AlertStore, load_all_alerts
+from ..delivery import DeliveryQueue
+from .. import events
+from ..events import EventBus, ALERT_REMOVED, ALERT_TRIGGERED
+from ..logger import logger
+from ..trigger_store import TriggerStore, get_trigger_store
 
 
 class BaseAlertProcess(ABC):
@@ -12,8 +20,44 @@ class BaseAlertProcess(ABC):
     This functionality allows standardized creation of new alert types/assets when needed by facilitating polymorphism.
     """
 
-    def __init__(self, telegram_bot: TelegramBot):
+    def __init__(
+        self,
+        telegram_bot: TelegramBot,
+        alert_store: AlertStore = None,
+        delivery_queue: DeliveryQueue = None,
+        event_bus: EventBus = None,
+        cluster=None,
+        trigger_store: TriggerStore = None,
+    ):
         self.telegram_bot = telegram_bot
+        # Optional resident store for user alerts & configuration
+        self.alert_store = alert_store
+        # Alerts are sent from the queue's workers, so that delivery does not hold up the polling cycle
+        self.delivery_queue = (
+            delivery_queue
+            if delivery_queue is not None
+            else DeliveryQueue(telegram_bot)
+        )
+        # Alert changes are published to and received from the bus, instead of re-reading every user
+        self.event_bus = event_bus if event_bus is not None else events.event_bus
+        # Cooldown alerts are re-armed in the trigger store, without rewriting the user's alerts
+        self.trigger_store = (
+            trigger_store if trigger_store is not None else get_trigger_store()
+        )
+        # Optional src.cluster.ClusterMember - only the users of its partitions are evaluated by this instance
+        self.cluster = cluster
+
+    def owns(self, user_id: str) -> bool:
+        """:return: True if this instance evaluates the user's alerts"""
+        return self.cluster is None or self.cluster.owns(user_id)
+
+    def load_all_alerts(self) -> dict[str, dict]:
+        """:return: {user_id: alerts database} for every whitelisted user evaluated by this instance"""
+        return {
+            user_id: alerts
+            for user_id, alerts in load_all_alerts(self.alert_store).items()
+            if self.owns(user_id)
+        }
 
     @abstractmethod
     def poll_user_alerts(self, tg_user_id: str) -> None:
@@ -41,13 +85,114 @@ class BaseAlertProcess(ABC):
     @abstractmethod
     def tg_alert(self, post: str, channel_ids: list[str], pair: str):
         """
-        Sends a Telegram alert to the user.
+        Queues a Telegram alert to the user.
 
         Each alert handler needs its own implementation of this method because the output
         will be different based on the asset/alert type.
         """
         pass
 
+    def log_delivery(self, post: str, status: Future) -> None:
+        """Log the chats that an alert could not be delivered to once its delivery has completed"""
+
+        def on_done(future):
+            failed = future.result()[1]
+            if len(failed) > 0:
+                logger.warn(
+                    f"Failed to send Telegram alert ({post}) to the following IDs: {failed}"
+                )
+
+        status.add_done_callback(on_done)
+
+    @staticmethod
+    def apply_triggers(alerts_database: dict, changes: list[tuple]) -> dict:
+        """
+        Apply the trigger updates of an evaluation to the user's current alerts
+
+        Alerts are located by their definition (everything but the trigger state), so that alerts added or
+        cancelled while the evaluation ran are preserved.
+
+        :param alerts_database: The user's current alerts, modified in place
+        :param changes: List of tuples: (pair, alert as evaluated, new trigger, whether to remove the alert)
+        :return: The modified alerts database
+        """
+        updated = set()  # Identical alerts are matched one-to-one
+        for pair, evaluated, trigger, remove in changes:
+            definition = {k: v for k, v in evaluated.items() if k != "trigger"}
+            for alert in alerts_database.get(pair, []):
+                if id(alert) in updated:
+                    continue
+                if {k: v for k, v in alert.items() if k != "trigger"} == definition:
+                    if remove:
+                        alerts_database[pair].remove(alert)
+                        if len(alerts_database[pair]) == 0:
+                            alerts_database.pop(pair)
+                    else:
+                        alert["trigger"] = trigger
+                        updated.add(id(alert))
+                    break
+        return alerts_database
+
+    def trigger(
+        self, tg_user_id: str, pair: str, alert: dict, value: float, changes: list
+    ) -> bool:
+        """
+        Record that an alert's condition is satisfied
+
+        :param value: The indicator value that satisfied the condition
+        :param changes: The evaluation's list of (pair, alert, new trigger, remove) to append the change to
+        :return: True if the alert is out of its cooldown and should be sent
+        """
+        cooldown = alert.get("trigger", {}).get("cooldown_seconds")
+        last_trigger = self.trigger_store.last_triggered(tg_user_id, pair, alert)
+        current_time = int(time.time())
+        if cooldown:
+            # Re-armed - only the trigger store is written, the alert definitions are unchanged
+            self.trigger_store.record(tg_user_id, pair, alert, current_time, value)
+        trigger = {"cooldown_seconds": cooldown, "last_triggered": current_time}
+        # If the alert has no cooldown setting, remove it
+        changes.append((pair, alert, trigger, not cooldown))
+        return current_time > last_trigger + (cooldown or 0)
+
+    def apply_changes(
+        self, tg_user_id: str, configuration, alerts_database: dict, changes: list
+    ) -> None:
+        """
+        Remove the triggered alerts without a cooldown from the user's alerts and publish every trigger
+
+        :param configuration: The user's configuration client
+        :param alerts_database: The user's alerts as evaluated
+        :param changes: As built by trigger()
+        """
+        removals = [change for change in changes if change[3]]
+        if len(removals) > 0:
+            # Applied to the current alerts, so that concurrent edits (e.g. a new alert) are not overwritten
+            alerts_database = configuration.modify_alerts(
+                lambda alerts: self.apply_triggers(alerts, removals)
+            )
+        # Drops the removed alerts from the indexes
+        self.publish_triggers(tg_user_id, changes, alerts_database)
+
+    def publish_triggers(
+        self, tg_user_id: str, changes: list[tuple], alerts_database: dict
+    ) -> None:
+        """
+        Publish the trigger updates of an evaluation
+
+        :param changes: As passed to apply_triggers()
+        :param alerts_database: The user's alerts once the changes were applied
+        """
+        for pair, alert, trigger, remove in changes:
+            payload = {
+                "user_id": tg_user_id,
+                "pair": pair,
+                "alert": {**alert, "trigger": trigger},
+                "alerts": alerts_database.get(pair, []),
+            }
+            self.event_bus.publish(ALERT_TRIGGERED, **payload)
+            if remove:
+                self.event_bus.publish(ALERT_REMOVED, **payload)
+
     @abstractmethod
     def run(self):
         """
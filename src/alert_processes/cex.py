@@ -1,34 +1,88 @@
 import time
+import threading
+from concurrent.futures import Future
 from datetime import datetime
 import os
 
-from ..user_configuration import (
-    LocalUserConfiguration,
-    MongoDBUserConfiguration,
-    get_whitelist,
+from ..alert_store import AlertStore, get_user_configuration
+from ..delivery import DeliveryQueue
+from ..events import (
+    EventBus,
+    ALERT_EVENTS,
+    USER_WHITELISTED,
+    USER_REMOVED,
 )
 from ..logger import logger
+from ..trigger_store import TriggerStore
 from ..config import *
-from ..utils import get_binance_price_url
+from ..price_cache import PriceCache
+from ..price_stream import BinancePriceStream
+from ..resilience import PermanentError
+from ..threshold_index import ThresholdIndex
 from .base import BaseAlertProcess
 from ..telegram import TelegramBot
 from ..models import BinancePriceResponse
 
-import requests
 from ratelimit import limits, sleep_and_retry
 
 
 class CEXAlertProcess(BaseAlertProcess):
-    def __init__(self, telegram_bot: TelegramBot):
+    def __init__(
+        self,
+        telegram_bot: TelegramBot,
+        price_cache: PriceCache = None,
+        threshold_index: ThresholdIndex = None,
+        streaming: bool = False,
+        alert_store: AlertStore = None,
+        delivery_queue: DeliveryQueue = None,
+        event_bus: EventBus = None,
+        cluster=None,
+        trigger_store: TriggerStore = None,
+    ):
         """
         :param telegram_bot: The Telegram bot instance
+        :param price_cache: The Binance price cache shared with the Telegram bot
+        :param threshold_index: The alert threshold index, kept up to date from the alert events
+        :param streaming: Evaluate alerts on every Binance stream tick instead of polling
+        :param alert_store: The resident alert store shared with the Telegram bot
+        :param delivery_queue: The Telegram delivery queue shared by the alert processes
+        :param event_bus: The bus that the Telegram bot and the user configurations publish alert changes to
+        :param cluster: The cluster membership, if several instances share the users (see src.cluster)
+        :param trigger_store: The trigger state of the alerts, shared with the other alert processes
         """
-        super().__init__(telegram_bot)
+        super().__init__(
+            telegram_bot,
+            alert_store=alert_store,
+            delivery_queue=delivery_queue,
+            event_bus=event_bus,
+            cluster=cluster,
+            trigger_store=trigger_store,
+        )
         self.polling = False  # Temporary variable to manage alerts
 
-        self.endpoint = get_binance_price_url()
+        self.price_cache = price_cache if price_cache is not None else PriceCache()
+        self.last_stats_log = time.time()
+
+        # Per-cycle price snapshot: {window: {symbol: BinancePriceResponse}}
+        self.snapshot = {}
+
+        self.threshold_index = (
+            threshold_index if threshold_index is not None else ThresholdIndex()
+        )
+
+        # Streaming mode:
+        self.streaming = streaming
+        self.stream = None
+        self.stream_counts = {}  # {(user_id, pair): number of simple alerts}
+        self.stream_pairs = {}  # {symbol: {pair: number of simple alerts}}
+        self._stream_lock = threading.Lock()
 
-    def poll_user_alerts(self, tg_user_id: str) -> None:
+        for event in ALERT_EVENTS:
+            self.event_bus.subscribe(event, self.on_alerts_changed)
+        self.event_bus.subscribe(USER_WHITELISTED, self.on_user_whitelisted)
+        self.event_bus.subscribe(USER_REMOVED, self.on_user_removed)
+
+    def poll_user_alerts(self, tg_user_id: str, pairs: set[str] = None) -> None:
         """
         1. Load the user's configuration
         2. poll all alerts and create posts
@@ -36,20 +90,18 @@ class CEXAlertProcess(BaseAlertProcess):
         4. Send alerts if found
 
         :param tg_user_id: The Telegram user ID from the database
+        :param pairs: Only evaluate the alerts of these pairs (e.g. {"BTC/USDT"}), or all pairs if None
         """
-        configuration = (
-            LocalUserConfiguration(tg_user_id)
-            if not USE_MONGO_DB
-            else MongoDBUserConfiguration(tg_user_id)
-        )
+        configuration = get_user_configuration(tg_user_id, self.alert_store)
         alerts_database = configuration.load_alerts()
         config = configuration.load_config()
 
-        do_update = False  # If any changes are made, update the database
+        changes = []  # (pair, alert, new trigger, remove) of the triggered alerts
         post_queue = []
         for pair in alerts_database.copy().keys():
+            if pairs is not None and pair not in pairs:
+                continue
 
-            remove_queue = []
             for alert in alerts_database[pair]:
                 if alert["type"] == "s":
                     condition, value, post_string = self.get_simple_indicator(
@@ -57,29 +109,11 @@ class CEXAlertProcess(BaseAlertProcess):
                     )
 
                     if condition:  # If there is a simple alert condition satisfied
-                        cooldown = alert.get("trigger", {}).get("cooldown_seconds")
-                        last_trigger = alert.get("trigger", {}).get("last_triggered", 0)
-                        if int(time.time()) > last_trigger + (cooldown or 0):
+                        if self.trigger(tg_user_id, pair, alert, value, changes):
                             post_queue.append((post_string, pair))
 
-                        current_time = int(time.time())
-                        alert["trigger"] = {
-                            "cooldown_seconds": cooldown,
-                            "last_triggered": current_time,
-                        }
-                        if not alert["trigger"]["cooldown_seconds"]:
-                            # If the alert has no cooldown setting, remove it
-                            remove_queue.append(alert)
-
-                        do_update = True  # Since the alert needs to be updated in the database, signal do_update
-
-            for item in remove_queue:
-                alerts_database[pair].remove(item)
-                if len(alerts_database[pair]) == 0:
-                    alerts_database.pop(pair)
-
-        if do_update:
-            configuration.update_alerts(alerts_database)
+        if len(changes) > 0:
+            self.apply_changes(tg_user_id, configuration, alerts_database, changes)
 
         if len(post_queue) > 0:
             self.polling = False
@@ -88,10 +122,7 @@ class CEXAlertProcess(BaseAlertProcess):
                 status = self.tg_alert(
                     post=post, channel_ids=config["channels"], pair=pair
                 )
-                if len(status[1]) > 0:
-                    logger.warn(
-                        f"Failed to send Telegram alert ({post}) to the following IDs: {status[1]}"
-                    )
+                self.log_delivery(post, status)
 
         if not self.polling:
             self.polling = True
@@ -100,8 +131,153 @@ class CEXAlertProcess(BaseAlertProcess):
     @sleep_and_retry
     @limits(calls=1, period=CEX_POLLING_PERIOD)
     def poll_all_alerts(self) -> None:
-        for user in get_whitelist():
-            self.poll_user_alerts(tg_user_id=user)
+        """
+        1. Aggregate the distinct pairs across all users from the threshold index
+        2. Fetch a price snapshot for all pairs using batched Binance requests
+        3. Evaluate the alerts of the users whose thresholds were crossed
+        """
+        price_symbols, change_symbols = self.get_snapshot_symbols()
+        self.snapshot = {
+            BINANCE_TIMEFRAMES[0]: self.price_cache.get_many(
+                price_symbols, window=BINANCE_TIMEFRAMES[0]
+            ),
+            "1d": self.price_cache.get_many(change_symbols, window="1d"),
+        }
+        self.evaluate_snapshot()
+
+    def get_snapshot_symbols(self) -> tuple[set[str], set[str]]:
+        """
+        :return: Tuple:
+                 (Set) The token pairs (e.g. BTCUSDT) with simple alerts, to fetch the latest price of
+                 (Set) The token pairs with 24HRCHG alerts, to fetch the 24 hour change of
+        """
+        return (
+            {pair.replace("/", "") for pair in self.threshold_index.pairs()},
+            {pair.replace("/", "") for pair in self.threshold_index.change_pairs()},
+        )
+
+    def evaluate_snapshot(self) -> None:
+        """Evaluate the alerts of the users whose thresholds were crossed by the current snapshot"""
+        candidates = {}  # {user_id: {pair}}
+        for pair in self.threshold_index.pairs():
+            try:
+                price = self.get_latest_price(token_pair=pair.replace("/", ""))
+            except Exception as exc:
+                # Skip the pair for this cycle rather than failing every other pair with it
+                logger.warn(f"Could not get the latest price of {pair} - {exc}")
+                continue
+            for user in self.threshold_index.crossed(pair, price):
+                candidates.setdefault(user, set()).add(pair)
+
+        # The alerts of the cycle are sent together, in one message per chat
+        with self.delivery_queue.cycle():
+            for user, user_pairs in candidates.items():
+                if self.owns(user):
+                    self.poll_user_alerts(tg_user_id=user, pairs=user_pairs)
+
+        if time.time() - self.last_stats_log > PRICE_CACHE_STATS_PERIOD:
+            self.last_stats_log = time.time()
+            logger.info(f"Price cache statistics: {self.price_cache.stats()}")
+
+    def build_index(self, alerts_by_user: dict[str, dict] = None) -> None:
+        """
+        Fully build the threshold index and the stream reference counts.
+        Only runs at startup - they are then updated incrementally from the alert events.
+        """
+        if alerts_by_user is None:
+            alerts_by_user = self.load_all_alerts()
+        self.threshold_index.build(alerts_by_user)
+
+        with self._stream_lock:
+            self.stream_counts, self.stream_pairs = {}, {}
+        for user, alerts_db in alerts_by_user.items():
+            for pair, alerts in alerts_db.items():
+                self.update_stream_counts(user, pair, alerts)
+
+    def sync_stream(self) -> None:
+        """Reconcile the price stream subscriptions with the stream reference counts"""
+        refcounts = {}
+        with self._stream_lock:
+            for symbol, pairs in self.stream_pairs.items():
+                refcounts[symbol] = sum(pairs.values())
+        self.stream.sync(refcounts)
+
+    def update_stream_counts(self, user_id: str, pair: str, alerts: list[dict]) -> None:
+        """
+        Update the reference counts of a user's pair, (un)subscribing from its stream as needed.
+        Each pair is reference counted by the number of simple alerts on it.
+
+        :param alerts: The user's current alerts on the pair
+        """
+        count = sum(1 for alert in alerts if alert["type"] == "s")
+        symbol = pair.replace("/", "")
+        with self._stream_lock:
+            previous = self.stream_counts.pop((user_id, pair), 0)
+            if count > 0:
+                self.stream_counts[(user_id, pair)] = count
+            pairs = self.stream_pairs.setdefault(symbol, {})
+            pairs[pair] = pairs.get(pair, 0) + count - previous
+            if pairs[pair] == 0:
+                del pairs[pair]
+            if len(pairs) == 0:
+                del self.stream_pairs[symbol]
+
+        if self.stream is not None:
+            if count > previous:
+                self.stream.acquire(symbol, count - previous)
+            elif count < previous:
+                self.stream.release(symbol, previous - count)
+
+    def on_alerts_changed(
+        self, user_id: str, pair: str, alerts: list[dict], **kwargs
+    ) -> None:
+        """Handles the alert events: an alert was added, cancelled, triggered or re-armed"""
+        if not self.owns(user_id):
+            return
+        self.threshold_index.update(user_id, pair, alerts)
+        self.update_stream_counts(user_id, pair, alerts)
+
+    def on_user_whitelisted(self, user_id: str, alerts: dict, **kwargs) -> None:
+        if not self.owns(user_id):
+            return
+        self.threshold_index.update_user(user_id, alerts)
+        for pair, pair_alerts in alerts.items():
+            self.update_stream_counts(user_id, pair, pair_alerts)
+
+    def on_user_removed(self, user_id: str, **kwargs) -> None:
+        self.threshold_index.remove_user(user_id)
+        with self._stream_lock:
+            pairs = [
+                pair for _user_id, pair in self.stream_counts if _user_id == user_id
+            ]
+        for pair in pairs:
+            self.update_stream_counts(user_id, pair, [])
+
+    def on_tick(self, symbol: str, ticker: BinancePriceResponse) -> None:
+        """
+        Evaluate the alerts crossed by a new price from the stream
+
+        :param symbol: token pair without the slash (e.g. BTCUSDT)
+        :param ticker: The ticker built from the stream event
+        """
+        self.price_cache.put(symbol, BINANCE_TIMEFRAMES[0], ticker)
+        self.snapshot.setdefault(BINANCE_TIMEFRAMES[0], {})[symbol] = ticker
+        if ticker.window == "1d":
+            self.price_cache.put(symbol, "1d", ticker)
+            self.snapshot.setdefault("1d", {})[symbol] = ticker
+
+        with self.delivery_queue.cycle():
+            for pair in list(self.stream_pairs.get(symbol, {})):
+                for user in self.threshold_index.crossed(pair, ticker.lastPrice):
+                    if not self.owns(user):
+                        continue
+                    try:
+                        self.poll_user_alerts(tg_user_id=user, pairs={pair})
+                    except Exception as exc:
+                        logger.exception(
+                            f"Could not evaluate {pair} alerts for user {user}",
+                            exc_info=exc,
+                        )
 
     def get_simple_indicator(
         self, pair: str, alert: dict, pair_price: float = None
@@ -161,55 +337,35 @@ class CEXAlertProcess(BaseAlertProcess):
 
         return False, pair_price, ""
 
-    def get_latest_price(
-        self,
-        token_pair: str,
-        retry_delay: int = 2,
-        maximum_retries: int = 5,
-        _try: int = 1,
-    ) -> float:
+    def get_latest_price(self, token_pair: str) -> float:
         """
-        Make a request to Binance API and return the response
+        Get the latest price from the cycle snapshot, or from the shared price cache
+
+        Transient Binance failures are retried by the shared Binance upstream (backoff, retry budget & circuit breaker),
+        so a dead pair or an outage fails fast instead of stalling the cycle.
 
         :param token_pair: token pair without the slash (e.g. BTCUSDT)
-        :param _try: The current try for recursive retries
-        :param retry_delay: seconds delay between retries
-        :param maximum_retries: Maximum number of retries
 
         :return float: price of the token pair
         """
-        url = self.endpoint.format(token_pair, BINANCE_TIMEFRAMES[0])
-        try:
-
-            response = requests.get(url)
-            response.raise_for_status()
+        if token_pair in self.snapshot.get(BINANCE_TIMEFRAMES[0], {}):
+            return self.snapshot[BINANCE_TIMEFRAMES[0]][token_pair].lastPrice
 
-            return BinancePriceResponse(response.json()).lastPrice
+        try:
+            return self.price_cache.get(token_pair, BINANCE_TIMEFRAMES[0]).lastPrice
+        except PermanentError:
+            raise
         except Exception as err:
-            if _try == maximum_retries:
-                raise ConnectionAbortedError(
-                    f"Binance request ({url}) failed after {_try} retries - Error: {err}"
-                )
-            else:
-                time.sleep(retry_delay)
-                return self.get_latest_price(token_pair, _try=_try + 1)
+            raise ConnectionAbortedError(
+                f"Binance request for {token_pair} failed - Error: {err}"
+            )
 
-    def get_pct_change(
-        self,
-        token_pair: str,
-        window: str,
-        retry_delay: int = 2,
-        maximum_retries: int = 5,
-        _try: int = 1,
-    ) -> float:
+    def get_pct_change(self, token_pair: str, window: str) -> float:
         """
-        Make a request to Binance API and return the 24 hour % change for a token pair
+        Get the % change for a token pair from the cycle snapshot, or from the shared price cache
 
         :param token_pair: token pair without the slash (e.g. BTCUSDT)
         :param window: The time window for the price change (e.g. 1d for 1 day)
-        :param _try: The current try for recursive retries
-        :param retry_delay: seconds delay between retries
-        :param maximum_retries: Maxiumum number of retries
 
         :return float: The percent change of the token pair (expressed as a percentage, i.e. -3.8 for -3.8%)
         """
@@ -217,51 +373,35 @@ class CEXAlertProcess(BaseAlertProcess):
             f"Invalid window ({window}) for Binance API. "
             f"Must be one of {BINANCE_TIMEFRAMES}"
         )
-        url = self.endpoint.format(token_pair, window)
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
+        if token_pair in self.snapshot.get(window, {}):
+            return self.snapshot[window][token_pair].priceChangePercent
 
-            return BinancePriceResponse(response.json()).priceChangePercent
+        try:
+            return self.price_cache.get(token_pair, window).priceChangePercent
+        except PermanentError:
+            raise
         except Exception as err:
-            if _try == maximum_retries:
-                raise ConnectionAbortedError(
-                    f"Binance request ({url}) failed after {_try} retries - Error: {err}"
-                )
-            else:
-                time.sleep(retry_delay)
-                return self.get_pct_change(token_pair, window, _try=_try + 1)
+            raise ConnectionAbortedError(
+                f"Binance request for {token_pair} failed - Error: {err}"
+            )
 
-    def tg_alert(self, post: str, channel_ids: list[str], pair: str = None) -> tuple:
+    def tg_alert(self, post: str, channel_ids: list[str], pair: str = None) -> Future:
         """
-        Sends the post (price alert) to each registered user of the Telegram bot
+        Queues the post (price alert) for delivery to each registered user of the Telegram bot
 
         :param post: A message to send to each registered bot user
         :param channel_ids: All group ids to send the alert to (self.config_client.load_config()['channels'])
         :param pair: The binance pair corresponding to the alert (for showing chart)
 
-        :return: Tuple = ([successful group ids], [unsuccessful group ids])
+        :return: Future resolving to ([successful group ids], [unsuccessful group ids]) once delivered
         """
         post = f"🔔 <b>CEX ALERT:</b> 🔔\n\n" + post
         if pair:
             pair_fmt = pair.replace("/", "_")
             post += f"\n\n<a href='https://www.binance.com/en/trade/{pair_fmt}?type=spot'><b>View {pair} Chart</b></a>"
-        output = ([], [])
-        for g_id in channel_ids:
-            try:
-                # requests.post(url=f'https://api.telegram.org/bot{self.tg_bot_token}/sendMessage',
-                #               params={'chat_id': g_id, 'text': header_str + post, "parse_mode": "HTML"})
-                self.telegram_bot.send_message(
-                    chat_id=g_id,
-                    text=post,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True,
-                )
-                output[0].append(g_id)
-            except:
-                output[1].append(g_id)
-
-        return output
+        return self.delivery_queue.broadcast(
+            channel_ids, post, parse_mode="HTML", disable_web_page_preview=True
+        )
 
     def run(self):
         """
@@ -269,6 +409,13 @@ class CEXAlertProcess(BaseAlertProcess):
         """
         try:
             logger.warn(f"{type(self).__name__} started at {datetime.utcnow()} UTC+0")
+            self.build_index()
+            if self.streaming:
+                self.stream = BinancePriceStream(on_tick=self.on_tick)
+                self.sync_stream()
+                # Ticks are evaluated on this thread, and subscriptions follow the alert events
+                self.stream.run()
+                return
             while True:
                 self.poll_all_alerts()
         except NotImplementedError as exc:
@@ -1,26 +1,50 @@
 import time
+import threading
+from concurrent.futures import Future
 from datetime import datetime
 import os
 from functools import wraps
 
 from .base import BaseAlertProcess
-from ..user_configuration import (
-    LocalUserConfiguration,
-    MongoDBUserConfiguration,
-    get_whitelist,
-)
+from ..alert_store import AlertStore, get_user_configuration
+from ..delivery import DeliveryQueue
+from ..events import EventBus, ALERT_EVENTS, USER_WHITELISTED, USER_REMOVED
 from ..logger import logger
+from ..trigger_store import TriggerStore
 from ..config import *
 from ..indicators import TADatabaseClient, TAAggregateClient
 from ..telegram import TelegramBot
 
 
 class TechnicalAlertProcess(BaseAlertProcess):
-    def __init__(self, telegram_bot: TelegramBot):
-        super().__init__(telegram_bot)
+    def __init__(
+        self,
+        telegram_bot: TelegramBot,
+        alert_store: AlertStore = None,
+        delivery_queue: DeliveryQueue = None,
+        event_bus: EventBus = None,
+        cluster=None,
+        trigger_store: TriggerStore = None,
+    ):
+        super().__init__(
+            telegram_bot,
+            alert_store=alert_store,
+            delivery_queue=delivery_queue,
+            event_bus=event_bus,
+            cluster=cluster,
+            trigger_store=trigger_store,
+        )
         self.polling = False  # Temporary variable to manage alerts
         self.ta_db = TADatabaseClient().fetch_ref()
-        self.ta_agg_cli = TAAggregateClient()
+        self.ta_agg_cli = TAAggregateClient(alert_store=alert_store)
+
+        # {user_id: {pairs with technical alerts}}, loaded at startup and kept up to date from the alert events
+        self.technical_pairs = {}
+        self._lock = threading.Lock()
+        for event in ALERT_EVENTS:
+            self.event_bus.subscribe(event, self.on_alerts_changed)
+        self.event_bus.subscribe(USER_WHITELISTED, self.on_user_whitelisted)
+        self.event_bus.subscribe(USER_REMOVED, self.on_user_removed)
 
     def poll_user_alerts(self, tg_user_id: str) -> None:
         """
@@ -31,19 +55,14 @@ class TechnicalAlertProcess(BaseAlertProcess):
 
         :param tg_user_id: The Telegram user ID from the database
         """
-        configuration = (
-            LocalUserConfiguration(tg_user_id)
-            if not USE_MONGO_DB
-            else MongoDBUserConfiguration(tg_user_id)
-        )
+        configuration = get_user_configuration(tg_user_id, self.alert_store)
         alerts_database = configuration.load_alerts()
         config = configuration.load_config()
 
-        do_update = False  # If any changes are made, update the database
+        changes = []  # (pair, alert, new trigger, remove) of the triggered alerts
         post_queue = []
         for pair in alerts_database.copy().keys():
 
-            remove_queue = []
             for alert in alerts_database[pair]:
                 if alert["type"] == "t":
                     condition, value, post_string = self.get_technical_indicator(
@@ -51,29 +70,11 @@ class TechnicalAlertProcess(BaseAlertProcess):
                     )
 
                     if condition:  # If there is a technical alert condition satisfied
-                        cooldown = alert.get("trigger", {}).get("cooldown_seconds")
-                        last_trigger = alert.get("trigger", {}).get("last_triggered", 0)
-                        if int(time.time()) > last_trigger + (cooldown or 0):
+                        if self.trigger(tg_user_id, pair, alert, value, changes):
                             post_queue.append((post_string, pair))
 
-                        current_time = int(time.time())
-                        alert["trigger"] = {
-                            "cooldown_seconds": cooldown,
-                            "last_triggered": current_time,
-                        }
-                        if not alert["trigger"]["cooldown_seconds"]:
-                            # If the alert has no cooldown setting, remove it
-                            remove_queue.append(alert)
-
-                        do_update = True  # Since the alert needs to be updated in the database, signal do_update
-
-            for item in remove_queue:
-                alerts_database[pair].remove(item)
-                if len(alerts_database[pair]) == 0:
-                    alerts_database.pop(pair)
-
-        if do_update:
-            configuration.update_alerts(alerts_database)
+        if len(changes) > 0:
+            self.apply_changes(tg_user_id, configuration, alerts_database, changes)
 
         if len(post_queue) > 0:
             self.polling = False
@@ -82,23 +83,56 @@ class TechnicalAlertProcess(BaseAlertProcess):
                 status = self.tg_alert(
                     post=post, channel_ids=config["channels"], pair=pair
                 )
-                if len(status[1]) > 0:
-                    logger.warn(
-                        f"Failed to send Telegram alert ({post}) to the following IDs: {status[1]}"
-                    )
+                self.log_delivery(post, status)
 
         if not self.polling:
             self.polling = True
             logger.info(f"Bot polling for next alert...")
 
     def poll_all_alerts(self) -> None:
-        """
-        1. Aggregate pairs across all users
-        2. Fetch all pair prices
-        3. Log individual user failures
-        """
-        for user in get_whitelist():
-            self.poll_user_alerts(tg_user_id=user)
+        """Poll the alerts of every user with at least one technical alert"""
+        with self._lock:
+            users = list(self.technical_pairs.keys())
+        # The alerts of the cycle are sent together, in one message per chat
+        with self.delivery_queue.cycle():
+            for user in users:
+                if self.owns(user):
+                    self.poll_user_alerts(tg_user_id=user)
+
+    def load_technical_pairs(self, alerts_by_user: dict[str, dict] = None) -> None:
+        """Load the pairs with technical alerts of every user (only at startup)"""
+        if alerts_by_user is None:
+            alerts_by_user = self.load_all_alerts()
+        technical_pairs = {}
+        for user, alerts_db in alerts_by_user.items():
+            for pair, alerts in alerts_db.items():
+                if any(alert["type"] == "t" for alert in alerts):
+                    technical_pairs.setdefault(user, set()).add(pair)
+        with self._lock:
+            self.technical_pairs = technical_pairs
+
+    def on_alerts_changed(
+        self, user_id: str, pair: str, alerts: list[dict], **kwargs
+    ) -> None:
+        """Handles the alert events: an alert was added, cancelled, triggered or re-armed"""
+        if not self.owns(user_id):
+            return
+        with self._lock:
+            pairs = self.technical_pairs.setdefault(user_id, set())
+            if any(alert["type"] == "t" for alert in alerts):
+                pairs.add(pair)
+            else:
+                pairs.discard(pair)
+            if len(pairs) == 0:
+                del self.technical_pairs[user_id]
+
+    def on_user_whitelisted(self, user_id: str, alerts: dict, **kwargs) -> None:
+        for pair, pair_alerts in alerts.items():
+            self.on_alerts_changed(user_id, pair, pair_alerts)
+
+    def on_user_removed(self, user_id: str, **kwargs) -> None:
+        with self._lock:
+            self.technical_pairs.pop(user_id, None)
 
     def get_technical_indicator(
         self, pair: str, alert: dict
@@ -106,7 +140,7 @@ class TechnicalAlertProcess(BaseAlertProcess):
         """
         Accounts for all of the implemented taapi.io indicators.
         Get the available indicators using the telegram command.
-        References the alert against the temp/ta_aggregate.json file to check for satisfaction.
+        References the alert against the in-memory TA aggregate to check for satisfaction.
 
         :param pair: The crypto pair
         :param alert: An alert data dictionary as returned by src.io_handler.UserConfiguration.load_alerts()
@@ -126,22 +160,13 @@ class TechnicalAlertProcess(BaseAlertProcess):
             return null_output
 
         # Match the alert to its corresponding reference in the aggregate and check the value:
-        matched_indicator = None
-        formatted_alert = self.ta_agg_cli.format_alert_for_match(alert)
-
-        # Attempt to find an existing indicator match for the alert
-        for indicator in aggregate[pair][alert["interval"]]:
-            try:
-                if all(indicator[k] == v for k, v in formatted_alert.items()):
-                    matched_indicator = indicator
-                    break
-            except KeyError:
-                continue
-
+        matched_indicator = self.ta_agg_cli.find(pair, alert)
         if matched_indicator is None:
-            raise ValueError(
-                f"Could not match alert to indicator in the TA aggregate - Alert: {alert}"
+            # A new alert, whose indicator is added to the aggregate by the next refresh of the Taapi.io process
+            logger.debug(
+                f"The indicator of the alert is not in the TA aggregate yet - Alert: {alert}"
             )
+            return null_output
 
         # If these tests pass, this is the correct indicator because the symbol, interval, and params pass
         value = matched_indicator["values"][alert["output_value"]]
@@ -174,39 +199,27 @@ class TechnicalAlertProcess(BaseAlertProcess):
         else:
             return null_output
 
-    def tg_alert(self, post: str, channel_ids: list[str], pair: str) -> tuple:
+    def tg_alert(self, post: str, channel_ids: list[str], pair: str) -> Future:
         """
-        Sends the post (price alert) to each registered user of the Telegram bot
+        Queues the post (price alert) for delivery to each registered user of the Telegram bot
 
         :param post: A message to send to each registered bot user
         :param channel_ids: All group ids to send the alert to (self.config_client.load_config()['channels'])
         :param pair: The binance pair corresponding to the alert (for showing chart)
-        :return: Tuple = ([successful group ids], [unsuccessful group ids])
+        :return: Future resolving to ([successful group ids], [unsuccessful group ids]) once delivered
         """
         post = f"🔔 <b>TECHNICAL ALERT:</b> 🔔\n\n" + post
         if pair:
             pair_fmt = pair.replace("/", "_")
             post += f"\n<a href='https://www.binance.com/en/trade/{pair_fmt}?type=spot'><b>View {pair} Chart</b></a>"
-        output = ([], [])
-        for g_id in channel_ids:
-            try:
-                # requests.post(url=f'https://api.telegram.org/bot{self.tg_bot_token}/sendMessage',
-                #               params={'chat_id': g_id, 'text': header_str + post, "parse_mode": "HTML"})
-                self.telegram_bot.send_message(
-                    chat_id=g_id,
-                    text=post,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True,
-                )
-                output[0].append(g_id)
-            except:
-                output[1].append(g_id)
-
-        return output
+        return self.delivery_queue.broadcast(
+            channel_ids, post, parse_mode="HTML", disable_web_page_preview=True
+        )
 
     def run(self):
         try:
             logger.warn(f"{type(self).__name__} started at {datetime.utcnow()} UTC+0")
+            self.load_technical_pairs()
             while True:
                 self.poll_all_alerts()
                 time.sleep(TECHNICAL_POLLING_PERIOD)
@@ -0,0 +1,199 @@
+import copy
+import threading
+
+from .config import *
+from .logger import logger
+from .user_configuration import BaseConfig, get_whitelist
+
+
+class AlertStore:
+    """
+    Resident copy of every whitelisted user's alerts and configuration.
+
+    All users are loaded once at startup and reads are served from memory. Mutations mark the user dirty,
+    and dirty users are written to the file/SQLite/MongoDB backend on a background interval and at shutdown,
+    so that the polling cycles do not depend on disk or database latency.
+    """
+
+    def __init__(self, flush_period: float = ALERT_STORE_FLUSH_PERIOD):
+        """
+        :param flush_period: Seconds between writes of the dirty users to the backend
+        """
+        self.flush_period = flush_period
+        self._users = {}  # {user_id: {"alerts": dict, "config": dict}}
+        self._dirty = {}  # {user_id: {"alerts", "config"}}
+        self._lock = threading.RLock()
+        self.flush_lock = threading.Lock()  # Held while writing to the backend
+        self._stopped = threading.Event()
+
+    def load(self) -> None:
+        """Load every whitelisted user from the backend"""
+        users = BaseConfig.load_all(sections=("alerts", "config"))
+        with self._lock:
+            self._users = users
+            self._dirty = {}
+        logger.info(f"Alert store loaded {len(users)} users")
+
+    def configuration(self, tg_user_id: str) -> "StoredUserConfiguration":
+        """Get a user configuration client that reads and writes through the store"""
+        return StoredUserConfiguration(tg_user_id, store=self)
+
+    def users(self) -> list[str]:
+        with self._lock:
+            return list(self._users.keys())
+
+    def get(self, user_id: str, section: str) -> dict:
+        """
+        :param section: Either "alerts" or "config"
+        :return: A copy of the section that the caller is free to mutate
+        """
+        with self._lock:
+            if user_id not in self._users:
+                self.add_user(user_id)
+            return copy.deepcopy(self._users[user_id][section])
+
+    def set(self, user_id: str, section: str, data: dict) -> None:
+        """Replace a section and schedule it to be written to the backend"""
+        with self._lock:
+            if user_id not in self._users:
+                self.add_user(user_id)
+            self._users[user_id][section] = copy.deepcopy(data)
+            self._dirty.setdefault(user_id, set()).add(section)
+
+    def modify(self, user_id: str, section: str, mutator):
+        """
+        Atomically read-modify-write a section (see LocalUserConfiguration.modify_alerts)
+
+        :return: The mutator's return value
+        """
+        with self._lock:
+            data = self.get(user_id, section)
+            result = mutator(data)
+            self.set(user_id, section, data)
+        return result
+
+    def add_user(self, user_id: str) -> None:
+        """Load a (newly whitelisted) user from the backend"""
+        backend = BaseConfig(user_id)
+        user = {"alerts": backend.load_alerts(), "config": backend.load_config()}
+        with self._lock:
+            self._users[user_id] = user
+
+    def remove_user(self, user_id: str) -> None:
+        """Forget a user, including their pending writes"""
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+
+    def flush(self) -> None:
+        """Write all dirty users to the backend in one batch"""
+        with self.flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+                pending = {
+                    user_id: {
+                        section: copy.deepcopy(self._users[user_id][section])
+                        for section in sections
+                    }
+                    for user_id, sections in dirty.items()
+                    if user_id in self._users
+                }
+
+            if len(pending) > 0:
+                try:
+                    BaseConfig.write_all(pending)
+                except Exception as exc:
+                    logger.exception(
+                        f"Could not write {len(pending)} users to the backend - retrying on the next flush",
+                        exc_info=exc,
+                    )
+                    with self._lock:
+                        for user_id, sections in pending.items():
+                            self._dirty.setdefault(user_id, set()).update(sections)
+
+    def run(self) -> None:
+        """
+        Flush the dirty users every flush_period seconds until close() is called.
+
+        Should be started in a new daemon thread.
+        """
+        while not self._stopped.wait(self.flush_period):
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.exception("Could not flush the alert store", exc_info=exc)
+
+    def close(self) -> None:
+        """Stop the background flush and write any pending changes"""
+        self._stopped.set()
+        self.flush()
+
+
+class StoredUserConfiguration(BaseConfig):
+    """User configuration client backed by the AlertStore - overrides the read/write methods of the backend"""
+
+    def __init__(self, tg_user_id: str, store: AlertStore):
+        """
+        :param tg_user_id: The Telegram user ID of the bot user to locate their configuration
+        :param store: The alert store holding the user's data
+        """
+        super().__init__(tg_user_id=tg_user_id)
+        self.store = store
+
+    def whitelist_user(self, is_admin: bool = False):
+        """OVERRIDES SUPER - Create the user in the backend and load them into the store"""
+        super().whitelist_user(is_admin=is_admin)
+        self.store.add_user(self.user_id)
+
+    def blacklist_user(self):
+        """OVERRIDES SUPER - Remove the user from the store and the backend"""
+        with self.store.flush_lock:
+            self.store.remove_user(self.user_id)
+            super().blacklist_user()
+
+    def load_alerts(self) -> dict:
+        return self.store.get(self.user_id, "alerts")
+
+    def update_alerts(self, data: dict) -> None:
+        self.store.set(self.user_id, "alerts", data)
+
+    def load_config(self) -> dict:
+        return self.store.get(self.user_id, "config")
+
+    def update_config(self, data: dict) -> None:
+        self.store.set(self.user_id, "config", data)
+
+    def modify_alerts(self, mutator):
+        """OVERRIDES SUPER - Read-modify-write under the store's lock"""
+        return self.store.modify(self.user_id, "alerts", mutator)
+
+    def modify_config(self, mutator):
+        """OVERRIDES SUPER - Read-modify-write under the store's lock"""
+        return self.store.modify(self.user_id, "config", mutator)
+
+
+def get_user_configuration(tg_user_id: str, alert_store: AlertStore = None):
+    """Get a user's configuration client, served from the alert store if one is used"""
+    if alert_store is not None:
+        return alert_store.configuration(tg_user_id)
+    return BaseConfig(tg_user_id)
+
+
+def get_users(alert_store: AlertStore = None) -> list[str]:
+    """Get the whitelisted users, from the alert store if one is used"""
+    if alert_store is not None:
+        return alert_store.users()
+    return get_whitelist()
+
+
+def load_all_alerts(alert_store: AlertStore = None) -> dict[str, dict]:
+    """Get {user_id: alerts database} of every whitelisted user, from the alert store if one is used"""
+    if alert_store is not None:
+        return {
+            user_id: alert_store.get(user_id, "alerts")
+            for user_id in alert_store.users()
+        }
+    return {
+        user_id: sections["alerts"]
+        for user_id, sections in BaseConfig.load_all(sections=("alerts",)).items()
+    }
@@ -0,0 +1,268 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, time
+from urllib.parse import quote
+
+from .config import *
+from .logger import logger
+from .models import BinancePriceResponse
+from .resilience import PermanentError, get_upstream
+from .alert_processes import CEXAlertProcess
+from .indicators import TaapiioProcess
+
+import aiohttp
+
+
+class AsyncHTTPClient:
+    """A single pooled aiohttp session with bounded concurrency and per-request timeouts"""
+
+    def __init__(
+        self,
+        max_connections: int = ASYNC_MAX_CONNECTIONS,
+        timeout: float = ASYNC_REQUEST_TIMEOUT,
+    ):
+        """
+        :param max_connections: Maximum number of concurrent connections across all hosts
+        :param timeout: Total timeout of a single request (in seconds)
+        """
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        upstream: str = None,
+        raise_for_status: bool = True,
+        **kwargs,
+    ):
+        """
+        Send a request and return the decoded JSON response
+
+        :param upstream: Name of the upstream service (e.g. "binance") to send the request through the retry policy,
+                         retry budget and circuit breaker shared with the threaded engine (see http_client.request())
+        :param raise_for_status: Raise for error responses, with PermanentError for client errors
+        """
+
+        async def send():
+            async with self.session.request(method, url, **kwargs) as response:
+                if raise_for_status:
+                    _raise_for_status(response)
+                elif response.status == 429 or response.status >= 500:
+                    response.raise_for_status()
+                return await response.json(content_type=None)
+
+        if upstream is None:
+            return await send()
+        return await get_upstream(upstream).call_async(send)
+
+
+def _raise_for_status(response: aiohttp.ClientResponse) -> None:
+    """Like http_client.raise_for_status(), for aiohttp responses"""
+    if 400 <= response.status < 500 and response.status != 429:
+        raise PermanentError(
+            f"{response.status} Client Error: {response.reason} for url: {response.url}"
+        )
+    response.raise_for_status()
+
+
+class AsyncEngine:
+    """
+    asyncio variant of the polling engine for the CEXAlertProcess and the TaapiioProcess.
+
+    All Binance and taapi.io requests of a cycle are sent concurrently over a single pooled HTTP client,
+    so that one slow response no longer stalls the others. Alert evaluation and delivery reuse the
+    process classes and run in worker threads, so the results are identical to the threaded engine.
+    """
+
+    def __init__(
+        self, cex_process: CEXAlertProcess, taapiio_process: TaapiioProcess = None
+    ):
+        self.cex = cex_process
+        self.taapiio = taapiio_process
+        self.http = None
+        # taapi.io quota waits block, so they get their own thread to avoid starving evaluation
+        self.quota_executor = ThreadPoolExecutor(max_workers=1)
+
+    def run(self) -> None:
+        """
+        Runs the engine's event loop.
+
+        Should be started in a new daemon thread.
+        """
+        logger.warn(f"{type(self).__name__} started")
+        asyncio.run(self.main())
+
+    async def main(self) -> None:
+        async with AsyncHTTPClient() as self.http:
+            loops = [self.cex_loop()]
+            if self.taapiio is not None:
+                loops.append(self.taapiio_loop())
+            await asyncio.gather(*loops)
+
+    async def cex_loop(self) -> None:
+        """Fetch a price snapshot and evaluate the CEX alerts every CEX_POLLING_PERIOD seconds"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.cex.build_index)
+        while True:
+            start = monotonic()
+            try:
+                await self.cex_cycle()
+            except Exception as exc:
+                logger.exception(
+                    "An error has occurred in the async CEX alert cycle", exc_info=exc
+                )
+            await asyncio.sleep(max(0.0, CEX_POLLING_PERIOD - (monotonic() - start)))
+
+    async def cex_cycle(self) -> None:
+        loop = asyncio.get_running_loop()
+        price_symbols, change_symbols = self.cex.get_snapshot_symbols()
+        try:
+            # Requests still outstanding when the next cycle is due are cancelled
+            prices, changes = await asyncio.wait_for(
+                asyncio.gather(
+                    self.fetch_tickers(price_symbols, BINANCE_TIMEFRAMES[0]),
+                    self.fetch_tickers(change_symbols, "1d"),
+                ),
+                timeout=CEX_POLLING_PERIOD,
+            )
+        except asyncio.TimeoutError:
+            logger.warn(
+                f"Binance snapshot took longer than {CEX_POLLING_PERIOD} seconds - "
+                f"falling back to the price cache for this cycle"
+            )
+            prices, changes = {}, {}
+
+        self.cex.snapshot = {BINANCE_TIMEFRAMES[0]: prices, "1d": changes}
+        await loop.run_in_executor(None, self.cex.evaluate_snapshot)
+
+    async def fetch_tickers(
+        self, symbols: set[str], window: str
+    ) -> dict[str, BinancePriceResponse]:
+        """
+        Fetch the tickers of many token pairs with concurrent multi-symbol requests,
+        storing them in the price cache shared with the Telegram bot.
+        """
+        symbols = sorted(symbols)
+        chunks = [
+            symbols[i : i + BINANCE_MAX_SYMBOLS_PER_REQUEST]
+            for i in range(0, len(symbols), BINANCE_MAX_SYMBOLS_PER_REQUEST)
+        ]
+        responses = await asyncio.gather(
+            *[
+                self.http.request_json(
+                    "GET",
+                    self.cex.price_cache.bulk_endpoint.format(
+                        quote(json.dumps(chunk, separators=(",", ":"))), window
+                    ),
+                    upstream="binance",
+                )
+                for chunk in chunks
+            ],
+            return_exceptions=True,
+        )
+
+        tickers = {}
+        for chunk, response in zip(chunks, responses):
+            if isinstance(response, Exception):
+                logger.warn(
+                    f"Binance batch request for {len(chunk)} pairs failed - Error: {response!r}"
+                )
+                continue
+            for ticker in response:
+                ticker = BinancePriceResponse(ticker)
+                self.cex.price_cache.put(ticker.symbol, window, ticker)
+                tickers[ticker.symbol] = ticker
+        return tickers
+
+    async def taapiio_loop(self) -> None:
+        """Refresh the TA aggregate, sending the bulk queries concurrently within the tier's rate limit"""
+        loop = asyncio.get_running_loop()
+        previous_rates = []
+        while True:
+            start = monotonic()
+            try:
+                await loop.run_in_executor(None, self.taapiio.refresh_aggregate)
+                aggregate = await loop.run_in_executor(
+                    None, self.taapiio.agg_cli.copy_agg
+                )
+                queries = self.taapiio.schedule(aggregate)
+                if len(queries) == 0:
+                    await self.wait_for_schedule()
+                    continue
+
+                responses = await asyncio.gather(
+                    *[self.send_bulk_query(query) for _, query in queries],
+                    return_exceptions=True,
+                )
+                for (indicators, _), response in zip(queries, responses):
+                    try:
+                        if isinstance(response, Exception):
+                            raise response
+                        self.taapiio.update_indicators(indicators, response)
+                    except Exception as exc:
+                        logger.warn(f"taapi.io bulk query failed - Error: {exc!r}")
+
+                self.taapiio.agg_cli.dump_agg(aggregate)
+                await loop.run_in_executor(
+                    None, self.taapiio.agg_cli.ta_aggregate.checkpoint
+                )
+            except Exception as exc:
+                logger.exception(
+                    "An error has occurred in the async taapi.io cycle", exc_info=exc
+                )
+                await asyncio.sleep(15)
+                continue
+
+            previous_rates.append(round(monotonic() - start, 1))
+            if len(previous_rates) > 3:
+                del previous_rates[0]
+            logger.info(
+                f"TA Aggregate updated: {sum(len(indicators) for indicators, _ in queries)} due indicators "
+                f"in {len(queries)} bulk queries ({self.taapiio.overdue} left overdue). "
+                f"Average through process rate: {round(sum(previous_rates) / len(previous_rates), 1)} seconds "
+                f"(refresh periods: {self.taapiio.format_refresh_periods()})"
+            )
+
+    async def wait_for_schedule(self) -> None:
+        """
+        Nothing to poll or due - wait until the next indicator is due or technical alerts are added, as the
+        threaded loop does. The wait runs in a worker thread, in slices of at most a second so that the executor
+        can be shut down, without copying and scheduling the aggregate again in between.
+        """
+        loop = asyncio.get_running_loop()
+        while not self.taapiio.aggregate_changed.is_set():
+            timeout = 1.0
+            if self.taapiio.next_due is not None:
+                timeout = min(self.taapiio.next_due - time(), timeout)
+                if timeout <= 0:
+                    return
+            await loop.run_in_executor(
+                None, self.taapiio.aggregate_changed.wait, timeout
+            )
+
+    async def send_bulk_query(self, query: dict) -> dict:
+        # Wait for the same rate limit as TaapiioProcess.call_api, so that Telegram commands share the quota
+        await asyncio.get_running_loop().run_in_executor(
+            self.quota_executor, self.taapiio.wait_for_quota
+        )
+        logger.info(f"Sending bulk query to API: {query}")
+        return await self.http.request_json(
+            "POST",
+            self.taapiio.bulk_endpoint,
+            upstream="taapiio",
+            raise_for_status=False,
+            json=query,
+        )
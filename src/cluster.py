@@ -0,0 +1,285 @@
+"""
+Runs several bot instances against the same user database without duplicate alerts.
+
+Users are split into CLUSTER_PARTITIONS partitions, and each partition is leased to a single live instance.
+Instances renew a heartbeat and their leases every CLUSTER_HEARTBEAT_PERIOD seconds. Partitions are assigned
+by rendezvous hashing over the live instances, so only the partitions of an instance that joins or dies move,
+and a dead instance's partitions are taken over once its leases expire. The instance holding the "leader" lease
+runs the Telegram command listener.
+
+The leases are stored next to the users: in a "<MONGODB_COLLECTION>_leases" collection with MongoDB, otherwise
+in an SQLite file (meant for running several instances on one machine for testing).
+"""
+
+import sqlite3
+import threading
+import zlib
+from os import getpid
+from socket import gethostname
+from time import monotonic, time
+from uuid import uuid4
+
+from .config import *
+from . import events
+from .events import EventBus, USER_WHITELISTED, USER_REMOVED
+from .logger import logger
+from .sharding import shard_of
+from .user_configuration import BaseConfig
+
+LEADER_LEASE = "leader"
+
+
+class MongoLeaseStore:
+    """Leases and heartbeats as documents of a sibling collection of the users collection"""
+
+    def __init__(self):
+        from .mongo import MongoDBConnection
+        from pymongo.errors import DuplicateKeyError
+
+        connection = MongoDBConnection()
+        self.collection = connection.database[f"{connection.collection.name}_leases"]
+        self._duplicate_key_error = DuplicateKeyError
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Acquire or renew a lease if it is free, expired or already held by the owner
+
+        :return: True if the owner holds the lease for the next ttl seconds
+        """
+        now = time()
+        try:
+            self.collection.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires": now + ttl}},
+                upsert=True,
+            )
+        except self._duplicate_key_error:
+            # The lease exists and is held by another owner, so the upsert tried to insert it again
+            return False
+        return True
+
+    def release(self, name: str, owner: str) -> None:
+        self.collection.delete_one({"_id": name, "owner": owner})
+
+    def heartbeat(self, instance_id: str, ttl: float) -> None:
+        self.acquire(f"instance:{instance_id}", instance_id, ttl)
+
+    def instances(self) -> list[str]:
+        """:return: The IDs of the instances with a live heartbeat"""
+        return [
+            document["owner"]
+            for document in self.collection.find(
+                {"_id": {"$regex": "^instance:"}, "expires": {"$gte": time()}},
+                {"owner": 1},
+            )
+        ]
+
+
+class SQLiteLeaseStore:
+    """Leases and heartbeats in an SQLite file shared by the instances of one machine"""
+
+    def __init__(self, path: str = CLUSTER_SQLITE_PATH):
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases "
+                "(name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Acquire or renew a lease if it is free, expired or already held by the owner
+
+        :return: True if the owner holds the lease for the next ttl seconds
+        """
+        now = time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name: str, owner: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+    def heartbeat(self, instance_id: str, ttl: float) -> None:
+        self.acquire(f"instance:{instance_id}", instance_id, ttl)
+
+    def instances(self) -> list[str]:
+        """:return: The IDs of the instances with a live heartbeat"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT owner FROM leases WHERE name LIKE 'instance:%' AND expires >= ?",
+                (time(),),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class ClusterMember:
+    """
+    This instance's membership in the cluster: its heartbeat, its partition leases and the leader lease.
+
+    The alert processes only evaluate the users of the partitions that this instance holds (see owns()).
+    Their state is kept up to date by publishing user_whitelisted / user_removed events as partitions are
+    gained and lost, and whenever the alerts of an owned user are changed by another instance.
+    """
+
+    def __init__(
+        self,
+        leases=None,
+        instance_id: str = None,
+        partitions: int = CLUSTER_PARTITIONS,
+        event_bus: EventBus = None,
+        on_leader_change=None,
+    ):
+        """
+        :param leases: The lease store (defaults to MongoDB if USE_MONGO_DB, otherwise CLUSTER_SQLITE_PATH)
+        :param instance_id: Unique ID of this instance (defaults to hostname-pid-random)
+        :param partitions: The number of user partitions, which must be the same on every instance
+        :param event_bus: The bus that the alert processes receive alert changes from
+        :param on_leader_change: Called with True when this instance becomes the leader, and False when it stops being it
+        """
+        if leases is None:
+            leases = MongoLeaseStore() if USE_MONGO_DB else SQLiteLeaseStore()
+        self.leases = leases
+        self.instance_id = (
+            instance_id
+            if instance_id is not None
+            else f"{gethostname()}-{getpid()}-{uuid4().hex[:6]}"
+        )
+        self.partition_count = partitions
+        self.event_bus = event_bus if event_bus is not None else events.event_bus
+        self.on_leader_change = on_leader_change
+
+        self.partitions = frozenset()  # The partitions leased to this instance
+        self.is_leader = False
+        # monotonic() time until which the leases are known to be held
+        self._valid_until = 0.0
+        # {user_id: version} of the owned users, as of the last sync
+        self._versions = {}
+        self._stopped = threading.Event()
+
+    def owns(self, user_id: str) -> bool:
+        """:return: True if this instance evaluates the user's alerts"""
+        return (
+            monotonic() < self._valid_until
+            and shard_of(user_id, self.partition_count) in self.partitions
+        )
+
+    def heartbeat(self) -> None:
+        """Renew the heartbeat and leases, rebalance the partitions, and sync the owned users"""
+        started = monotonic()
+        self.leases.heartbeat(self.instance_id, CLUSTER_LEASE_TTL)
+        instances = self.leases.instances()
+        if self.instance_id not in instances:
+            instances.append(self.instance_id)
+
+        partitions, handed_over = set(), []
+        for partition in range(self.partition_count):
+            name = f"partition:{partition}"
+            if _preferred(partition, instances) == self.instance_id:
+                # Taken over once the previous holder has released it, or its lease has expired
+                if self.leases.acquire(name, self.instance_id, CLUSTER_LEASE_TTL):
+                    partitions.add(partition)
+            elif partition in self.partitions:
+                # Handed over to the instance that joined
+                handed_over.append(name)
+
+        is_leader = self.leases.acquire(
+            LEADER_LEASE, self.instance_id, CLUSTER_LEASE_TTL
+        )
+        self._valid_until = started + CLUSTER_LEASE_TTL
+        if partitions != self.partitions:
+            logger.info(
+                f"Cluster instance {self.instance_id} holds {len(partitions)} of {self.partition_count} "
+                f"partitions ({len(instances)} live instances)"
+            )
+        self.partitions = frozenset(partitions)
+        self.sync_users()
+        # Only released once the consumers of user_removed are done with the users of the partitions
+        # (e.g. the trigger store has written their states), as the taking instance loads them right away
+        for name in handed_over:
+            self.leases.release(name, self.instance_id)
+        # The leader lease may already have lapsed if the heartbeat took longer than CLUSTER_LEASE_TTL
+        self.set_leader(is_leader and monotonic() < self._valid_until)
+
+    def set_leader(self, is_leader: bool) -> None:
+        """Record whether this instance holds the leader lease, calling on_leader_change if that changed"""
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        logger.warn(
+            f"Cluster instance {self.instance_id} "
+            f"{'is now' if is_leader else 'is no longer'} the leader"
+        )
+        if self.on_leader_change is not None:
+            self.on_leader_change(is_leader)
+
+    def sync_users(self) -> None:
+        """
+        Publish the users that this instance gained, lost, or whose alerts were changed by another instance.
+        A changed user is removed and re-added, so that the consumers reload all of their alerts.
+        """
+        versions = {
+            user_id: version
+            for user_id, version in BaseConfig.load_versions().items()
+            if self.owns(user_id)
+        }
+        for user_id in self._versions.keys() - versions.keys():
+            self.event_bus.publish(USER_REMOVED, user_id=user_id)
+        for user_id, version in versions.items():
+            if self._versions.get(user_id) == version:
+                continue
+            if user_id in self._versions:
+                self.event_bus.publish(USER_REMOVED, user_id=user_id)
+            self.event_bus.publish(
+                USER_WHITELISTED,
+                user_id=user_id,
+                alerts=BaseConfig(user_id).load_alerts(),
+            )
+        self._versions = versions
+
+    def run(self) -> None:
+        """
+        Heartbeat every CLUSTER_HEARTBEAT_PERIOD seconds until close() is called.
+
+        Should be started in a new daemon thread.
+        """
+        while not self._stopped.wait(CLUSTER_HEARTBEAT_PERIOD):
+            try:
+                self.heartbeat()
+            except Exception as exc:
+                # The leases lapse after CLUSTER_LEASE_TTL, and owns() stops returning True with them.
+                # The leadership is given up right away, as another instance may take the lease over first.
+                logger.exception(
+                    "Could not renew the cluster heartbeat and leases", exc_info=exc
+                )
+                self.set_leader(False)
+
+    def close(self) -> None:
+        """Release the leases, so that the other instances take over without waiting for them to expire"""
+        self._stopped.set()
+        self._valid_until = 0.0
+        for partition in self.partitions:
+            self.leases.release(f"partition:{partition}", self.instance_id)
+        if self.is_leader:
+            self.leases.release(LEADER_LEASE, self.instance_id)
+        self.leases.release(f"instance:{self.instance_id}", self.instance_id)
+
+
+def _preferred(partition: int, instances: list[str]) -> str:
+    """The instance that a partition is assigned to (highest random weight)"""
+    return max(
+        instances,
+        key=lambda instance: zlib.crc32(f"{instance}:{partition}".encode()),
+    )
@@ -13,6 +13,13 @@ SIMPLE_INDICATOR_COMPARISONS = ["ABOVE", "BELOW", "PCTCHG", "24HRCHG"]
 MAX_ALERTS_PER_USER = (
     10  # Integer or None (Should be set in a static configuration file)
 )
+TELEGRAM_DELIVERY_WORKERS = 4  # Threads sending alert messages to Telegram
+TELEGRAM_GLOBAL_RATE = 30  # Maximum messages per second across all chats
+TELEGRAM_CHAT_RATE = 1  # Maximum messages per second to a single chat
+TELEGRAM_GROUP_RATE = (20, 60)  # Maximum (messages, per seconds) to a single group chat
+TELEGRAM_DELIVERY_MAX_RETRIES = 3  # Times a message is re-sent after Telegram responds with 429 (Too Many Requests)
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096  # Telegram's limit for the text of a single message
+TELEGRAM_MESSAGE_SEPARATOR = "\n\n"  # Separates coalesced alerts within a single message
 
 """BINANCE DATA CONFIG"""
 BINANCE_LOCATIONS = ["us", "global"]
@@ -20,19 +27,66 @@ BINANCE_PRICE_URL_GLOBAL = "https://api.binance.com/api/v3/ticker?symbol={}&wind
 BINANCE_PRICE_URL_US = (
     "https://api.binance.us/api/v3/ticker?symbol={}&windowSize={}"  # (e.x. BTCUSDT, 1d
 )
+BINANCE_BULK_PRICE_URL_GLOBAL = "https://api.binance.com/api/v3/ticker?symbols={}&windowSize={}"  # (e.x. ["BTCUSDT","ETHUSDT"], 1d)
+BINANCE_BULK_PRICE_URL_US = "https://api.binance.us/api/v3/ticker?symbols={}&windowSize={}"
+BINANCE_MAX_SYMBOLS_PER_REQUEST = 100  # Binance rejects rolling window ticker requests with more than 100 symbols
+PRICE_CACHE_TTL = 2  # Seconds that a Binance ticker is reused across the alert processes and Telegram commands
+PRICE_CACHE_MAXSIZE = 2048  # Maximum number of (symbol, window) tickers held in the price cache
+PRICE_CACHE_STATS_PERIOD = 3600  # Delay between price cache statistics log entries (in seconds)
+BINANCE_STREAM_URL_GLOBAL = "wss://stream.binance.com:9443/ws"
+BINANCE_STREAM_URL_US = "wss://stream.binance.us:9443/ws"
+BINANCE_STREAM_TYPE = "miniTicker"  # "miniTicker" (last price & 24hr change) or "bookTicker" (best bid/ask)
+BINANCE_STREAM_TIMEOUT = 120  # Seconds without any frame before the stream connection is considered dead
+BINANCE_STREAM_BACKOFF = (1, 60)  # (initial, maximum) reconnect delay in seconds, doubled on each failure
+BINANCE_STREAM_SUBSCRIBE_CHUNK = 200  # Maximum streams per SUBSCRIBE request
 BINANCE_TIMEFRAMES = ["1m", "5m", "15m", "30m", "1h", "2h", "4h", "12h", "1d", "7d"]
 
+"""HTTP CLIENT CONFIG"""
+HTTP_POOL_MAXSIZE = 10  # Maximum keep-alive connections per upstream host (Binance, taapi.io, Telegram)
+HTTP_CONNECT_TIMEOUT = 5  # Timeout to establish a connection to an upstream host (in seconds)
+HTTP_READ_TIMEOUT = 15  # Timeout to wait for an upstream response (in seconds)
+
+"""UPSTREAM RESILIENCE CONFIG"""
+RETRY_ATTEMPTS = 3  # Attempts per upstream request (Binance, taapi.io, Telegram), including the first one
+RETRY_BASE_DELAY = 0.5  # Upper bound of the first (jittered) retry delay, doubled on each retry (in seconds)
+RETRY_MAX_DELAY = 5  # Upper bound of any retry delay (in seconds)
+RETRY_BUDGET = 20  # Maximum retries per upstream within RETRY_BUDGET_PERIOD
+RETRY_BUDGET_PERIOD = CEX_POLLING_PERIOD  # Period of the retry budget (in seconds)
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures that open an upstream's circuit
+CIRCUIT_RESET_TIMEOUT = 30  # Seconds that an open circuit fails fast before a trial request is let through
+
+"""ASYNCIO ENGINE CONFIG"""
+ASYNC_MAX_CONNECTIONS = 20  # Maximum concurrent connections of the pooled HTTP client used by the asyncio engine
+ASYNC_REQUEST_TIMEOUT = 10  # Total timeout of a single request sent by the asyncio engine (in seconds)
+
+"""SHARDED ENGINE CONFIG"""
+SHARD_SNAPSHOT_SIZE = 32 * 1024 * 1024  # Size of the shared memory block holding the price & TA aggregate snapshot (in bytes)
+SHARD_STARTUP_TIMEOUT = 120  # Seconds to wait for the worker processes to load their users
+
+"""CLUSTER CONFIG"""
+CLUSTER_PARTITIONS = 64  # Number of user partitions leased to the instances (must be the same on every instance)
+CLUSTER_HEARTBEAT_PERIOD = 10  # Seconds between renewals of an instance's heartbeat & leases
+CLUSTER_LEASE_TTL = 30  # Seconds after its last renewal that a dead instance's partitions are taken over
+CLUSTER_SQLITE_PATH = join(dirname(abspath(__file__)), "cluster.db")  # Lease database of the instances of one machine, when not using MongoDB
+
 """SWAP DATA CONFIG"""
 SWAP_POLLING_DELAY = 30  # Swap polling delay (in seconds) to handle rate limits.
 
 """DATABASE PREFERENCES & PATHS"""
 USE_MONGO_DB = False
+USE_SQLITE_DB = False  # Store users, channels & alerts in an SQLite database (takes precedence over USE_MONGO_DB)
+WHITELIST_REFRESH_PERIOD = 60  # Delay between whitelist rescans when MongoDB change streams are unavailable (in seconds)
+CAS_MAX_RETRIES = 5  # Attempts of a compare-and-swap update of a user's MongoDB document before giving up
+ALERT_STORE_FLUSH_PERIOD = 5  # Delay between writes of changed user alerts/configuration to the database (in seconds)
 WHITELIST_ROOT = join(dirname(abspath(__file__)), "whitelist")
+SQLITE_DB_PATH = join(dirname(abspath(__file__)), "whitelist.db")
 RESOURCES_ROOT = join(dirname(abspath(__file__)), "resources")
 TA_DB_PATH = join(
     dirname(abspath(__file__)), "resources/indicator_format_reference.json"
 )
 AGG_DATA_LOCATION = join(dirname(abspath(__file__)), "temp/ta_aggregate.json")
+TRIGGER_DB_PATH = join(dirname(abspath(__file__)), "triggers.db")  # Trigger state of the alerts of every process of this machine, when not using MongoDB or SQLite
+TRIGGER_FLUSH_PERIOD = 1  # Delay between writes of the alerts' trigger state to the database (in seconds)
 
 """TAAPI.IO"""
 INTERVALS = ["1m", "5m", "15m", "30m", "1h", "2h", "4h", "12h", "1d", "1w"]
@@ -44,6 +98,15 @@ SUBSCRIPTION_TIERS = {
     "pro": (30, 15),
     "expert": (75, 15),
 }  # (requests, per period in seconds)
+BULK_QUERY_LIMITS = {
+    "free": (1, 20),
+    "basic": (3, 20),
+    "pro": (10, 20),
+    "expert": (20, 20),
+}  # (constructs per bulk query, indicators per construct)
+TA_CANDLE_CLOSE_DELAY = 5  # Delay after a candle closes before its indicators are refreshed, for its close to be included (in seconds)
+TA_INTRA_CANDLE_REFRESH = 300  # Also refresh indicators this often before their candle closes (in seconds, None to only refresh them at the close)
+TA_AGGREGATE_CHECKPOINT_PERIOD = 60  # Delay between writes of the in-memory TA aggregate to AGG_DATA_LOCATION (in seconds)
 REQUEST_BUFFER = 0.05  # buffer percentage for preventing rate limit errors (e.x. 0.05 = 5% of request period, so period * 1.05)
 
 # TA_AGGREGATE_PPERIOD = 30  # TA Aggregate polling period, to poll technical indicators
@@ -0,0 +1,330 @@
+import heapq
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from itertools import count
+from time import monotonic
+
+from .config import *
+from .logger import logger
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+
+class TokenBucket:
+    """A token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0  # Set when Telegram asks us to back off (retry_after)
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class _Message:
+    def __init__(self, chat_id: str, text: str, kwargs: dict):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+
+
+def split_message(text: str, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> list[str]:
+    """Split a text into parts of at most limit characters, at line breaks where possible"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+def _last_result(futures: list[Future]) -> Future:
+    """:return: A future resolving to the result of the last future once all are done, or raising the first error"""
+    result = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        for future in futures:
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+        result.set_result(futures[-1].result())
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
+
+
+class DeliveryQueue:
+    """
+    Sends Telegram messages from a pool of worker threads, decoupled from alert evaluation.
+
+    Sends are paced with token buckets for Telegram's global limit and the per-chat limits
+    (groups, which have negative chat IDs, have an additional per-minute limit). Messages to the same chat
+    are delivered in order, one at a time. A 429 response pauses the chat for its retry_after and re-queues the message.
+
+    Messages waiting for the same chat are coalesced into a single message, up to Telegram's length limit,
+    so that a burst of alerts (e.g. during a large market move) costs one send per chat instead of one per alert.
+    The alert processes submit the alerts of an evaluation cycle within cycle(), which holds them until the cycle
+    ends, so that they are all waiting when the chat is sent to. Alerts of different processes are coalesced when
+    they are waiting for the same chat at the same time (e.g. while the chat is rate limited).
+    Messages longer than Telegram's limit are split into several messages, at line breaks where possible.
+    """
+
+    def __init__(
+        self,
+        telegram_bot: TeleBot,
+        workers: int = TELEGRAM_DELIVERY_WORKERS,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        group_rate: tuple = TELEGRAM_GROUP_RATE,
+        max_retries: int = TELEGRAM_DELIVERY_MAX_RETRIES,
+    ):
+        """
+        :param telegram_bot: The bot used to send the messages
+        :param workers: Number of sending threads
+        :param global_rate: Messages per second across all chats
+        :param chat_rate: Messages per second to a single chat
+        :param group_rate: (messages, period in seconds) to a single group chat
+        :param max_retries: Number of times a message is re-queued after a 429 response
+        """
+        self.telegram_bot = telegram_bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}  # {chat_id: [TokenBucket]}
+        self._pending = {}  # {chat_id: deque[_Message]}
+        # Chats with pending messages that are neither being sent to nor delayed
+        self._ready = deque()
+        self._delayed = []  # heap of (due, seq, chat_id) for rate limited chats
+        self._seq = count()
+        self._cond = threading.Condition()
+        self._threads = []
+        # Messages held by the cycle() of the current thread
+        self._local = threading.local()
+
+    def submit(self, chat_id: str, text: str, **kwargs) -> Future:
+        """
+        Queue a message for delivery, split into several messages if it is longer than Telegram's limit
+
+        :param kwargs: Passed to TeleBot.send_message (e.g. parse_mode)
+        :return: A future resolving to the (last) sent telebot Message, or raising the delivery error
+        """
+        messages = [
+            _Message(str(chat_id), part, kwargs) for part in split_message(text)
+        ]
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            held.extend(messages)
+        else:
+            self._enqueue(messages)
+        if len(messages) == 1:
+            return messages[0].future
+        return _last_result([message.future for message in messages])
+
+    @contextmanager
+    def cycle(self):
+        """
+        Hold the messages submitted by this thread until the end of the block, e.g. an evaluation cycle,
+        so that they are coalesced into one message per chat
+        """
+        if getattr(self._local, "held", None) is not None:
+            # Nested in another cycle, which sends the messages
+            yield
+            return
+        self._local.held = []
+        try:
+            yield
+        finally:
+            held, self._local.held = self._local.held, None
+            self._enqueue(held)
+
+    def broadcast(self, chat_ids: list[str], text: str, **kwargs) -> Future:
+        """
+        Queue a message for delivery to many chats
+
+        :return: A future resolving to ([successful chat ids], [unsuccessful chat ids]) once every chat was attempted
+        """
+        result, output = Future(), ([], [])
+        futures = [
+            (chat_id, self.submit(chat_id, text, **kwargs)) for chat_id in chat_ids
+        ]
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def on_done(chat_id, future):
+            with lock:
+                output[0 if future.exception() is None else 1].append(chat_id)
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                result.set_result(output)
+
+        if len(futures) == 0:
+            result.set_result(output)
+        for chat_id, future in futures:
+            future.add_done_callback(lambda f, chat_id=chat_id: on_done(chat_id, f))
+        return result
+
+    def pending(self) -> int:
+        """Number of messages waiting to be sent"""
+        with self._cond:
+            return sum(len(queue) for queue in self._pending.values())
+
+    def close(self, timeout: float = 10) -> None:
+        """Wait up to timeout seconds for the queued messages to be delivered"""
+        deadline = monotonic() + timeout
+        with self._cond:
+            while self._pending and monotonic() < deadline:
+                self._cond.wait(min(0.1, deadline - monotonic()))
+
+    def _enqueue(self, messages: list[_Message]) -> None:
+        if len(messages) == 0:
+            return
+        with self._cond:
+            self._start()
+            for message in messages:
+                queue = self._pending.get(message.chat_id)
+                if queue is None:
+                    queue = self._pending[message.chat_id] = deque()
+                    self._ready.append(message.chat_id)
+                queue.append(message)
+            self._cond.notify_all()
+
+    def _start(self) -> None:
+        """Start the worker threads on first use (must hold the lock)"""
+        if self._threads:
+            return
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _chat_buckets(self, chat_id: str) -> list[TokenBucket]:
+        buckets = self._buckets.get(chat_id)
+        if buckets is None:
+            buckets = [TokenBucket(self.chat_rate, 1)]
+            if chat_id.startswith("-"):
+                messages, period = self.group_rate
+                buckets.append(TokenBucket(messages / period, messages))
+            self._buckets[chat_id] = buckets
+        return buckets
+
+    def _next(self) -> list[_Message]:
+        """Block until a chat may be sent to and take its batch of messages (must hold the lock)"""
+        while True:
+            now = monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._ready.append(heapq.heappop(self._delayed)[2])
+
+            if self._ready:
+                chat_id = self._ready[0]
+                buckets = [self._global] + self._chat_buckets(chat_id)
+                wait = max(bucket.wait_time(now) for bucket in buckets)
+                if wait == 0:
+                    self._ready.popleft()
+                    for bucket in buckets:
+                        bucket.consume()
+                    return self._take_batch(self._pending[chat_id])
+                if self._global.wait_time(now) == 0:
+                    # Only this chat is limited - let the other chats go first
+                    self._ready.popleft()
+                    heapq.heappush(
+                        self._delayed, (now + wait, next(self._seq), chat_id)
+                    )
+                    continue
+                self._cond.wait(wait)
+                continue
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            self._cond.wait(timeout)
+
+    @staticmethod
+    def _take_batch(queue: deque) -> list[_Message]:
+        """Take the leading messages of a chat's queue that fit into a single Telegram message"""
+        batch = [queue.popleft()]
+        length = len(batch[0].text)
+        while queue and queue[0].kwargs == batch[0].kwargs:
+            length += len(TELEGRAM_MESSAGE_SEPARATOR) + len(queue[0].text)
+            if length > TELEGRAM_MAX_MESSAGE_LENGTH:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                batch = self._next()
+            chat_id = batch[0].chat_id
+
+            retry = False
+            try:
+                sent = self.telegram_bot.send_message(
+                    chat_id=chat_id,
+                    text=TELEGRAM_MESSAGE_SEPARATOR.join(m.text for m in batch),
+                    **batch[0].kwargs,
+                )
+            except ApiTelegramException as exc:
+                for message in batch:
+                    message.attempts += 1
+                if exc.error_code == 429 and batch[0].attempts <= self.max_retries:
+                    retry_after = exc.result_json.get("parameters", {}).get(
+                        "retry_after", 1
+                    )
+                    logger.warn(
+                        f"Telegram rate limit hit for chat {chat_id} - retrying in {retry_after} seconds"
+                    )
+                    with self._cond:
+                        for bucket in self._chat_buckets(chat_id):
+                            bucket.pause(retry_after)
+                    retry = True
+                else:
+                    for message in batch:
+                        message.future.set_exception(exc)
+            except Exception as exc:
+                for message in batch:
+                    message.future.set_exception(exc)
+            else:
+                for message in batch:
+                    message.future.set_result(sent)
+
+            with self._cond:
+                queue = self._pending[chat_id]
+                if retry:
+                    queue.extendleft(reversed(batch))
+                if queue:
+                    self._ready.append(chat_id)
+                else:
+                    del self._pending[chat_id]
+                self._cond.notify_all()
@@ -0,0 +1,58 @@
+import threading
+
+from .logger import logger
+
+# Payload: user_id, pair, alert, alerts (the user's alerts on the pair after the change)
+ALERT_ADDED = "alert_added"
+ALERT_REMOVED = "alert_removed"
+ALERT_TRIGGERED = "alert_triggered"  # The alert's trigger holds its new state
+ALERT_EVENTS = (ALERT_ADDED, ALERT_REMOVED, ALERT_TRIGGERED)
+
+# Payload: user_id, alerts (the user's alerts database)
+USER_WHITELISTED = "user_whitelisted"
+# Payload: user_id
+USER_REMOVED = "user_removed"
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of alert and whitelist changes.
+
+    The alert processes and the TA aggregate builder load every user once at startup, then keep their state
+    up to date from these events instead of re-reading every user each cycle.
+    Handlers are called synchronously in the publishing thread, so they must be quick and thread-safe.
+    """
+
+    def __init__(self):
+        self._handlers = {}  # {event: [handler]}
+        self._lock = threading.Lock()
+
+    def subscribe(self, event: str, handler) -> None:
+        """
+        :param event: The event name (e.g. ALERT_ADDED)
+        :param handler: Called with the event's payload as keyword arguments
+        """
+        with self._lock:
+            self._handlers[event] = self._handlers.get(event, []) + [handler]
+
+    def unsubscribe(self, event: str, handler) -> None:
+        with self._lock:
+            self._handlers[event] = [
+                h for h in self._handlers.get(event, []) if h != handler
+            ]
+
+    def publish(self, event: str, **payload) -> None:
+        """Call every handler of the event. A failing handler is logged and does not affect the others."""
+        with self._lock:
+            handlers = self._handlers.get(event, [])
+        for handler in handlers:
+            try:
+                handler(**payload)
+            except Exception as exc:
+                logger.exception(
+                    f"Could not handle the {event} event of user {payload.get('user_id')}",
+                    exc_info=exc,
+                )
+
+
+event_bus = EventBus()
@@ -0,0 +1,83 @@
+import threading
+from urllib.parse import urlsplit
+
+from .config import *
+from .resilience import PermanentError, get_upstream
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_sessions = {}  # {scheme://host: requests.Session}
+_lock = threading.Lock()
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Get the pooled session of the upstream host of a URL, creating it on first use.
+
+    Each host (Binance, taapi.io, Telegram) gets its own keep-alive connection pool,
+    so that repeated calls skip the TCP and TLS handshakes.
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, pool_block=False
+            )
+            session.mount(f"{parts.scheme}://", adapter)
+            # requests decompresses gzip responses transparently
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            _sessions[host] = session
+        return session
+
+
+def request(method: str, url: str, upstream: str = None, **kwargs) -> requests.Response:
+    """
+    requests.request() over the pooled session of the URL's host, with the default timeouts
+
+    :param upstream: Name of the upstream service (e.g. "binance") to send the request through its
+                     retry policy and circuit breaker. Connection errors, timeouts, 429 and 5xx responses
+                     are retried; other responses are returned to the caller as is.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    session = get_session(url)
+    if upstream is None:
+        return session.request(method, url, **kwargs)
+
+    def send():
+        response = session.request(method, url, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    return get_upstream(upstream).call(send)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def raise_for_status(response: requests.Response) -> None:
+    """Like Response.raise_for_status(), but raises PermanentError for client errors that retrying cannot fix"""
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        raise PermanentError(
+            f"{response.status_code} Client Error: {response.reason} for url: {response.url}",
+            response=response,
+        )
+    response.raise_for_status()
+
+
+def close() -> None:
+    """Close every pooled session"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -17,22 +17,31 @@ Features Needed:
 """
 
 import json
-from time import time, sleep
+import threading
+from time import monotonic, time, sleep
 from typing import Union
 import os
 
-from .user_configuration import (
-    get_whitelist,
-    LocalUserConfiguration,
-    MongoDBUserConfiguration,
+from .alert_store import (
+    AlertStore,
+    get_user_configuration,
+    get_users,
+    load_all_alerts,
 )
 from .config import *
+from . import events
+from .events import EventBus, ALERT_ADDED, ALERT_REMOVED, USER_WHITELISTED, USER_REMOVED
 from .logger import logger
-from .utils import get_ratelimits
+from .serialization import read_json, write_json
+from .utils import get_bulk_limits, get_ratelimits
+from . import http_client
 
-import requests
 from ratelimit import limits, sleep_and_retry
 
+# The indicators database, loaded once and shared by every TADatabaseClient
+_reference = None
+_reference_lock = threading.Lock()
+
 
 class TADatabaseClient:
     """This client should handle the cross-process operations of the technical analysis indicators database"""
@@ -42,12 +51,22 @@ class TADatabaseClient:
 
     def dump_ref(self, data: dict) -> None:
         """Update the technical analysis indicators database"""
-        with open(TA_DB_PATH, "w") as out:
-            out.write(json.dumps(data, indent=2))
+        global _reference
+        with _reference_lock:
+            with open(TA_DB_PATH, "w") as out:
+                out.write(json.dumps(data, indent=2))
+            _reference = data
 
     def fetch_ref(self) -> dict:
-        """Get the location of and return the technical analysis indicators database in JSON format"""
-        return json.loads(open(TA_DB_PATH).read())
+        """
+        Get the technical analysis indicators database in JSON format.
+        It is only read from disk once - the returned dict is shared and must not be modified.
+        """
+        global _reference
+        with _reference_lock:
+            if _reference is None:
+                _reference = read_json(TA_DB_PATH)
+            return _reference
 
     def add_indicator(
         self,
@@ -77,7 +96,7 @@ class TADatabaseClient:
                        NOTE: All return types for the output_values are considered as FLOAT
         :param indicator_type: "s" for simple indicator, and "t" for technical indicator
         """
-        db = self.fetch_ref()
+        db = dict(self.fetch_ref())
         db[indicator_id.upper()] = {
             "name": name,
             "endpoint": endpoint,
@@ -123,8 +142,175 @@ class TADatabaseClient:
         return indicator
 
 
+def indicator_key(symbol: str, interval: str, indicator: dict) -> tuple:
+    """
+    Canonical, hashable key of an aggregate indicator: (symbol, interval, indicator, normalized params)
+
+    :param indicator: An alert formatted with TAAggregateClient.format_alert_for_match(), or an aggregate entry
+    """
+    params = tuple(
+        sorted(
+            (param, _normalize(value))
+            for param, value in indicator.items()
+            if param not in ("indicator", "values", "last_update")
+        )
+    )
+    return symbol, interval, indicator["indicator"].lower(), params
+
+
+def _normalize(value):
+    """Normalize a parameter value, so that e.g. 14, 14.0 and "14" give the same key"""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def index_aggregate(aggregate: dict) -> dict:
+    """:return: {indicator key: aggregate entry} of every indicator in the aggregate"""
+    index = {}
+    for symbol, intervals in aggregate.items():
+        for interval, indicators in intervals.items():
+            for indicator in indicators:
+                index.setdefault(indicator_key(symbol, interval, indicator), indicator)
+    return index
+
+
+WEEK_OPEN_OFFSET = 4 * 86400  # Weekly candles open on Mondays, 4 days after the epoch
+
+
+def interval_seconds(interval: str) -> int:
+    """:return: The length of an interval of INTERVALS (e.g. "4h") in seconds"""
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+    return int(interval[:-1]) * units[interval[-1]]
+
+
+def next_refresh(interval: str, last_update: float) -> float:
+    """
+    When an aggregate indicator is due to be refreshed: once its candle closes, or TA_INTRA_CANDLE_REFRESH
+    seconds after its last update if that is sooner. An indicator that was never updated is due right away.
+
+    :param interval: The indicator's interval
+    :param last_update: The time of its last update (0 if it was never updated)
+    """
+    if not last_update:
+        return 0.0
+    length = interval_seconds(interval)
+    offset = WEEK_OPEN_OFFSET if interval.endswith("w") else 0
+    candle_close = (last_update - offset) // length * length + offset + length
+    due = candle_close + TA_CANDLE_CLOSE_DELAY
+    if TA_INTRA_CANDLE_REFRESH is not None:
+        due = min(due, last_update + TA_INTRA_CANDLE_REFRESH)
+    return due
+
+
+class TAAggregate:
+    """
+    The TA aggregate, held in memory and shared by the Taapi.io process and the technical alert process.
+
+    publish() replaces the current snapshot and increments the version. Readers get the current snapshot
+    without copying or parsing it, so published snapshots must never be modified - writers update a copy
+    (see TAAggregateClient.copy_agg()) and publish it. The aggregate is only written to disk as a periodic
+    checkpoint, which is loaded on the first read to warm restarts with the previous values.
+    """
+
+    def __init__(self, path: str = AGG_DATA_LOCATION):
+        """
+        :param path: The checkpoint file
+        """
+        self.path = path
+        self.version = 0  # Incremented by every publish()
+        # The current snapshot, loaded from the checkpoint on first use
+        self._data = None
+        # (snapshot, {indicator key: entry}) of the last indexed snapshot
+        self._index = (None, {})
+        self._checkpointed = (0, monotonic())  # (version, time) of the last checkpoint
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        """:return: The current aggregate, which must not be modified"""
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    try:
+                        self._data = read_json(self.path)
+                    except FileNotFoundError:
+                        self._data = {}
+                    except ValueError as exc:
+                        logger.warn(
+                            f"Ignoring the corrupt TA aggregate checkpoint - {exc}"
+                        )
+                        self._data = {}
+                data = self._data
+        return data
+
+    def index(self) -> dict:
+        """:return: {indicator key: entry} of the current aggregate, built once per snapshot"""
+        data = self.snapshot()
+        indexed, index = self._index
+        if indexed is not data:
+            index = index_aggregate(data)
+            self._index = (data, index)
+        return index
+
+    def publish(self, data: dict) -> int:
+        """
+        Replace the current aggregate
+
+        :return: The new version
+        """
+        with self._lock:
+            self._data = data
+            self.version += 1
+            return self.version
+
+    def checkpoint(self, force: bool = False) -> bool:
+        """
+        Write the aggregate to disk if it changed and TA_AGGREGATE_CHECKPOINT_PERIOD elapsed since the last write
+
+        :param force: Write regardless of the period (e.g. at shutdown)
+        :return: True if the aggregate was written
+        """
+        with self._lock:
+            version, data = self.version, self._data
+            last_version, last_time = self._checkpointed
+        if data is None or version == last_version:
+            return False
+        if not force and monotonic() - last_time < TA_AGGREGATE_CHECKPOINT_PERIOD:
+            return False
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        write_json(self.path, data)
+        with self._lock:
+            self._checkpointed = (version, monotonic())
+        return True
+
+
+shared_aggregate = TAAggregate()  # The aggregate of this process
+
+
 class TAAggregateClient:
-    def __init__(self):
+    def __init__(
+        self,
+        alert_store: AlertStore = None,
+        cluster=None,
+        aggregate: TAAggregate = None,
+    ):
+        self.alert_store = alert_store
+        # The in-memory aggregate, shared by default with the other clients of this process
+        self.ta_aggregate = aggregate if aggregate is not None else shared_aggregate
+        # {indicator key: number of alerts on the indicator}
+        self.refcounts = {}
+        # {user_id: {pair: [indicator key of each technical alert]}} of the aggregated users
+        self.user_keys = {}
+        self.cluster = cluster  # Only the indicators of the users owned by this instance are aggregated
         self.indicators_db_cli = TADatabaseClient()
         self.indicators_reference = self.indicators_db_cli.fetch_ref()
 
@@ -150,25 +336,17 @@ class TAAggregateClient:
         if ta_db is None:
             ta_db = self.indicators_reference
 
-        # Fetch the old aggregate to get previous values
-        try:
-            old_agg = self.load_agg()
-        except FileNotFoundError:
-            old_agg = {}
-            self.dump_agg(old_agg)
-        except Exception as exc:
-            logger.exception("Could not load TA aggregate", exc_info=exc)
-            raise exc
+        # The old aggregate's entries, to have previous values persist
+        old_index = self.index()
 
-        # Create the new aggregate to weed out unused indicators:
+        # Create the new aggregate to weed out unused indicators.
+        # Identical indicators of different alerts share a single entry, so that they are only requested once.
         agg = {}
-        for user in get_whitelist():
-            alerts_data = (
-                LocalUserConfiguration(user).load_alerts()
-                if not USE_MONGO_DB
-                else MongoDBUserConfiguration(user).load_alerts()
-            )
-
+        refcounts = {}
+        user_keys = {}
+        for user_id, alerts_data in load_all_alerts(self.alert_store).items():
+            if self.cluster is not None and not self.cluster.owns(user_id):
+                continue
             for symbol, alerts in alerts_data.items():
                 if symbol not in agg.keys():
                     agg[symbol] = {}
@@ -180,22 +358,13 @@ class TAAggregateClient:
 
                     # Build the alert to store in the aggregate with format prepared to be sent to the API in bulk call
                     formatted_alert = self.format_alert_for_match(alert)
+                    key = indicator_key(symbol, alert["interval"], formatted_alert)
+                    user_keys.setdefault(user_id, {}).setdefault(symbol, []).append(key)
+                    refcounts[key] = refcounts.get(key, 0) + 1
+                    if refcounts[key] > 1:
+                        continue  # Already in the new aggregate
 
-                    # Attempt to find an existing match to have previous values persist
-                    match = None
-                    try:
-                        for indicator in old_agg[symbol][alert["interval"]]:
-                            try:
-                                if all(
-                                    indicator[k] == v
-                                    for k, v in formatted_alert.items()
-                                ):
-                                    match = indicator
-                                    break
-                            except KeyError:
-                                continue
-                    except KeyError:
-                        pass
+                    match = old_index.get(key)
                     if match is not None:
                         formatted_alert = match
                     else:
@@ -209,9 +378,104 @@ class TAAggregateClient:
                     agg[symbol][alert["interval"]].append(formatted_alert)
 
         # Update the aggregate with the new data
+        self.refcounts, self.user_keys = refcounts, user_keys
         self.dump_agg(agg)
         # logger.info("TA aggregate built.")
 
+    def update_ta_aggregate(self, changes: list[tuple], ta_db: dict = None) -> bool:
+        """
+        Apply changes of the users' alerts to the aggregate, without reloading every user
+
+        The indicators of the changed alerts are reference counted, so only the indicators that no alert
+        uses anymore are removed, and only the indicators that are not in the aggregate yet are added.
+        Changes replace the previous alerts, so applying one twice is harmless.
+
+        :param changes: List of tuples:
+            - (user_id, pair, alerts): The user's current alerts on the pair
+            - (user_id, None, alerts database): All of the user's current alerts
+            - (user_id, None, None): The user was removed
+        :param ta_db: Can optionally be provided if the ta_db is already stored in a higher level function.
+        :return: True if indicators were added to or removed from the aggregate
+        """
+        if ta_db is None:
+            ta_db = self.indicators_reference
+
+        # {indicator key: formatted indicator} of the keys whose reference count changed
+        touched = {}
+        for user_id, pair, alerts in changes:
+            if self.cluster is not None and not self.cluster.owns(user_id):
+                # e.g. the user moved to another cluster instance
+                pair, alerts = None, None
+            previous = self.user_keys.pop(user_id, {})
+            if pair is None:
+                current = {}
+                for symbol, pair_alerts in (alerts or {}).items():
+                    current[symbol] = self._format_keys(symbol, pair_alerts, touched)
+            else:
+                current = dict(previous)
+                current[pair] = self._format_keys(pair, alerts, touched)
+
+            for keys in previous.values():
+                for key in keys:
+                    self.refcounts[key] -= 1
+                    touched.setdefault(key, None)
+            for keys in current.values():
+                for key in keys:
+                    self.refcounts[key] = self.refcounts.get(key, 0) + 1
+            current = {symbol: keys for symbol, keys in current.items() if keys}
+            if len(current) > 0:
+                self.user_keys[user_id] = current
+
+        index = self.index()
+        removed = {key for key in touched if self.refcounts.get(key, 0) <= 0}
+        added = {
+            key: formatted
+            for key, formatted in touched.items()
+            if self.refcounts.get(key, 0) > 0 and key not in index
+        }
+        for key in removed:
+            self.refcounts.pop(key, None)
+        removed &= index.keys()
+        if len(removed) == 0 and len(added) == 0:
+            return False
+
+        # Publish a new aggregate - the entries of the current one are shared, not modified
+        agg = {}
+        for symbol, intervals in self.load_agg().items():
+            for interval, indicators in intervals.items():
+                kept = [
+                    indicator
+                    for indicator in indicators
+                    if indicator_key(symbol, interval, indicator) not in removed
+                ]
+                if len(kept) > 0:
+                    agg.setdefault(symbol, {})[interval] = kept
+        for (symbol, interval, _, _), formatted in added.items():
+            entry = dict(formatted)
+            entry["values"] = {
+                var: None for var in ta_db[entry["indicator"].upper()]["output"]
+            }
+            entry["last_update"] = 0
+            agg.setdefault(symbol, {}).setdefault(interval, []).append(entry)
+        self.dump_agg(agg)
+        return True
+
+    def _format_keys(self, symbol: str, alerts: list[dict], formatted: dict) -> list:
+        """
+        :param formatted: {indicator key: formatted indicator} that the indicators of the alerts are added to
+        :return: The indicator keys of the technical alerts
+        """
+        keys = []
+        for alert in alerts or []:
+            if alert["type"] != "t":
+                continue
+            formatted_alert = self.format_alert_for_match(alert)
+            key = indicator_key(symbol, alert["interval"], formatted_alert)
+            if formatted.get(key) is None:
+                formatted[key] = formatted_alert
+            keys.append(key)
+        return keys
+
     def format_alert_for_match(self, alert: dict):
         formatted_alert = {"indicator": alert["indicator"].lower()}
         for param, _, default_value in self.indicators_db_cli.get_indicator(
@@ -225,19 +489,39 @@ class TAAggregateClient:
         return formatted_alert
 
     def dump_agg(self, data: dict) -> None:
-        if not os.path.isdir(os.path.dirname(AGG_DATA_LOCATION)):
-            os.mkdir(os.path.dirname(AGG_DATA_LOCATION))
-        with open(AGG_DATA_LOCATION, "w") as outfile:
-            outfile.write(json.dumps(data, indent=2))
+        """Publish a new aggregate (it must not be modified afterwards)"""
+        self.ta_aggregate.publish(data)
 
     def load_agg(self) -> dict:
-        try:
-            with open(AGG_DATA_LOCATION, "r") as infile:
-                contents = infile.read()
-                return json.loads(contents)
-        except FileNotFoundError:
-            self.dump_agg({})
-            return self.load_agg()
+        """:return: The current aggregate, which must not be modified"""
+        return self.ta_aggregate.snapshot()
+
+    def index(self) -> dict:
+        """:return: {indicator key: entry} of the current aggregate, which must not be modified"""
+        return self.ta_aggregate.index()
+
+    def find(self, symbol: str, alert: dict) -> Union[dict, None]:
+        """:return: The aggregate entry of an alert's indicator, or None if it is not in the aggregate"""
+        key = indicator_key(
+            symbol, alert["interval"], self.format_alert_for_match(alert)
+        )
+        return self.index().get(key)
+
+    def copy_agg(self) -> dict:
+        """
+        :return: A copy of the current aggregate to update and publish. Only the containers and the values
+                 are copied, the indicator definitions are shared.
+        """
+        return {
+            symbol: {
+                interval: [
+                    {**indicator, "values": dict(indicator["values"])}
+                    for indicator in indicators
+                ]
+                for interval, indicators in intervals.items()
+            }
+            for symbol, intervals in self.load_agg().items()
+        }
 
     def clean_agg(self) -> None:
         """Remove all unused indicators from the aggregate"""
@@ -251,34 +535,120 @@ class TAAggregateClient:
 class TaapiioProcess:
     """Taapi.io process should be run in a separate thread to allow for sleeping between API calls"""
 
-    def __init__(self, taapiio_apikey: str, telegram_bot_token: str = None):
+    def __init__(
+        self,
+        taapiio_apikey: str,
+        telegram_bot_token: str = None,
+        alert_store: AlertStore = None,
+        event_bus: EventBus = None,
+        cluster=None,
+    ):
         self.apikey = taapiio_apikey
+        self.bulk_endpoint = BULK_ENDPOINT
+        self.alert_store = alert_store
         self.last_call = 0  # Implemented instead of the ratelimit package solution to solve the buffer issue
-        self.ta_db = (
-            TADatabaseClient().fetch_ref()
-        )  # TA DB is static and can be loaded once
-        self.agg_cli = TAAggregateClient()
+        self.ta_db = TADatabaseClient().fetch_ref()  # TA DB is static and shared
+        self.agg_cli = TAAggregateClient(alert_store=alert_store, cluster=cluster)
         self.tg_bot_token = telegram_bot_token  # Can be left blank, but the process wont be able to report errors
 
+        # Alert changes to apply to the aggregate (see TAAggregateClient.update_ta_aggregate()), queued by the
+        # event handlers and applied by the polling loop. The aggregate is fully built on the first cycle.
+        self.pending_changes = []
+        self.built = False
+        self._changes_lock = threading.Lock()
+        # Set when technical alerts are added or removed, to wake up the loop when the aggregate is empty
+        self.aggregate_changed = threading.Event()
+        self.aggregate_changed.set()
+        # Refresh schedule of the aggregate indicators (see schedule())
+        self.next_due = None
+        self.overdue = 0
+        self.refresh_periods = {}
+        self.event_bus = event_bus if event_bus is not None else events.event_bus
+        for event in (ALERT_ADDED, ALERT_REMOVED):
+            self.event_bus.subscribe(event, self.on_alert_changed)
+        self.event_bus.subscribe(USER_WHITELISTED, self.on_user_whitelisted)
+        self.event_bus.subscribe(USER_REMOVED, self.on_user_removed)
+
+    def on_alert_changed(
+        self, user_id: str, pair: str, alert: dict, alerts: list[dict], **kwargs
+    ) -> None:
+        if alert["type"] == "t":
+            self.queue_change(user_id, pair, alerts)
+
+    def on_user_whitelisted(self, user_id: str, alerts: dict, **kwargs) -> None:
+        if any(alert["type"] == "t" for pair in alerts.values() for alert in pair):
+            self.queue_change(user_id, None, alerts)
+
+    def on_user_removed(self, user_id: str, **kwargs) -> None:
+        self.queue_change(user_id, None, None)
+
+    def queue_change(self, user_id: str, pair: Union[str, None], alerts) -> None:
+        with self._changes_lock:
+            self.pending_changes.append((user_id, pair, alerts))
+        self.aggregate_changed.set()
+
+    def refresh_aggregate(self) -> bool:
+        """
+        Build the TA aggregate on the first call, then apply the alert changes queued since the last call
+
+        :return: True if indicators were added to or removed from the aggregate
+        """
+        if not self.aggregate_changed.is_set():
+            return False
+        self.aggregate_changed.clear()  # Cleared first, so that changes queued during the update are not missed
+        with self._changes_lock:
+            changes, self.pending_changes = self.pending_changes, []
+        try:
+            if not self.built:
+                # Changes queued before the build are already part of it
+                self.agg_cli.build_ta_aggregate(self.ta_db)
+                self.built = True
+                changed = True
+            else:
+                changed = self.agg_cli.update_ta_aggregate(changes, self.ta_db)
+        except Exception:
+            with self._changes_lock:
+                self.pending_changes = changes + self.pending_changes
+            self.aggregate_changed.set()
+            raise
+
+        if changed:
+            # Forget the refresh periods of the removed indicators
+            index = self.agg_cli.index()
+            self.refresh_periods = {
+                key: seconds
+                for key, seconds in self.refresh_periods.items()
+                if key in index
+            }
+        return changed
+
     @sleep_and_retry
     @limits(
         calls=get_ratelimits()[0],
         period=round(get_ratelimits()[1] * (1 + REQUEST_BUFFER), 1),
     )
     # @tiered_rate_limit()
-    def call_api(self, endpoint: str, params: dict, r_type: str = "POST") -> dict:
+    def wait_for_quota(self) -> None:
         """
-        Calls the taapi.io API and returned the response in JSON format
+        Blocks until a taapi.io API call is allowed by the subscription tier's rate limit.
+        Shared by every caller of the API (threaded and asyncio engines, Telegram commands).
 
         Free API key limit is 1 call every 15 seconds, we use +1 to add a safety buffer
         """
+        pass
+
+    def call_api(self, endpoint: str, params: dict, r_type: str = "POST") -> dict:
+        """
+        Calls the taapi.io API and returned the response in JSON format
+        """
+        self.wait_for_quota()
         if r_type == "GET":
-            return requests.get(
-                endpoint.format(api_key=self.apikey), params=params
+            return http_client.get(
+                endpoint.format(api_key=self.apikey), upstream="taapiio", params=params
             ).json()
         elif r_type == "POST":
             logger.info(f"Sending bulk query to API: {params}")
-            return requests.post(endpoint, json=params).json()
+            return http_client.post(endpoint, upstream="taapiio", json=params).json()
 
     def mainloop(self):
         """
@@ -292,57 +662,36 @@ class TaapiioProcess:
         )  # Store the last 5 values for process time to fetch and update all values in the aggregate
         while True:
             start = time()
-            num_indicators = 0
+            num_indicators = num_queries = 0
 
-            # 1. Build to aggregate before every cycle
-            self.agg_cli.build_ta_aggregate(self.ta_db)
+            # 1. Update the aggregate if technical alerts were added or removed
+            self.refresh_aggregate()
 
-            # 2. Poll all values from the aggregate using bulk queries to the taapi.io API
-            aggregate = self.agg_cli.load_agg()
+            # 2. Poll the due values of the aggregate using bulk queries to the taapi.io API
+            aggregate = self.agg_cli.copy_agg()
             if all(len(v) == 0 for v in aggregate.values()):
-                sleep(0.1)  # To prevent excessive spamming
+                # Nothing to poll - block until technical alerts are added
+                self.aggregate_changed.wait()
                 continue
 
-            for symbol, intervals in aggregate.items():
-                for interval, indicators in intervals.items():
-                    num_indicators += len(indicators)  # For logging
-
-                    # Prepare the bulk query for the API
-                    exclude_keys = ["values", "last_update"]
-                    indicators_query = [
-                        {k: v for k, v in indicator.items() if k not in exclude_keys}
-                        for indicator in indicators
-                    ]
-                    query = {
-                        "secret": self.apikey,
-                        "construct": {
-                            "exchange": DEFAULT_EXCHANGE,
-                            "symbol": symbol,
-                            "interval": interval,
-                            "indicators": indicators_query,
-                        },
-                    }
-                    r = self.call_api(endpoint=BULK_ENDPOINT, params=query)
-                    # print("TAAPI.IO RESPONSE:", r)
-                    try:
-                        responses = r["data"]
-                    except KeyError:
-                        # if "error" in r.keys():
-                        #     logger.warn(f"Taapio error occurred when building aggregate: {r['error']}")
-                        raise Exception(f"Error occurred calling taapi.io API - {r}")
-
-                    # Assign returned values and update aggregate:
-                    for i, response in enumerate(responses):
-                        for output_variable in self.ta_db[
-                            indicators[i]["indicator"].upper()
-                        ]["output"]:
-                            indicators[i]["values"][output_variable] = response[
-                                "result"
-                            ][output_variable]
-                        indicators[i]["last_update"] = int(time())
-
-            # 3. Dump aggregate with updated values so that the alerts client can reference it
+            queries = self.schedule(aggregate)
+            if len(queries) == 0:
+                # Nothing due - block until the next indicator is due or technical alerts are added
+                self.aggregate_changed.wait(
+                    None if self.next_due is None else max(self.next_due - time(), 0)
+                )
+                continue
+
+            for indicators, query in queries:
+                num_indicators += len(indicators)  # For logging
+                num_queries += 1
+                r = self.call_api(endpoint=self.bulk_endpoint, params=query)
+                # print("TAAPI.IO RESPONSE:", r)
+                self.update_indicators(indicators, r)
+
+            # 3. Publish the aggregate with updated values so that the alerts client can reference it
             self.agg_cli.dump_agg(aggregate)
+            self.agg_cli.ta_aggregate.checkpoint()
             # print("End Aggregate:")
             # print(json.dumps(aggregate, indent=2))
 
@@ -351,10 +700,158 @@ class TaapiioProcess:
             if len(previous_rates) > 3:
                 del previous_rates[0]
             logger.info(
-                f"TA Aggregate updated. "
-                f"Average through process rate: {round(sum(previous_rates) / len(previous_rates), 1)} seconds"
+                f"TA Aggregate updated: {num_indicators} due indicators in {num_queries} bulk queries "
+                f"({self.overdue} left overdue). "
+                f"Average through process rate: {round(sum(previous_rates) / len(previous_rates), 1)} seconds "
+                f"(refresh periods: {self.format_refresh_periods()})"
             )
 
+    def schedule(
+        self, aggregate: dict, now: float = None
+    ) -> list[tuple[list[dict], dict]]:
+        """
+        Select the indicators of the aggregate that are due to be refreshed (see next_refresh()), and pack the
+        most overdue ones into the bulk queries allowed by the tier's rate limit for one period.
+
+        Also sets next_due (when the next indicator is due, None if there is none), overdue (the number of due
+        indicators left for the next period) and refresh_periods ({indicator key: seconds between the last two
+        updates of the indicator}) of the refreshed indicators.
+
+        :return: List of tuples: (aggregate indicators updated by the query, bulk query for the API)
+        """
+        now = time() if now is None else now
+        due = []  # (due time, symbol, interval, indicator)
+        self.next_due = None
+        for symbol, intervals in aggregate.items():
+            for interval, indicators in intervals.items():
+                for indicator in indicators:
+                    due_at = next_refresh(interval, indicator.get("last_update", 0))
+                    if due_at <= now:
+                        due.append((due_at, symbol, interval, indicator))
+                    elif self.next_due is None or due_at < self.next_due:
+                        self.next_due = due_at
+
+        queries = self.build_bulk_queries(due, limit=get_ratelimits()[0])
+
+        refreshed = {
+            id(indicator) for indicators, _ in queries for indicator in indicators
+        }
+        self.overdue = len(due) - len(refreshed)
+        for _, symbol, interval, indicator in due:
+            if id(indicator) in refreshed and indicator.get("last_update"):
+                key = indicator_key(symbol, interval, indicator)
+                self.refresh_periods[key] = now - indicator["last_update"]
+        return queries
+
+    def build_bulk_queries(
+        self, due: list[tuple], limit: int = None
+    ) -> list[tuple[list[dict], dict]]:
+        """
+        Pack due indicators into bulk queries within the tier's limits, the most overdue first
+
+        The indicators of each (symbol, interval) become one construct, split in chunks if it has more indicators
+        than a construct allows. The constructs are then packed into queries of at most BULK_QUERY_LIMITS
+        constructs, the most overdue first (and the largest first among equally overdue ones), so that the first
+        queries hold the most overdue indicators. Each indicator is given its position in the query as ID, so that
+        the results of a multi-construct query can be assigned back.
+
+        :param due: Tuples: (due time, symbol, interval, aggregate indicator)
+        :param limit: The maximum number of queries to return (the most overdue ones)
+        :return: List of tuples: (aggregate indicators updated by the query, bulk query for the API)
+        """
+        max_constructs, max_indicators = get_bulk_limits()
+        grouped = {}  # {(symbol, interval): [(due time, indicator)]}
+        for due_at, symbol, interval, indicator in sorted(due, key=lambda d: d[0]):
+            grouped.setdefault((symbol, interval), []).append((due_at, indicator))
+        # (due time of its most overdue indicator, symbol, interval, indicators)
+        constructs = []
+        for (symbol, interval), indicators in grouped.items():
+            for i in range(0, len(indicators), max_indicators):
+                chunk = indicators[i : i + max_indicators]
+                constructs.append(
+                    (chunk[0][0], symbol, interval, [ind for _, ind in chunk])
+                )
+
+        # The indicator limit applies to each construct, so only the number of constructs limits a query
+        constructs.sort(key=lambda c: (c[0], -len(c[3])))
+        bins = [
+            constructs[i : i + max_constructs]
+            for i in range(0, len(constructs), max_constructs)
+        ]
+
+        queries = []
+        exclude_keys = ["values", "last_update"]
+        for packed in bins[:limit]:
+            query_indicators, query_constructs = [], []
+            for _, symbol, interval, indicators in packed:
+                # Prepare the construct for the API
+                indicators_query = []
+                for indicator in indicators:
+                    indicator_query = {
+                        k: v for k, v in indicator.items() if k not in exclude_keys
+                    }
+                    indicator_query["id"] = str(len(query_indicators))
+                    indicators_query.append(indicator_query)
+                    query_indicators.append(indicator)
+                query_constructs.append(
+                    {
+                        "exchange": DEFAULT_EXCHANGE,
+                        "symbol": symbol,
+                        "interval": interval,
+                        "indicators": indicators_query,
+                    }
+                )
+            query = {
+                "secret": self.apikey,
+                # A single construct is sent as an object, as supported by every tier
+                "construct": (
+                    query_constructs[0]
+                    if len(query_constructs) == 1
+                    else query_constructs
+                ),
+            }
+            queries.append((query_indicators, query))
+        return queries
+
+    def format_refresh_periods(self) -> str:
+        """:return: The median and the longest achieved refresh period of the indicators of each interval, for logging"""
+        periods = {}  # {interval: [seconds]}
+        for (_, interval, _, _), seconds in self.refresh_periods.items():
+            periods.setdefault(interval, []).append(seconds)
+        summary = []
+        for interval in INTERVALS:
+            seconds = sorted(periods.get(interval, []))
+            if len(seconds) > 0:
+                summary.append(
+                    f"{interval} {round(seconds[len(seconds) // 2])}s "
+                    f"(max {round(seconds[-1])}s, {len(seconds)} indicators)"
+                )
+        return ", ".join(summary)
+
+    def update_indicators(self, indicators: list[dict], response: dict) -> None:
+        """Assign the values of a bulk query response to the aggregate indicators it was built from"""
+        try:
+            responses = response["data"]
+        except KeyError:
+            # if "error" in r.keys():
+            #     logger.warn(f"Taapio error occurred when building aggregate: {r['error']}")
+            raise Exception(f"Error occurred calling taapi.io API - {response}")
+
+        # Assign returned values and update aggregate:
+        for position, result in enumerate(responses):
+            try:
+                # The ID given by build_bulk_queries()
+                i = int(result["id"])
+            except (KeyError, TypeError, ValueError):
+                i = position
+            for output_variable in self.ta_db[indicators[i]["indicator"].upper()][
+                "output"
+            ]:
+                indicators[i]["values"][output_variable] = result["result"][
+                    output_variable
+                ]
+            indicators[i]["last_update"] = int(time())
+
     def alert_admins(self, message: str) -> None:
         if self.tg_bot_token is None:
             logger.warn(
@@ -362,16 +859,13 @@ class TaapiioProcess:
             )
             return None
 
-        for user in get_whitelist():
-            admin = (
-                LocalUserConfiguration(user).admin_status()
-                if not USE_MONGO_DB
-                else MongoDBUserConfiguration(user).admin_status()
-            )
+        for user in get_users(self.alert_store):
+            admin = get_user_configuration(user, self.alert_store).admin_status()
 
             if admin:
-                requests.post(
+                http_client.post(
                     url=f"https://api.telegram.org/bot{self.tg_bot_token}/sendMessage",
+                    upstream="telegram",
                     params={"chat_id": user, "text": message},
                 )
 
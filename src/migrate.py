@@ -0,0 +1,63 @@
+"""
+Copies the users, channels and alerts of the local JSON or MongoDB backend into the SQLite database.
+
+Usage:
+    python -m src.migrate local [--root WHITELIST_ROOT] [--db SQLITE_DB_PATH]
+    python -m src.migrate mongo [--db SQLITE_DB_PATH]
+
+Then set USE_SQLITE_DB to True in src/config.py. Existing users in the database are replaced.
+"""
+
+import argparse
+import json
+from os import listdir
+from os.path import isdir, join
+
+from .config import WHITELIST_ROOT, SQLITE_DB_PATH
+from .logger import logger
+from .sqlite import SQLiteConnection
+from .user_configuration import SQLiteUserConfiguration
+
+
+def read_local(root: str):
+    """Yield (user_id, config, alerts) for every user directory under the whitelist root"""
+    for user_id in listdir(root):
+        if not isdir(join(root, user_id)):
+            continue
+        with open(join(root, user_id, "config.json"), "r") as infile:
+            config = json.loads(infile.read())
+        with open(join(root, user_id, "alerts.json"), "r") as infile:
+            alerts = json.loads(infile.read())
+        yield user_id, config, alerts
+
+
+def read_mongo():
+    """Yield (user_id, config, alerts) for every user document in the MongoDB collection"""
+    from .mongo import MongoDBConnection
+
+    for document in MongoDBConnection().collection.find():
+        yield document["user_id"], document["config"], document["alerts"]
+
+
+def migrate(users, database: SQLiteConnection) -> int:
+    count = 0
+    for user_id, config, alerts in users:
+        SQLiteUserConfiguration(user_id, database=database).import_user(config, alerts)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate the bot's users to the SQLite backend"
+    )
+    parser.add_argument("source", choices=["local", "mongo"])
+    parser.add_argument(
+        "--root", default=WHITELIST_ROOT, help="Whitelist directory (local source)"
+    )
+    parser.add_argument("--db", default=SQLITE_DB_PATH, help="SQLite database path")
+    args = parser.parse_args()
+
+    users = read_local(args.root) if args.source == "local" else read_mongo()
+    count = migrate(users, SQLiteConnection(args.db))
+    logger.info(f"Migrated {count} users from the {args.source} backend to {args.db}")
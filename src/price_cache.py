@@ -0,0 +1,217 @@
+import json
+import threading
+from collections import OrderedDict
+from time import monotonic
+from urllib.parse import quote
+
+from .config import *
+from .logger import logger
+from .models import BinancePriceResponse
+from .utils import get_binance_price_url, get_binance_bulk_price_url
+from . import http_client
+
+
+class _Flight:
+    """A single in-progress upstream fetch that concurrent callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PriceCache:
+    """
+    Thread-safe TTL cache for Binance tickers, shared by the alert processes and the Telegram bot.
+
+    Entries are keyed by (symbol, window) and evicted least-recently-used once maxsize is reached.
+    Concurrent misses for the same key are coalesced so that only one request is sent upstream.
+    """
+
+    def __init__(
+        self, ttl: float = PRICE_CACHE_TTL, maxsize: int = PRICE_CACHE_MAXSIZE
+    ):
+        """
+        :param ttl: Seconds that a fetched ticker is served from the cache
+        :param maxsize: Maximum number of (symbol, window) entries held in the cache
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.endpoint = get_binance_price_url()
+        self.bulk_endpoint = get_binance_bulk_price_url()
+
+        # {(symbol, window): (expires_at, BinancePriceResponse)}
+        self._entries = OrderedDict()
+        self._flights = {}  # {(symbol, window): _Flight}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0  # Served from the cache
+        self.coalesced = 0  # Waited on another caller's fetch
+        self.misses = 0  # Fetched from upstream
+        self.requests = 0  # HTTP requests sent upstream
+
+    def get(
+        self, symbol: str, window: str = BINANCE_TIMEFRAMES[0]
+    ) -> BinancePriceResponse:
+        """
+        Get the ticker of a token pair, fetching it from Binance if it is not cached
+
+        :param symbol: token pair without the slash (e.g. BTCUSDT)
+        :param window: The time window for the ticker (e.g. 1d for 1 day)
+        """
+        key = (symbol, window)
+        with self._lock:
+            ticker = self._lookup(key)
+            if ticker is not None:
+                self.hits += 1
+                return ticker
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                flight.result = self._fetch(symbol, window)
+                self._store(key, flight.result)
+            except Exception as exc:
+                flight.error = exc
+            finally:
+                self._land(key, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def get_many(
+        self, symbols: set[str], window: str = BINANCE_TIMEFRAMES[0]
+    ) -> dict[str, BinancePriceResponse]:
+        """
+        Get the tickers of many token pairs, fetching the missing ones in batched multi-symbol requests.
+        Requests are chunked to BINANCE_MAX_SYMBOLS_PER_REQUEST symbols each.
+
+        Pairs from a chunk that fails (e.g. due to a single invalid symbol) are left out of the result,
+        so that callers can fall back to get() to surface the error for the individual pair.
+
+        :param symbols: token pairs without the slash (e.g. BTCUSDT)
+        :param window: The time window for the tickers (e.g. 1d for 1 day)
+
+        :return dict: {symbol: BinancePriceResponse}
+        """
+        result, waiting, fetching = {}, {}, {}
+        with self._lock:
+            for symbol in symbols:
+                key = (symbol, window)
+                ticker = self._lookup(key)
+                if ticker is not None:
+                    self.hits += 1
+                    result[symbol] = ticker
+                elif key in self._flights:
+                    self.coalesced += 1
+                    waiting[symbol] = self._flights[key]
+                else:
+                    self.misses += 1
+                    fetching[symbol] = self._flights[key] = _Flight()
+
+        pending = sorted(fetching)
+        for i in range(0, len(pending), BINANCE_MAX_SYMBOLS_PER_REQUEST):
+            chunk = pending[i : i + BINANCE_MAX_SYMBOLS_PER_REQUEST]
+            try:
+                tickers = self._fetch_many(chunk, window)
+            except Exception as exc:
+                logger.warn(
+                    f"Binance batch request for {len(chunk)} pairs failed - Error: {exc}"
+                )
+                tickers = {}
+
+            for symbol in chunk:
+                key, flight = (symbol, window), fetching[symbol]
+                if symbol in tickers:
+                    self._store(key, tickers[symbol])
+                    flight.result = result[symbol] = tickers[symbol]
+                else:
+                    flight.error = ValueError(
+                        f"{symbol} was not returned by the Binance batch request"
+                    )
+                self._land(key, flight)
+
+        for symbol, flight in waiting.items():
+            flight.done.wait()
+            if flight.error is None:
+                result[symbol] = flight.result
+
+        return result
+
+    def put(self, symbol: str, window: str, ticker: BinancePriceResponse) -> None:
+        """Store a ticker that was obtained elsewhere (e.g. from a stream)"""
+        self._store((symbol, window), ticker)
+
+    def stats(self) -> dict:
+        """Get the cache counters, including the number of upstream requests saved"""
+        with self._lock:
+            lookups = self.hits + self.coalesced + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "requests": self.requests,
+                "saved": lookups - self.requests,
+                "hit_rate": (
+                    round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0
+                ),
+            }
+
+    def _lookup(self, key: tuple):
+        """Return the cached ticker if it is still fresh (must hold the lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _store(self, key: tuple, ticker: BinancePriceResponse) -> None:
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, ticker)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _land(self, key: tuple, flight: _Flight) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.done.set()
+
+    def _fetch(self, symbol: str, window: str) -> BinancePriceResponse:
+        with self._lock:
+            self.requests += 1
+        response = http_client.get(
+            self.endpoint.format(symbol, window), upstream="binance"
+        )
+        http_client.raise_for_status(response)
+
+        return BinancePriceResponse(response.json())
+
+    def _fetch_many(
+        self, symbols: list[str], window: str
+    ) -> dict[str, BinancePriceResponse]:
+        with self._lock:
+            self.requests += 1
+        url = self.bulk_endpoint.format(
+            quote(json.dumps(symbols, separators=(",", ":"))), window
+        )
+        response = http_client.get(url, upstream="binance")
+        http_client.raise_for_status(response)
+
+        tickers = [BinancePriceResponse(ticker) for ticker in response.json()]
+        return {ticker.symbol: ticker for ticker in tickers}
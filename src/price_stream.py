@@ -0,0 +1,188 @@
+import json
+import random
+import threading
+
+from .config import *
+from .logger import logger
+from .models import BinancePriceResponse
+from .utils import get_binance_stream_url
+
+import websocket
+
+
+class BinancePriceStream:
+    """
+    Maintains a single Binance WebSocket connection subscribed to the ticker streams of the tracked pairs.
+
+    Pairs are tracked by reference count, so that a pair is subscribed when its first alert is added
+    and unsubscribed when its last alert is cancelled or triggered.
+    The connection is re-established with exponential backoff whenever it drops.
+    """
+
+    def __init__(
+        self, on_tick, url: str = None, stream_type: str = BINANCE_STREAM_TYPE
+    ):
+        """
+        :param on_tick: Callback invoked as on_tick(symbol, BinancePriceResponse) for every stream event
+        :param url: The WebSocket endpoint (defaults to the Binance endpoint for the LOCATION)
+        :param stream_type: Either "miniTicker" or "bookTicker"
+        """
+        assert stream_type in ["miniTicker", "bookTicker"], (
+            f"Invalid Binance stream type ({stream_type}). "
+            f"Must be one of ['miniTicker', 'bookTicker']"
+        )
+        self.on_tick = on_tick
+        self.url = url if url is not None else get_binance_stream_url()
+        self.stream_type = stream_type
+
+        self.refcounts = {}  # {symbol: number of alerts tracking the symbol}
+        self._ws = None
+        self._lock = threading.Lock()
+        self._request_id = 0
+        self._stopped = threading.Event()
+
+    @property
+    def connected(self) -> bool:
+        """Whether the connection is up, i.e. (un)subscribe requests are sent right away"""
+        return self._ws is not None
+
+    def acquire(self, symbol: str, count: int = 1) -> None:
+        """Track a symbol, subscribing to its stream if it was not tracked yet"""
+        with self._lock:
+            self.refcounts[symbol] = self.refcounts.get(symbol, 0) + count
+            if self.refcounts[symbol] == count:
+                self._send("SUBSCRIBE", [symbol])
+
+    def release(self, symbol: str, count: int = 1) -> None:
+        """Stop tracking a symbol, unsubscribing from its stream once nothing tracks it"""
+        with self._lock:
+            if symbol not in self.refcounts:
+                return
+            self.refcounts[symbol] -= count
+            if self.refcounts[symbol] <= 0:
+                del self.refcounts[symbol]
+                self._send("UNSUBSCRIBE", [symbol])
+
+    def sync(self, refcounts: dict[str, int]) -> None:
+        """
+        Reconcile the tracked symbols with a full set of reference counts
+
+        :param refcounts: {symbol: number of alerts tracking the symbol}
+        """
+        with self._lock:
+            current = dict(self.refcounts)
+        for symbol, count in current.items():
+            if refcounts.get(symbol, 0) < count:
+                self.release(symbol, count - refcounts.get(symbol, 0))
+        for symbol, count in refcounts.items():
+            if count > current.get(symbol, 0):
+                self.acquire(symbol, count - current.get(symbol, 0))
+
+    def run(self) -> None:
+        """
+        Connect and dispatch stream events until stop() is called, reconnecting with backoff.
+
+        Should be started in a new daemon thread.
+        """
+        delay = BINANCE_STREAM_BACKOFF[0]
+        while not self._stopped.is_set():
+            try:
+                self._connect()
+                delay = BINANCE_STREAM_BACKOFF[0]  # Reset once a connection succeeds
+                while not self._stopped.is_set():
+                    raw = self._ws.recv()
+                    if not raw:
+                        raise ConnectionError("Connection closed by the server")
+                    self._handle(raw)
+            except Exception as exc:
+                if self._stopped.is_set():
+                    break
+                logger.warn(
+                    f"Binance price stream disconnected - Reconnecting in {delay:.1f} seconds... ({exc})"
+                )
+            finally:
+                self._close()
+
+            self._stopped.wait(delay * random.uniform(0.5, 1))
+            delay = min(delay * 2, BINANCE_STREAM_BACKOFF[1])
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._close()
+
+    def _connect(self) -> None:
+        ws = websocket.create_connection(
+            self.url, timeout=BINANCE_STREAM_TIMEOUT, enable_multithread=True
+        )
+        with self._lock:
+            self._ws = ws
+            symbols = sorted(self.refcounts)
+            # Re-subscribe everything tracked before the connection dropped
+            for i in range(0, len(symbols), BINANCE_STREAM_SUBSCRIBE_CHUNK):
+                self._send("SUBSCRIBE", symbols[i : i + BINANCE_STREAM_SUBSCRIBE_CHUNK])
+        logger.info(f"Binance price stream connected ({len(symbols)} pairs)")
+
+    def _close(self) -> None:
+        with self._lock:
+            ws, self._ws = self._ws, None
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _send(self, method: str, symbols: list[str]) -> None:
+        """Send a (un)subscribe request if connected (must hold the lock)"""
+        if self._ws is None or len(symbols) == 0:
+            return
+        self._request_id += 1
+        try:
+            self._ws.send(
+                json.dumps(
+                    {
+                        "method": method,
+                        "params": [f"{s.lower()}@{self.stream_type}" for s in symbols],
+                        "id": self._request_id,
+                    }
+                )
+            )
+        except Exception as exc:
+            # The reader thread reconnects and re-subscribes all tracked symbols
+            logger.warn(f"Could not send {method} to the Binance price stream - {exc}")
+
+    def _handle(self, raw: str) -> None:
+        message = json.loads(raw)
+        if "result" in message or "s" not in message:
+            if message.get("error"):
+                logger.warn(f"Binance price stream error: {message['error']}")
+            return
+
+        if message.get("e") == "24hrMiniTicker":
+            last, open_ = float(message["c"]), float(message["o"])
+            ticker = BinancePriceResponse(
+                {
+                    "symbol": message["s"],
+                    "lastPrice": last,
+                    "openPrice": open_,
+                    "highPrice": message["h"],
+                    "lowPrice": message["l"],
+                    "volume": message["v"],
+                    "quoteVolume": message["q"],
+                    "priceChange": last - open_,
+                    "priceChangePercent": (
+                        (last - open_) / open_ * 100 if open_ else 0.0
+                    ),
+                    "closeTime": message.get("E", 0),
+                    "window": "1d",
+                }
+            )
+        else:
+            # bookTicker events only carry the best bid and ask, so the mid price is used
+            ticker = BinancePriceResponse(
+                {
+                    "symbol": message["s"],
+                    "lastPrice": (float(message["b"]) + float(message["a"])) / 2,
+                }
+            )
+
+        self.on_tick(message["s"], ticker)
@@ -0,0 +1,198 @@
+import asyncio
+import random
+import threading
+from time import monotonic, sleep
+
+from .config import *
+from .logger import logger
+
+import requests
+
+
+class PermanentError(requests.HTTPError):
+    """An upstream rejected the request in a way that retrying cannot fix (e.g. HTTP 400 for an invalid symbol)"""
+
+
+class CircuitOpenError(ConnectionError):
+    """The upstream is considered down and calls fail fast until its circuit half-opens"""
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(
+        self,
+        attempts: int = RETRY_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+    ):
+        """
+        :param attempts: Total number of attempts, including the first one
+        :param base_delay: Upper bound of the first delay (in seconds), doubled on each retry
+        :param max_delay: Upper bound of any delay (in seconds)
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delays(self) -> list[float]:
+        """The delays to sleep before each retry"""
+        return [
+            random.uniform(0, min(self.max_delay, self.base_delay * 2**i))
+            for i in range(self.attempts - 1)
+        ]
+
+
+class RetryBudget:
+    """
+    Caps the number of retries across all callers of an upstream within a period (e.g. a polling cycle),
+    so that a widespread failure does not multiply the load on the upstream or stall the cycle.
+    """
+
+    def __init__(
+        self, retries: int = RETRY_BUDGET, period: float = RETRY_BUDGET_PERIOD
+    ):
+        self.retries = retries
+        self.period = period
+        self._remaining = retries
+        self._window_start = monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        """:return: True if a retry may be attempted"""
+        with self._lock:
+            if monotonic() - self._window_start >= self.period:
+                self._remaining, self._window_start = self.retries, monotonic()
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, failing calls fast for `reset_timeout` seconds.
+    Then a single trial call is let through (half-open) which either closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """:return: True if a call may be sent to the upstream"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if (
+                self.state == "open"
+                and monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                self.state = "half-open"
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"{self.name} circuit closed")
+            self.state, self._failures = "closed", 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half-open" or (
+                self.state == "closed" and self._failures >= self.failure_threshold
+            ):
+                if self.state == "closed":
+                    logger.warn(
+                        f"{self.name} circuit opened after {self._failures} consecutive failures"
+                    )
+                self.state, self._opened_at = "open", monotonic()
+
+
+class Upstream:
+    """Retry policy, retry budget and circuit breaker of a single upstream service"""
+
+    def __init__(
+        self,
+        name: str,
+        policy: RetryPolicy = None,
+        budget: RetryBudget = None,
+        breaker: CircuitBreaker = None,
+    ):
+        self.name = name
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.budget = budget if budget is not None else RetryBudget()
+        self.breaker = breaker if breaker is not None else CircuitBreaker(name)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func, retrying it with backoff while the retry budget lasts.
+        PermanentError is raised immediately, and CircuitOpenError is raised without calling func while the circuit is open.
+        """
+        delays = self.policy.delays()
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"{self.name} is unavailable - failing fast until its circuit half-opens"
+                )
+            try:
+                result = func(*args, **kwargs)
+            except PermanentError:
+                self.breaker.record_success()  # The upstream is up, the request is invalid
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                if len(delays) == 0 or not self.budget.take():
+                    raise
+                sleep(delays.pop(0))
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """Like call(), for a coroutine function (e.g. a request of the asyncio engine) - sleeps without blocking the loop"""
+        delays = self.policy.delays()
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"{self.name} is unavailable - failing fast until its circuit half-opens"
+                )
+            try:
+                result = await func(*args, **kwargs)
+            except PermanentError:
+                self.breaker.record_success()  # The upstream is up, the request is invalid
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                if len(delays) == 0 or not self.budget.take():
+                    raise
+                await asyncio.sleep(delays.pop(0))
+                continue
+
+            self.breaker.record_success()
+            return result
+
+
+_upstreams = {}
+_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """Get the shared Upstream of a service (e.g. "binance", "taapiio", "telegram"), creating it on first use"""
+    with _lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name)
+        return _upstreams[name]
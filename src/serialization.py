@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import threading
+from hashlib import blake2b
+
+try:
+    import orjson
+except ImportError:  # orjson is optional - the stdlib codec is used without it
+    orjson = None
+
+_written = {}  # {path: (digest, st_mtime_ns) of the last write}
+_lock = threading.Lock()
+
+# The process umask, read once as it can only be read by changing it
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def dumps(data) -> bytes:
+    """Serialize to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def loads(raw):
+    """Deserialize JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def read_json(path: str):
+    with open(path, "rb") as infile:
+        return loads(infile.read())
+
+
+def write_json(path: str, data) -> bool:
+    """
+    Atomically replace a JSON file: readers see either the previous or the new contents, never a partial write.
+    The file keeps its permissions, and a new file is created with the default ones (as with open()).
+
+    The write is skipped if the content is unchanged since the last write through this function
+    and the file was not modified in between.
+
+    :return: True if the file was written
+    """
+    raw = dumps(data)
+    digest = blake2b(raw, digest_size=16).digest()
+    try:
+        stat = os.stat(path)
+        mtime, mode = stat.st_mtime_ns, stat.st_mode & 0o7777
+    except FileNotFoundError:
+        # The mode that open() would create the file with
+        mtime, mode = None, 0o666 & ~_umask
+    with _lock:
+        if mtime is not None and _written.get(path) == (digest, mtime):
+            return False
+
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        # mkstemp creates the file with mode 0600, which would replace the file's permissions
+        os.chmod(temp_path, mode)
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(raw)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    with _lock:
+        _written[path] = (digest, os.stat(path).st_mtime_ns)
+    return True
@@ -1,9 +1,9 @@
 import os
 import json
 
-from .user_configuration import LocalUserConfiguration, MongoDBUserConfiguration
+from .user_configuration import BaseConfig
 from .logger import logger
-from .config import USE_MONGO_DB, AGG_DATA_LOCATION
+from .config import AGG_DATA_LOCATION
 
 
 def do_setup():
@@ -15,10 +15,7 @@ def do_setup():
             f"Creating default bot configuration for Telegram user {user_id}..."
         )
 
-        if not USE_MONGO_DB:
-            LocalUserConfiguration(user_id).whitelist_user(is_admin=True)
-        else:
-            MongoDBUserConfiguration(user_id).whitelist_user(is_admin=True)
+        BaseConfig(user_id).whitelist_user(is_admin=True)
 
         # Create empty aggregate as placeholder if it doesn't already exist:
         if not os.path.isdir(os.path.dirname(AGG_DATA_LOCATION)):
@@ -0,0 +1,462 @@
+"""
+Sharded alert evaluation across worker processes.
+
+Users are partitioned by a stable hash of their ID across N worker processes, so that alert evaluation is not
+bound to a single interpreter's GIL. The coordinator (in the bot's process) fetches the Binance prices and loads
+the TA aggregate once per cycle and publishes them to every worker through a shared memory snapshot. Each worker
+evaluates its own users against the snapshot and sends the triggered alerts back to the coordinator, which
+delivers them through the bot's single DeliveryQueue.
+
+Workers read and write the user configuration backend directly (the AlertStore is not used in this mode), and
+receive the alert & whitelist changes made in the bot's process as forwarded events. In turn, the alerts that
+the workers trigger or remove are published on the bot's bus along with their results.
+"""
+
+import multiprocessing
+import struct
+import threading
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from queue import Empty
+from time import monotonic, sleep
+
+from .config import *
+from .alert_processes import CEXAlertProcess, TechnicalAlertProcess
+from .alert_store import load_all_alerts
+from .delivery import DeliveryQueue
+from . import events
+from .events import (
+    EventBus,
+    ALERT_EVENTS,
+    ALERT_REMOVED,
+    ALERT_TRIGGERED,
+    USER_WHITELISTED,
+    USER_REMOVED,
+)
+from .indicators import TAAggregateClient, TaapiioProcess, index_aggregate
+from .logger import logger
+from .models import BinancePriceResponse
+from .price_cache import PriceCache
+from .serialization import dumps, loads
+from .trigger_store import TriggerStore
+
+
+def shard_of(user_id: str, shards: int) -> int:
+    """The shard of a user - crc32 is used instead of hash() as it is stable across processes"""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+class SharedSnapshot:
+    """
+    A JSON document published by a single writer process and read by others through a shared memory block.
+
+    The header holds a sequence number and the payload length. The sequence is odd while a write is in progress,
+    so that readers detect and retry torn reads instead of locking out the writer (seqlock).
+    """
+
+    _HEADER = struct.Struct("<QQ")  # (sequence, payload length)
+
+    def __init__(self, name: str = None, size: int = SHARD_SNAPSHOT_SIZE):
+        """
+        :param name: Name of an existing block to attach to, or None to create one
+        :param size: Size of the block to create (in bytes)
+        """
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self._HEADER.pack_into(self.memory.buf, 0, 0, 0)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.sequence = 0
+
+    def publish(self, data) -> int:
+        """
+        Replace the snapshot (must only be called by the owner)
+
+        :return: The sequence number of the new snapshot
+        """
+        raw = dumps(data)
+        if self._HEADER.size + len(raw) > self.memory.size:
+            raise OverflowError(
+                f"Snapshot of {len(raw)} bytes exceeds the shared memory block ({self.memory.size} bytes) - "
+                f"increase SHARD_SNAPSHOT_SIZE"
+            )
+        buf = self.memory.buf
+        self.sequence += 1
+        self._HEADER.pack_into(buf, 0, self.sequence, len(raw))
+        buf[self._HEADER.size : self._HEADER.size + len(raw)] = raw
+        self.sequence += 1
+        self._HEADER.pack_into(buf, 0, self.sequence, len(raw))
+        return self.sequence
+
+    def read(self) -> tuple[int, object]:
+        """:return: Tuple: (sequence number, data) of the latest complete snapshot"""
+        buf = self.memory.buf
+        while True:
+            sequence, length = self._HEADER.unpack_from(buf, 0)
+            if sequence % 2 == 1:
+                sleep(0.001)
+                continue
+            raw = bytes(buf[self._HEADER.size : self._HEADER.size + length])
+            if self._HEADER.unpack_from(buf, 0)[0] == sequence:
+                return sequence, loads(raw) if length > 0 else None
+
+    def close(self) -> None:
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class _ResultDelivery:
+    """
+    Stands in for the DeliveryQueue of the alert processes in a worker: the alerts are collected and sent back
+    to the coordinator, which delivers them and logs the failed chats.
+    """
+
+    def __init__(self):
+        self.posts = []  # [(chat_ids, text, send_message kwargs)]
+
+    def broadcast(self, chat_ids: list[str], text: str, **kwargs) -> Future:
+        self.posts.append((list(chat_ids), text, kwargs))
+        status = Future()
+        status.set_result((list(chat_ids), []))
+        return status
+
+    @contextmanager
+    def cycle(self):
+        # The coordinator delivers the alerts of a cycle together
+        yield
+
+    def take(self) -> list[tuple]:
+        posts, self.posts = self.posts, []
+        return posts
+
+
+class _SnapshotAggregateClient(TAAggregateClient):
+    """Serves the TA aggregate from the coordinator's snapshot instead of the in-memory aggregate"""
+
+    def __init__(self):
+        super().__init__()
+        self.aggregate = {}
+        # (aggregate, {indicator key: entry}) of the last indexed aggregate
+        self._index = (None, {})
+
+    def load_agg(self) -> dict:
+        return self.aggregate
+
+    def index(self) -> dict:
+        """OVERRIDES SUPER - Index the snapshot's aggregate once per cycle"""
+        indexed, index = self._index
+        if indexed is not self.aggregate:
+            index = index_aggregate(self.aggregate)
+            self._index = (self.aggregate, index)
+        return index
+
+
+class ShardWorker:
+    """Evaluates the alerts of the users of one shard - runs in its own process"""
+
+    def __init__(
+        self,
+        shard: int,
+        shards: int,
+        snapshot_name: str,
+        tasks: multiprocessing.Queue,
+        results: multiprocessing.Queue,
+        technical: bool,
+    ):
+        """
+        :param shard: The shard of this worker (0 to shards - 1)
+        :param shards: The total number of shards
+        :param snapshot_name: Name of the coordinator's shared memory snapshot
+        :param tasks: Queue of ("cycle", sequence) and ("event", event, payload) messages from the coordinator,
+                      or None to stop
+        :param results: Queue of (shard, sequence, posts, (price symbols, change symbols), [(event, payload)])
+                        messages to the coordinator, with the alert events published by the worker's cycle
+        :param technical: Evaluate technical alerts too
+        """
+        self.shard = shard
+        self.shards = shards
+        self.snapshot_name = snapshot_name
+        self.tasks = tasks
+        self.results = results
+        self.technical = technical
+
+    def run(self) -> None:
+        snapshot = SharedSnapshot(name=self.snapshot_name)
+        delivery = _ResultDelivery()
+        # The trigger states are keyed by user in a database shared by the workers, so they follow the users
+        # whatever the number of shards
+        trigger_store = TriggerStore()
+        threading.Thread(target=trigger_store.run, daemon=True).start()
+        cex = CEXAlertProcess(
+            telegram_bot=None, delivery_queue=delivery, trigger_store=trigger_store
+        )
+        technical = None
+        if self.technical:
+            technical = TechnicalAlertProcess(
+                telegram_bot=None,
+                delivery_queue=delivery,
+                trigger_store=trigger_store,
+            )
+            technical.ta_agg_cli = _SnapshotAggregateClient()
+
+        # Triggered & removed alerts, sent back to the coordinator to update its TA aggregate
+        published = []
+        for event in (ALERT_TRIGGERED, ALERT_REMOVED):
+            events.event_bus.subscribe(
+                event,
+                lambda event=event, **payload: published.append((event, payload)),
+            )
+
+        alerts_by_user = {
+            user: alerts
+            for user, alerts in load_all_alerts().items()
+            if shard_of(user, self.shards) == self.shard
+        }
+        cex.build_index(alerts_by_user)
+        if technical is not None:
+            technical.load_technical_pairs(alerts_by_user)
+        logger.info(f"Shard worker {self.shard} loaded {len(alerts_by_user)} users")
+        self.results.put((self.shard, 0, [], cex.get_snapshot_symbols(), []))
+
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+                if task[0] == "event":
+                    events.event_bus.publish(task[1], **task[2])
+                    continue
+
+                published.clear()  # Only the events of this cycle are sent back
+                try:
+                    _, data = snapshot.read()
+                    cex.snapshot = {
+                        window: {
+                            symbol: BinancePriceResponse(ticker)
+                            for symbol, ticker in tickers.items()
+                        }
+                        for window, tickers in data["prices"].items()
+                    }
+                    cex.evaluate_snapshot()
+                    if technical is not None:
+                        technical.ta_agg_cli.aggregate = data.get("aggregate", {})
+                        technical.poll_all_alerts()
+                except Exception as exc:
+                    logger.exception(
+                        f"An error has occurred in shard worker {self.shard}",
+                        exc_info=exc,
+                    )
+                self.results.put(
+                    (
+                        self.shard,
+                        task[1],
+                        delivery.take(),
+                        cex.get_snapshot_symbols(),
+                        published[:],
+                    )
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            snapshot.close()
+            trigger_store.close()
+
+
+def run_worker(*args) -> None:
+    """Entry point of a worker process (see ShardWorker)"""
+    ShardWorker(*args).run()
+
+
+class ShardCoordinator:
+    """Runs the shard workers, publishes a price & TA aggregate snapshot to them each cycle and delivers their alerts"""
+
+    def __init__(
+        self,
+        shards: int,
+        delivery_queue: DeliveryQueue,
+        price_cache: PriceCache = None,
+        taapiio_process: TaapiioProcess = None,
+        event_bus: EventBus = None,
+    ):
+        """
+        :param shards: The number of worker processes
+        :param delivery_queue: The Telegram delivery queue to send the triggered alerts with
+        :param price_cache: The Binance price cache shared with the Telegram bot
+        :param taapiio_process: The Taapi.io process refreshing the TA aggregate, or None to skip technical alerts
+        :param event_bus: The bus that the Telegram bot and the user configurations publish alert changes to
+        """
+        self.shards = shards
+        self.delivery_queue = delivery_queue
+        self.price_cache = price_cache if price_cache is not None else PriceCache()
+        self.taapiio_process = taapiio_process
+        self.event_bus = event_bus if event_bus is not None else events.event_bus
+
+        # Workers are spawned rather than forked, as the bot's process runs several threads
+        self._context = multiprocessing.get_context("spawn")
+        self.snapshot = None
+        self.results = None
+        self.tasks = [None] * shards
+        self.processes = [None] * shards
+        # {shard: (price symbols, change symbols)} reported by the workers
+        self.symbols = {}
+        self._handlers = []  # [(event, handler)] subscribed to the bus
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start the workers and wait until they have loaded their users"""
+        self.snapshot = SharedSnapshot()
+        self.results = self._context.Queue()
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+        for event in ALERT_EVENTS + (USER_WHITELISTED, USER_REMOVED):
+            handler = self._forward(event)
+            self.event_bus.subscribe(event, handler)
+            self._handlers.append((event, handler))
+
+        self.collect(0, SHARD_STARTUP_TIMEOUT)
+
+    def run(self) -> None:
+        """
+        Start the workers and run a cycle every CEX_POLLING_PERIOD seconds until close() is called.
+
+        Should be started in a new daemon thread.
+        """
+        self.start()
+        logger.warn(f"{type(self).__name__} started with {self.shards} shards")
+        while not self._stopped.is_set():
+            start = monotonic()
+            try:
+                self.cycle()
+            except Exception as exc:
+                logger.exception(
+                    "An error has occurred in the sharded alert cycle", exc_info=exc
+                )
+            self._stopped.wait(max(0.0, CEX_POLLING_PERIOD - (monotonic() - start)))
+
+    def cycle(self) -> None:
+        """Publish a new snapshot, let every worker evaluate it and deliver the triggered alerts"""
+        for shard, process in enumerate(self.processes):
+            if not process.is_alive():
+                logger.critical(
+                    f"Shard worker {shard} exited with code {process.exitcode} - restarting it"
+                )
+                self._spawn(shard)
+
+        price_symbols, change_symbols = set(), set()
+        for prices, changes in self.symbols.values():
+            price_symbols.update(prices)
+            change_symbols.update(changes)
+
+        tickers = {
+            BINANCE_TIMEFRAMES[0]: self.price_cache.get_many(
+                price_symbols, window=BINANCE_TIMEFRAMES[0]
+            ),
+            "1d": self.price_cache.get_many(change_symbols, window="1d"),
+        }
+        data = {
+            "prices": {
+                window: {symbol: ticker.to_dict() for symbol, ticker in prices.items()}
+                for window, prices in tickers.items()
+            }
+        }
+        if self.taapiio_process is not None:
+            data["aggregate"] = self.taapiio_process.agg_cli.load_agg()
+
+        sequence = self.snapshot.publish(data)
+        for tasks in self.tasks:
+            tasks.put(("cycle", sequence))
+        self.collect(sequence, CEX_POLLING_PERIOD)
+
+    def collect(self, sequence: int, timeout: float) -> None:
+        """
+        Deliver the workers' alerts until every worker has finished the cycle, or the timeout expires.
+        Alerts of a late worker are delivered during the next cycle.
+
+        The alert events published by the workers are published again on the bus (e.g. for the Taapi.io process
+        to drop the indicators of the removed alerts), but not forwarded back to the workers.
+        """
+        pending = set(range(self.shards))
+        deadline = monotonic() + timeout
+        # The alerts of every worker are sent together, in one message per chat
+        with self.delivery_queue.cycle():
+            while len(pending) > 0:
+                try:
+                    shard, done, posts, symbols, published = self.results.get(
+                        timeout=max(0.0, deadline - monotonic())
+                    )
+                except Empty:
+                    logger.warn(
+                        f"Shard workers {sorted(pending)} did not finish cycle {sequence} within {timeout} seconds"
+                    )
+                    return
+
+                self.symbols[shard] = symbols
+                for chat_ids, text, kwargs in posts:
+                    self.deliver(chat_ids, text, **kwargs)
+                for event, payload in published:
+                    self.event_bus.publish(event, origin_shard=shard, **payload)
+                if done >= sequence:
+                    pending.discard(shard)
+
+    def deliver(self, chat_ids: list[str], text: str, **kwargs) -> None:
+        status = self.delivery_queue.broadcast(chat_ids, text, **kwargs)
+
+        def on_done(future):
+            failed = future.result()[1]
+            if len(failed) > 0:
+                logger.warn(
+                    f"Failed to send Telegram alert ({text}) to the following IDs: {failed}"
+                )
+
+        status.add_done_callback(on_done)
+
+    def close(self, timeout: float = 5) -> None:
+        """Stop the workers and release the shared memory snapshot"""
+        self._stopped.set()
+        for event, handler in self._handlers:
+            self.event_bus.unsubscribe(event, handler)
+        for tasks in self.tasks:
+            if tasks is not None:
+                tasks.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+    def _spawn(self, shard: int) -> None:
+        self.tasks[shard] = self._context.Queue()
+        self.processes[shard] = self._context.Process(
+            target=run_worker,
+            args=(
+                shard,
+                self.shards,
+                self.snapshot.name,
+                self.tasks[shard],
+                self.results,
+                self.taapiio_process is not None,
+            ),
+            name=f"shard-{shard}",
+            daemon=True,
+        )
+        self.processes[shard].start()
+
+    def _forward(self, event: str):
+        """Make a bus handler forwarding the event to the worker of the user's shard"""
+
+        def handler(origin_shard: int = None, **payload):
+            if origin_shard is not None:
+                return  # Published by the worker itself (see collect())
+            shard = shard_of(payload["user_id"], self.shards)
+            self.tasks[shard].put(("event", event, payload))
+
+        return handler
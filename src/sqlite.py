@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    settings TEXT NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS channels (
+    user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    channel_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, position)
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    pair TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    indicator TEXT NOT NULL,
+    comparison TEXT,
+    target REAL,
+    definition TEXT NOT NULL,
+    cooldown_seconds INTEGER,
+    -- As of the alert's definition, only read when the TriggerStore has no state for the alert
+    last_triggered INTEGER NOT NULL DEFAULT 0
+);
+DROP INDEX IF EXISTS alerts_pair_type;
+CREATE UNIQUE INDEX IF NOT EXISTS alerts_user_pair ON alerts (user_id, pair, position);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('whitelist_version', 0);
+CREATE TRIGGER IF NOT EXISTS users_insert AFTER INSERT ON users BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'whitelist_version';
+END;
+CREATE TRIGGER IF NOT EXISTS users_delete AFTER DELETE ON users BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'whitelist_version';
+END;
+CREATE TRIGGER IF NOT EXISTS alerts_insert AFTER INSERT ON alerts BEGIN
+    UPDATE users SET version = version + 1 WHERE user_id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS alerts_update AFTER UPDATE ON alerts BEGIN
+    UPDATE users SET version = version + 1 WHERE user_id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS alerts_delete AFTER DELETE ON alerts BEGIN
+    UPDATE users SET version = version + 1 WHERE user_id = OLD.user_id;
+END;
+"""
+
+
+class SQLiteConnection:
+    """
+    Thread-local connections to the SQLite database in WAL mode, so that the polling threads can read
+    while the Telegram bot writes.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the database file (created with the schema if it does not exist)
+        """
+        self.path = path
+        self._local = threading.local()
+        connection = self.connection()
+        columns = [
+            row["name"] for row in connection.execute("PRAGMA table_info(users)")
+        ]
+        if len(columns) > 0 and "version" not in columns:
+            # Databases created before users had a version
+            connection.execute(
+                "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        connection.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def whitelist_version(self) -> int:
+        """Counter incremented whenever a user is added or removed, by any process"""
+        return (
+            self.connection()
+            .execute("SELECT value FROM meta WHERE key = 'whitelist_version'")
+            .fetchone()[0]
+        )
@@ -1,36 +1,47 @@
+import threading
 import time
 from datetime import datetime
 from typing import Union
 from os import getenv
 
 from .logger import logger
-from .user_configuration import (
-    LocalUserConfiguration,
-    MongoDBUserConfiguration,
-    get_whitelist,
-)
+from .user_configuration import get_whitelist, is_whitelisted
+from .alert_store import AlertStore, get_user_configuration
+from . import events
+from .events import EventBus, ALERT_ADDED, ALERT_REMOVED
 from .utils import (
     get_logfile,
     get_help_command,
     get_commands,
-    get_binance_price_url,
     parse_trigger_cooldown,
 )
 from .config import *
 from .indicators import TADatabaseClient, TaapiioProcess
 from .models import TechnicalAlert, CEXAlert
+from .price_cache import PriceCache
 
-from telebot import TeleBot, types
+from telebot import TeleBot, types, apihelper
 import requests
 from requests.exceptions import ReadTimeout
 
-BaseConfig = LocalUserConfiguration if not USE_MONGO_DB else MongoDBUserConfiguration
-
 
 class TelegramBot(TeleBot):
-    def __init__(self, bot_token: str, taapiio_process: TaapiioProcess = None):
+    def __init__(
+        self,
+        bot_token: str,
+        taapiio_process: TaapiioProcess = None,
+        price_cache: PriceCache = None,
+        alert_store: AlertStore = None,
+        event_bus: EventBus = None,
+    ):
+        # pyTelegramBotAPI already keeps a pooled session per thread, it only needs a connect timeout
+        apihelper.CONNECT_TIMEOUT = HTTP_CONNECT_TIMEOUT
         super().__init__(token=bot_token)
-        self.binance_price_endpoint = get_binance_price_url()
+        # Optional resident store for user alerts & configuration
+        self.alert_store = alert_store
+        self.price_cache = price_cache if price_cache is not None else PriceCache()
+        # Notified of alert changes
+        self.event_bus = event_bus if event_bus is not None else events.event_bus
         self.taapiio_cli = None
         self.indicators_ref_cli = TADatabaseClient()
         self.indicators_db = self.indicators_ref_cli.fetch_ref()
@@ -40,14 +51,10 @@ class TelegramBot(TeleBot):
             )
         else:
             self.taapiio_cli = taapiio_process
+        self._stopped = threading.Event()  # Set by stop() to end run()
 
-        # Set the bot commands:
-        logger.info("Setting bot commands ...")
-        user_commands = [
-            types.BotCommand(command=command, description=description)
-            for command, description in get_commands().items()
-        ]
-        self.set_my_commands(user_commands)
+        # Set the bot commands in the background, so that startup does not wait on the Telegram API:
+        threading.Thread(target=self.set_commands, daemon=True).start()
 
         @self.message_handler(commands=["id"])
         def on_id(message):
@@ -159,7 +166,7 @@ class TelegramBot(TeleBot):
                 return
 
             try:
-                configuration = BaseConfig(str(message.from_user.id))
+                configuration = self.get_configuration(str(message.from_user.id))
                 alerts_db = configuration.load_alerts()
 
                 if MAX_ALERTS_PER_USER is not None:
@@ -217,11 +224,26 @@ class TelegramBot(TeleBot):
                         "trigger": trigger,
                     }
 
-                if pair in alerts_db.keys():
-                    alerts_db[pair].append(alert)
-                else:
-                    alerts_db[pair] = [alert]
-                configuration.update_alerts(alerts_db)
+                def add_alert(alerts_db):
+                    # Re-checked against the current alerts, which may have changed since they were loaded
+                    if MAX_ALERTS_PER_USER is not None and (
+                        sum(len(alerts) for alerts in alerts_db.values())
+                        >= MAX_ALERTS_PER_USER
+                    ):
+                        raise OverflowError(
+                            f"Maximum active alerts reached ({MAX_ALERTS_PER_USER})"
+                        )
+                    alerts_db.setdefault(pair, []).append(alert)
+                    return list(alerts_db[pair])
+
+                pair_alerts = configuration.modify_alerts(add_alert)
+                self.event_bus.publish(
+                    ALERT_ADDED,
+                    user_id=str(message.from_user.id),
+                    pair=pair,
+                    alert=alert,
+                    alerts=pair_alerts,
+                )
                 self.reply_to(message, f"Successfully activated new alert!")
             except Exception as exc:
                 self.reply_to(message, f"An error occurred:\n{exc}")
@@ -244,14 +266,26 @@ class TelegramBot(TeleBot):
                 return
 
             try:
-                configuration = BaseConfig(str(message.from_user.id))
-                alerts_db = configuration.load_alerts()
-                rm_alert = alerts_db[pair].pop(alert_index - 1)
-                all_rm = False
-                if len(alerts_db[pair]) == 0:
-                    rm_pair = alerts_db.pop(pair)
-                    all_rm = True
-                configuration.update_alerts(alerts_db)
+                configuration = self.get_configuration(str(message.from_user.id))
+
+                def cancel_alert(alerts_db):
+                    rm_alert = alerts_db[pair].pop(alert_index - 1)
+                    all_rm = False
+                    if len(alerts_db[pair]) == 0:
+                        rm_pair = alerts_db.pop(pair)
+                        all_rm = True
+                    return rm_alert, all_rm, list(alerts_db.get(pair, []))
+
+                rm_alert, all_rm, pair_alerts = configuration.modify_alerts(
+                    cancel_alert
+                )
+                self.event_bus.publish(
+                    ALERT_REMOVED,
+                    user_id=str(message.from_user.id),
+                    pair=pair,
+                    alert=rm_alert,
+                    alerts=pair_alerts,
+                )
                 self.reply_to(
                     message,
                     f"Successfully Canceled {pair} Alert:\n"
@@ -272,7 +306,7 @@ class TelegramBot(TeleBot):
             except IndexError:
                 alerts_pair = "ALL"
 
-            configuration = BaseConfig(str(message.from_user.id))
+            configuration = self.get_configuration(str(message.from_user.id))
             alerts_db = configuration.load_alerts()
             output = ""
             for ticker in alerts_db.keys():
@@ -360,12 +394,16 @@ class TelegramBot(TeleBot):
         @self.is_whitelisted
         def on_price_all(message):
             """/price_all - Gets the price of all tokens with alerts set"""
-            configuration = BaseConfig(str(message.from_user.id))
-            tokens = [
-                f'{key}: {self.get_latest_binance_price(key.replace("/", "").upper())}'
-                for key in configuration.load_alerts().keys()
-            ]
+            configuration = self.get_configuration(str(message.from_user.id))
+            pairs = list(configuration.load_alerts().keys())
             try:
+                # Warm the price cache with a single batched request for all pairs
+                self.price_cache.get_many(
+                    {pair.replace("/", "").upper() for pair in pairs}
+                )
+                tokens = [
+                    f"{pair}: {self.get_latest_binance_price(pair)}" for pair in pairs
+                ]
                 self.reply_to(message, "\n".join(tokens))
             except Exception as exc:
                 self.reply_to(message, f"Error: {str(exc)}")
@@ -408,7 +446,7 @@ class TelegramBot(TeleBot):
         def on_view_config(message):
             """Returns the current configuration of the bot (used as reference for /set_config)"""
             try:
-                configuration = BaseConfig(str(message.from_user.id))
+                configuration = self.get_configuration(str(message.from_user.id))
                 config = configuration.load_config()["settings"]
                 msg = f"{message.from_user.username} {self.get_me().first_name} Configuration:\n\n"
                 for k, v in config.items():
@@ -425,41 +463,45 @@ class TelegramBot(TeleBot):
         @self.is_whitelisted
         def on_set_config(message):
             """Used to change configuration variables of the bot"""
-            msg = ""
-            failed = []
             user_id = str(message.from_user.id)
-            configuration = BaseConfig(user_id)
-            full_config = configuration.load_config()
+            configuration = self.get_configuration(user_id)
             try:
-                config = full_config["settings"]
-                for change in self.split_message(message.text):
-                    try:
-                        conf, val = change.split("=")
-
-                        # Account for bool case:
-                        if val.lower() == "true" or val.lower() == "false":
-                            val = val.lower() == "true"
 
+                def set_config(full_config):
+                    # Rebuilt on every call, as the update may be re-applied after a concurrent write
+                    msg = ""
+                    failed = []
+                    config = full_config["settings"]
+                    for change in self.split_message(message.text):
                         try:
-                            var_type = type(config[conf])
-                        except KeyError:
-                            raise KeyError(
-                                f"{conf} does not match any available config settings in database."
-                            )
+                            conf, val = change.split("=")
 
-                        # Attempt to push the config update to the database:
-                        config[conf] = var_type(val)
+                            # Account for bool case:
+                            if val.lower() == "true" or val.lower() == "false":
+                                val = val.lower() == "true"
 
-                        msg += f"{conf} set to {val}\n"
-                        logger.info(f"{user_id}: {conf} set to {val} ({var_type})\n")
-                    except Exception as exc:
-                        failed.append((change, str(exc)))
-                        continue
+                            try:
+                                var_type = type(config[conf])
+                            except KeyError:
+                                raise KeyError(
+                                    f"{conf} does not match any available config settings in database."
+                                )
+
+                            # Attempt to push the config update to the database:
+                            config[conf] = var_type(val)
+
+                            msg += f"{conf} set to {val}\n"
+                        except Exception as exc:
+                            failed.append((change, str(exc)))
+                            continue
 
-                full_config["settings"] = config
-                configuration.update_config(full_config)
+                    full_config["settings"] = config
+                    return msg, failed
+
+                msg, failed = configuration.modify_config(set_config)
 
                 if len(msg) > 0:
+                    logger.info(f"{user_id}: {msg.strip()}")
                     self.reply_to(message, "Successfully set configuration:\n\n" + msg)
 
                 if len(failed) > 0:
@@ -476,7 +518,7 @@ class TelegramBot(TeleBot):
         def on_channels(message):
             splt_msg = self.split_message(message.text)
             try:
-                configuration = BaseConfig(str(message.from_user.id))
+                configuration = self.get_configuration(str(message.from_user.id))
                 if splt_msg[0].lower() == "add":
                     new_channels = splt_msg[1].split(",")
                     configuration.add_channels(new_channels)
@@ -528,12 +570,12 @@ class TelegramBot(TeleBot):
                 if splt_msg[0].lower() == "add":
                     new_users = splt_msg[1].split(",")
                     for user in new_users:
-                        BaseConfig(user).whitelist_user()
+                        self.get_configuration(user).whitelist_user()
                     self.reply_to(message, f"Whitelisted Users: {', '.join(new_users)}")
                 elif splt_msg[0].lower() == "remove":
                     rm_users = splt_msg[1].split(",")
                     for user in rm_users:
-                        BaseConfig(user).blacklist_user()
+                        self.get_configuration(user).blacklist_user()
                     self.reply_to(
                         message, f"Removed Users from Whitelist: {', '.join(rm_users)}"
                     )
@@ -582,7 +624,9 @@ class TelegramBot(TeleBot):
                     for i, new_admin in enumerate(new_admins):
                         try:
                             if new_admin in whitelist:
-                                BaseConfig(new_admin).admin_status(new_value=True)
+                                self.get_configuration(new_admin).admin_status(
+                                    new_value=True
+                                )
                             else:
                                 failure_msgs.append(
                                     f"{new_admins.pop(i)} - User is not yet whitelisted"
@@ -603,7 +647,9 @@ class TelegramBot(TeleBot):
                     for i, admin in enumerate(rm_admins):
                         try:
                             if admin in whitelist:
-                                BaseConfig(admin).admin_status(new_value=False)
+                                self.get_configuration(admin).admin_status(
+                                    new_value=False
+                                )
                             else:
                                 failure_msgs.append(
                                     f"{rm_admins.pop(i)} - User is not yet whitelisted"
@@ -621,7 +667,7 @@ class TelegramBot(TeleBot):
                 else:
                     msg = "Current Administrators:\n\n"
                     for user_id in get_whitelist():
-                        if BaseConfig(user_id).admin_status():
+                        if self.get_configuration(user_id).admin_status():
                             msg += f"{user_id}\n"
                     self.reply_to(message, msg)
             except IndexError:
@@ -639,6 +685,10 @@ class TelegramBot(TeleBot):
             if not all(char == " " for char in chunk) and len(chunk) > 0
         ]
 
+    def get_configuration(self, tg_user_id: str):
+        """Get a user's configuration client, served from the alert store if one is used"""
+        return get_user_configuration(tg_user_id, self.alert_store)
+
     def is_whitelisted(self, func):
         """
         (Decorator) Checks if the user is an administrator before proceeding with the function
@@ -648,7 +698,7 @@ class TelegramBot(TeleBot):
 
         def wrapper(*args, **kw):
             message = args[0]
-            if str(message.from_user.id) in get_whitelist():
+            if is_whitelisted(str(message.from_user.id)):
                 return func(*args, **kw)
             else:
                 self.reply_to(
@@ -668,7 +718,7 @@ class TelegramBot(TeleBot):
 
         def wrapper(*args, **kw):
             message = args[0]
-            if BaseConfig(str(message.from_user.id)).admin_status():
+            if self.get_configuration(str(message.from_user.id)).admin_status():
                 return func(*args, **kw)
             else:
                 self.reply_to(
@@ -681,18 +731,14 @@ class TelegramBot(TeleBot):
 
     def get_latest_binance_price(self, pair):
         try:
-            response = requests.get(
-                self.binance_price_endpoint.format(
-                    pair.replace("/", ""), BINANCE_TIMEFRAMES[0]
-                )
-            )
-            # response = requests.get(f'https://api.binance.com/api/v3/ticker/price?symbol={pair.replace("/", "")}')
             try:
-                return round(float(response.json()["lastPrice"]), 3)
-            except KeyError:
+                ticker = self.price_cache.get(pair.replace("/", "").upper())
+            except requests.HTTPError as exc:
                 raise ValueError(
-                    f"{pair} is not a valid pair.\n" f"API Response: {response.json()}"
+                    f"{pair} is not a valid pair.\n"
+                    f"API Response: {exc.response.text}"
                 )
+            return round(ticker.lastPrice, 3)
         except KeyError:
             raise ValueError(
                 f"{pair} is not a valid pair.\n"
@@ -807,9 +853,22 @@ class TelegramBot(TeleBot):
 
         return CEXAlert(pair, indicator)
 
+    def set_commands(self) -> None:
+        """Publish the bot's command list to Telegram"""
+        logger.info("Setting bot commands ...")
+        user_commands = [
+            types.BotCommand(command=command, description=description)
+            for command, description in get_commands().items()
+        ]
+        try:
+            self.set_my_commands(user_commands)
+        except Exception as exc:
+            logger.exception("Could not set the bot commands", exc_info=exc)
+
     def run(self):
         logger.warn(f"{self.get_me().username} started at {datetime.utcnow()} UTC+0")
-        while True:
+        self._stopped.clear()
+        while not self._stopped.is_set():
             try:
                 self.polling(non_stop=True)
             except KeyboardInterrupt:
@@ -824,4 +883,9 @@ class TelegramBot(TeleBot):
                     f"Unexpected error has occurred while polling - Retrying in 30 seconds...",
                     exc_info=exc,
                 )
-                time.sleep(30)
+                self._stopped.wait(30)
+
+    def stop(self) -> None:
+        """Stop listening for commands, e.g. when another cluster instance becomes the leader"""
+        self._stopped.set()
+        self.stop_polling()
@@ -0,0 +1,143 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+
+class ThresholdIndex:
+    """
+    Per-pair index of the absolute price thresholds of simple (type "s") alerts.
+
+    ABOVE and BELOW targets are stored as is, and PCTCHG alerts are folded into an upper and a lower
+    bound (entry * (1 + target) and entry * (1 - target)), so that the users with alerts crossed by a
+    new price are found by bisection in O(log n + k) instead of re-evaluating every alert.
+
+    Alerts that cannot be reduced to a price threshold (24HRCHG) are tracked per pair and always returned.
+    The index only narrows down which users to evaluate - the alerts themselves are still evaluated exactly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {pair: ([thresholds], [user_ids])} - crossed when price > threshold
+        self._above = {}
+        # {pair: ([thresholds], [user_ids])} - crossed when price < threshold
+        self._below = {}
+        self._unindexed = {}  # {pair: {user_id: alert count}}
+        self._entries = {}  # {(user_id, pair): [(side, threshold)]}
+
+    def build(self, alerts_by_user: dict[str, dict]) -> None:
+        """
+        Rebuild the whole index
+
+        :param alerts_by_user: {user_id: alerts database as returned by load_alerts()}
+        """
+        with self._lock:
+            self._above, self._below, self._unindexed, self._entries = {}, {}, {}, {}
+            for user_id, alerts_db in alerts_by_user.items():
+                for pair, alerts in alerts_db.items():
+                    self._add(user_id, pair, alerts)
+
+    def update(self, user_id: str, pair: str, alerts: list[dict]) -> None:
+        """
+        Replace the entries of a user's pair, e.g. after an alert was added, cancelled, triggered or re-armed
+
+        :param alerts: The user's current alerts on the pair (an empty list removes the pair)
+        """
+        with self._lock:
+            self._remove(user_id, pair)
+            self._add(user_id, pair, alerts)
+
+    def update_user(self, user_id: str, alerts_db: dict) -> None:
+        """Replace all entries of a user with the alerts database as returned by load_alerts()"""
+        with self._lock:
+            for _user_id, pair in list(self._entries.keys()):
+                if _user_id == user_id and pair not in alerts_db:
+                    self._remove(user_id, pair)
+            for pair, alerts in alerts_db.items():
+                self._remove(user_id, pair)
+                self._add(user_id, pair, alerts)
+
+    def remove_user(self, user_id: str) -> None:
+        self.update_user(user_id, {})
+
+    def pairs(self) -> set[str]:
+        """All pairs that have at least one simple alert"""
+        with self._lock:
+            return {pair for _, pair in self._entries.keys()}
+
+    def change_pairs(self) -> set[str]:
+        """All pairs that have at least one 24HRCHG alert"""
+        with self._lock:
+            return set(self._unindexed.keys())
+
+    def crossed(self, pair: str, price: float) -> set[str]:
+        """
+        Find the users with at least one alert on the pair that may be satisfied at the price
+
+        :return: The user IDs to evaluate
+        """
+        users = set()
+        with self._lock:
+            if pair in self._above:
+                thresholds, user_ids = self._above[pair]
+                users.update(user_ids[: bisect_left(thresholds, price)])
+            if pair in self._below:
+                thresholds, user_ids = self._below[pair]
+                users.update(user_ids[bisect_right(thresholds, price) :])
+            users.update(self._unindexed.get(pair, {}).keys())
+        return users
+
+    def _add(self, user_id: str, pair: str, alerts: list[dict]) -> None:
+        """Add the thresholds of a user's alerts on a pair (must hold the lock)"""
+        entries = []
+        for alert in alerts:
+            if alert["type"] != "s":
+                continue
+
+            comparison, target = alert["comparison"], alert["target"]
+            if comparison == "ABOVE":
+                entries.append(("above", target))
+            elif comparison == "BELOW":
+                entries.append(("below", target))
+            elif comparison == "PCTCHG":
+                entries.append(("above", alert["entry"] * (1 + target)))
+                entries.append(("below", alert["entry"] * (1 - target)))
+            else:
+                entries.append(("unindexed", None))
+
+        if len(entries) == 0:
+            return
+        self._entries[(user_id, pair)] = entries
+
+        for side, threshold in entries:
+            if side == "unindexed":
+                counts = self._unindexed.setdefault(pair, {})
+                counts[user_id] = counts.get(user_id, 0) + 1
+                continue
+
+            thresholds, user_ids = self._side(side).setdefault(pair, ([], []))
+            i = bisect_right(thresholds, threshold)
+            thresholds.insert(i, threshold)
+            user_ids.insert(i, user_id)
+
+    def _remove(self, user_id: str, pair: str) -> None:
+        """Remove all thresholds of a user's pair (must hold the lock)"""
+        for side, threshold in self._entries.pop((user_id, pair), []):
+            if side == "unindexed":
+                counts = self._unindexed[pair]
+                counts[user_id] -= 1
+                if counts[user_id] == 0:
+                    del counts[user_id]
+                if len(counts) == 0:
+                    del self._unindexed[pair]
+                continue
+
+            thresholds, user_ids = self._side(side)[pair]
+            i = bisect_left(thresholds, threshold)
+            while user_ids[i] != user_id:
+                i += 1
+            del thresholds[i]
+            del user_ids[i]
+            if len(thresholds) == 0:
+                del self._side(side)[pair]
+
+    def _side(self, side: str) -> dict:
+        return self._above if side == "above" else self._below
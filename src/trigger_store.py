@@ -0,0 +1,304 @@
+import json
+import sqlite3
+import threading
+from hashlib import blake2b
+
+from .config import *
+from . import events
+from .events import EventBus, ALERT_REMOVED, USER_WHITELISTED, USER_REMOVED
+from .logger import logger
+from .user_configuration import is_whitelisted
+
+STATE_FIELDS = ("last_triggered", "fire_count", "last_value")
+
+
+def alert_key(pair: str, alert: dict) -> str:
+    """
+    Identify an alert by its pair and definition (everything but the trigger state).
+    Identical alerts on the same pair share their trigger state, as they always trigger together.
+    """
+    definition = {k: v for k, v in alert.items() if k != "trigger"}
+    raw = json.dumps([pair, definition], sort_keys=True, separators=(",", ":"))
+    return blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+class MongoTriggerBackend:
+    """Trigger states as documents of a sibling collection of the users collection"""
+
+    def __init__(self):
+        from .mongo import MongoDBConnection
+
+        connection = MongoDBConnection()
+        self.collection = connection.database[f"{connection.collection.name}_triggers"]
+        self.collection.create_index("user_id")
+
+    def load(self, user_id: str = None) -> dict:
+        """:return: {(user_id, alert key): state} of every user, or of a single user"""
+        query = {} if user_id is None else {"user_id": user_id}
+        return {
+            (document["user_id"], document["key"]): {
+                field: document.get(field) for field in STATE_FIELDS
+            }
+            for document in self.collection.find(query, {"_id": 0})
+        }
+
+    def write(self, changes: dict) -> None:
+        """:param changes: {(user_id, alert key): new state, or None to delete it}"""
+        from pymongo import DeleteOne, ReplaceOne
+
+        operations = [
+            (
+                DeleteOne({"_id": f"{user_id}:{key}"})
+                if state is None
+                else ReplaceOne(
+                    {"_id": f"{user_id}:{key}"},
+                    {"user_id": user_id, "key": key, **state},
+                    upsert=True,
+                )
+            )
+            for (user_id, key), state in changes.items()
+        ]
+        if len(operations) > 0:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def delete_user(self, user_id: str) -> None:
+        self.collection.delete_many({"user_id": user_id})
+
+
+class SQLiteTriggerBackend:
+    """Trigger states in an SQLite table, shared by the processes of one machine"""
+
+    def __init__(self, path: str = TRIGGER_DB_PATH):
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS triggers (user_id TEXT NOT NULL, alert_key TEXT NOT NULL, "
+                "last_triggered INTEGER NOT NULL, fire_count INTEGER NOT NULL, last_value REAL, "
+                "PRIMARY KEY (user_id, alert_key))"
+            )
+
+    def load(self, user_id: str = None) -> dict:
+        """:return: {(user_id, alert key): state} of every user, or of a single user"""
+        query = f"SELECT user_id, alert_key, {', '.join(STATE_FIELDS)} FROM triggers"
+        with self._lock:
+            if user_id is None:
+                rows = self._connection.execute(query).fetchall()
+            else:
+                rows = self._connection.execute(
+                    f"{query} WHERE user_id = ?", (user_id,)
+                ).fetchall()
+        return {(row[0], row[1]): dict(zip(STATE_FIELDS, row[2:])) for row in rows}
+
+    def write(self, changes: dict) -> None:
+        """:param changes: {(user_id, alert key): new state, or None to delete it}"""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO triggers VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (user_id, key, *(state[field] for field in STATE_FIELDS))
+                        for (user_id, key), state in changes.items()
+                        if state is not None
+                    ],
+                )
+                self._connection.executemany(
+                    "DELETE FROM triggers WHERE user_id = ? AND alert_key = ?",
+                    [key for key, state in changes.items() if state is None],
+                )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def delete_user(self, user_id: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM triggers WHERE user_id = ?", (user_id,)
+            )
+
+
+def _default_backend():
+    """The MongoDB collection or SQLite table next to the users, or a file of its own with the local backend"""
+    if USE_SQLITE_DB:
+        return SQLiteTriggerBackend(SQLITE_DB_PATH)
+    if USE_MONGO_DB:
+        return MongoTriggerBackend()
+    return SQLiteTriggerBackend(TRIGGER_DB_PATH)
+
+
+class TriggerStore:
+    """
+    Trigger state of the alerts (last trigger time, fire count and last value), kept apart from the alert definitions.
+
+    Re-arming a cooldown alert is the most frequent write of the bot, so instead of rewriting the user's alerts,
+    only the alert's state is written, to a MongoDB collection or an SQLite table of its own. The states are keyed
+    by user and alert, so they follow the users across cluster instances and shard workers, whatever the number
+    of shards. They are served from memory, and the changed states are written in one batch every flush_period
+    seconds (see run()). The alert definitions are then only written when the user edits them (or an alert
+    without a cooldown is removed once triggered).
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        event_bus: EventBus = None,
+        flush_period: float = TRIGGER_FLUSH_PERIOD,
+    ):
+        """
+        :param backend: The trigger state database (defaults to the user configuration backend's, see _default_backend())
+        :param event_bus: The bus that cancelled alerts and gained or removed users are received from
+        :param flush_period: Seconds between writes of the changed states to the backend
+        """
+        self.backend = backend if backend is not None else _default_backend()
+        self.flush_period = flush_period
+        # {(user_id, alert key): {"last_triggered", "fire_count", "last_value"}}
+        self._states = {}
+        # {(user_id, alert key): state, or None once forgotten} to write on the next flush
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # Held while writing to the backend
+        self._stopped = threading.Event()
+        self.load()
+
+        self.event_bus = event_bus if event_bus is not None else events.event_bus
+        self.event_bus.subscribe(ALERT_REMOVED, self.on_alert_removed)
+        self.event_bus.subscribe(USER_WHITELISTED, self.on_user_whitelisted)
+        self.event_bus.subscribe(USER_REMOVED, self.on_user_removed)
+
+    def load(self) -> None:
+        """Load the states of every user from the backend"""
+        states = self.backend.load()
+        with self._lock:
+            self._states, self._dirty = states, {}
+        logger.info(f"Trigger store loaded {len(states)} alert states")
+
+    def load_user(self, user_id: str) -> None:
+        """Reload a user's states from the backend, e.g. once another instance or worker handed the user over"""
+        self.flush()
+        states = self.backend.load(user_id)
+        with self._lock:
+            for key in [key for key in self._states if key[0] == user_id]:
+                if key not in self._dirty:
+                    del self._states[key]
+            for key, state in states.items():
+                if key not in self._dirty:
+                    self._states[key] = state
+
+    def get(self, user_id: str, pair: str, alert: dict) -> dict:
+        """:return: The alert's trigger state, or an empty dict if it never triggered"""
+        with self._lock:
+            return dict(self._states.get((user_id, alert_key(pair, alert)), {}))
+
+    def last_triggered(self, user_id: str, pair: str, alert: dict) -> int:
+        """:return: When the alert last triggered, falling back to the trigger saved with older alert definitions"""
+        state = self.get(user_id, pair, alert)
+        if "last_triggered" in state:
+            return state["last_triggered"]
+        return alert.get("trigger", {}).get("last_triggered", 0)
+
+    def record(
+        self,
+        user_id: str,
+        pair: str,
+        alert: dict,
+        triggered_at: int,
+        value: float = None,
+    ) -> dict:
+        """
+        Record that an alert's condition was satisfied
+
+        :return: The alert's new trigger state
+        """
+        key = (user_id, alert_key(pair, alert))
+        with self._lock:
+            state = self._states.get(key, {})
+            state = {
+                "last_triggered": triggered_at,
+                "fire_count": state.get("fire_count", 0) + 1,
+                "last_value": value,
+            }
+            self._states[key] = self._dirty[key] = state
+            return dict(state)
+
+    def forget(self, user_id: str, pair: str, alert: dict) -> None:
+        """Drop the state of a cancelled alert, so that an identical alert added later starts afresh"""
+        key = (user_id, alert_key(pair, alert))
+        with self._lock:
+            if self._states.pop(key, None) is not None:
+                self._dirty[key] = None
+
+    def forget_user(self, user_id: str) -> None:
+        with self.flush_lock:
+            with self._lock:
+                for states in (self._states, self._dirty):
+                    for key in [key for key in states if key[0] == user_id]:
+                        del states[key]
+            self.backend.delete_user(user_id)
+
+    def on_alert_removed(self, user_id: str, pair: str, alert: dict, **kwargs) -> None:
+        self.forget(user_id, pair, alert)
+
+    def on_user_whitelisted(self, user_id: str, **kwargs) -> None:
+        # Also published when a user is gained from another cluster instance
+        self.load_user(user_id)
+
+    def on_user_removed(self, user_id: str, **kwargs) -> None:
+        # Also published when a user moves to another cluster instance, which loads the user's states once written
+        if is_whitelisted(user_id):
+            self.flush()
+        else:
+            self.forget_user(user_id)
+
+    def flush(self) -> None:
+        """Write the changed states to the backend"""
+        with self.flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            if len(dirty) == 0:
+                return
+            try:
+                self.backend.write(dirty)
+            except Exception as exc:
+                logger.exception(
+                    f"Could not write {len(dirty)} alert trigger states to the backend - retrying on the next flush",
+                    exc_info=exc,
+                )
+                with self._lock:
+                    # Changes made since are newer
+                    self._dirty = {**dirty, **self._dirty}
+
+    def run(self) -> None:
+        """
+        Flush the changed states every flush_period seconds until close() is called.
+
+        Should be started in a new daemon thread.
+        """
+        while not self._stopped.wait(self.flush_period):
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.exception("Could not flush the trigger store", exc_info=exc)
+
+    def close(self) -> None:
+        """Stop the background flush and write any pending changes"""
+        self._stopped.set()
+        self.flush()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_trigger_store() -> TriggerStore:
+    """The trigger store shared by the alert processes of this process, loaded on first use"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TriggerStore()
+        return _default
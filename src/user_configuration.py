@@ -1,13 +1,32 @@
 import json
 import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from os import stat
+from time import monotonic
 
 from .config import *
-from .mongo import MongoDBConnection
+from .events import event_bus, USER_WHITELISTED, USER_REMOVED
+from .logger import logger
+from .serialization import read_json, write_json
+from .sqlite import SQLiteConnection
 
-# Activate mongo DB connection if needed
+try:
+    import fcntl
+except ImportError:  # Not available on Windows - only the in-process lock is used
+    fcntl = None
+
+# Activate mongo DB connection if needed (pymongo is only imported when MongoDB is used)
 if USE_MONGO_DB:
+    from .mongo import MongoDBConnection
+
     db_connection = MongoDBConnection()
 
+# Activate SQLite connection if needed
+if USE_SQLITE_DB:
+    sqlite_connection = SQLiteConnection(SQLITE_DB_PATH)
+
 
 class LocalUserConfiguration:
     """Simplifies interaction with the json database system"""
@@ -29,7 +48,7 @@ class LocalUserConfiguration:
         """Add necessary files and directories to database for TG user ID"""
 
         # Return if user data directory already exists
-        if self.user_id in get_whitelist():
+        if is_whitelisted(self.user_id):
             return
 
         # Make root dir
@@ -42,68 +61,160 @@ class LocalUserConfiguration:
             default_config["channels"].append(self.user_id)
             if is_admin:
                 default_config["is_admin"] = True
-            with open(self.config_path, "w") as _out:
-                _out.write(json.dumps(default_config, indent=2))
+            write_json(self.config_path, default_config)
 
             # Make default alerts configuration
             shutil.copy(self.default_alerts_path, self.alerts_path)
         except Exception as exc:
             self.blacklist_user()
             raise exc
+        whitelist_registry.add(self.user_id)
+        event_bus.publish(
+            USER_WHITELISTED, user_id=self.user_id, alerts=read_json(self.alerts_path)
+        )
 
     def blacklist_user(self):
         """Remove TG user configuration from database"""
         # Removes user configuration recursively
         if exists(self.user_config_root):
             shutil.rmtree(self.user_config_root)
+        whitelist_registry.discard(self.user_id)
+        event_bus.publish(USER_REMOVED, user_id=self.user_id)
 
     def load_alerts(self) -> dict:
         """Load the database contents and return it in JSON format"""
-        with open(self.alerts_path, "r") as infile:
-            contents = infile.read()
-            return json.loads(contents)
+        return read_json(self.alerts_path)
 
     def update_alerts(self, data: dict) -> None:
-        with open(self.alerts_path, "w") as outfile:
-            outfile.write(json.dumps(data, indent=2))
+        write_json(self.alerts_path, data)
 
     def load_config(self) -> dict:
-        with open(self.config_path, "r") as infile:
-            contents = infile.read()
-            return json.loads(contents)
+        return read_json(self.config_path)
 
     def update_config(self, data: dict) -> None:
-        with open(self.config_path, "w") as outfile:
-            outfile.write(json.dumps(data, indent=2))
+        write_json(self.config_path, data)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the user's lock: a per-user thread lock, and an advisory file lock so that other processes
+        sharing the whitelist directory are excluded as well
+        """
+        with _user_lock(self.user_id):
+            if fcntl is None:
+                yield
+                return
+            with open(join(self.user_config_root, ".lock"), "a") as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def modify_alerts(self, mutator):
+        """
+        Atomically read-modify-write the user's alerts
+
+        :param mutator: Called with the current alerts database to modify in place. May be called more than once
+                        when a backend retries on a conflicting write, so it must not have other side effects.
+        :return: The mutator's return value
+        """
+        with self.locked():
+            alerts = self.load_alerts()
+            result = mutator(alerts)
+            self.update_alerts(alerts)
+        return result
+
+    def modify_config(self, mutator):
+        """Atomically read-modify-write the user's configuration (see modify_alerts)"""
+        with self.locked():
+            config = self.load_config()
+            result = mutator(config)
+            self.update_config(config)
+        return result
 
     def admin_status(self, new_value: bool = None) -> bool:
-        config = self.load_config()
-        if new_value is not None:
+        if new_value is None:
+            return self.load_config()["is_admin"]
+
+        def set_admin(config):
             config["is_admin"] = new_value
-            self.update_config(config)
-        return config["is_admin"]
+            return new_value
+
+        return self.modify_config(set_admin)
 
     def get_channels(self) -> list[str]:
         return self.load_config()["channels"]
 
     def add_channels(self, channels: list[str]) -> None:
-        config = self.load_config()
-        for channel in channels:
-            if channel not in config["channels"]:
-                config["channels"].append(channel)
-        self.update_config(config)
+        def add(config):
+            for channel in channels:
+                if channel not in config["channels"]:
+                    config["channels"].append(channel)
+
+        self.modify_config(add)
 
     def remove_channels(self, channels: list[str]) -> list[str]:
         """Attempts to remove channels from config, and returns fails"""
-        config = self.load_config()
-        fail = []
-        for channel in channels:
-            if channel in config["channels"]:
-                config["channels"].remove(channel)
-            else:
-                fail.append(channel)
-        self.update_config(config)
-        return fail
+
+        def remove(config):
+            fail = []
+            for channel in channels:
+                if channel in config["channels"]:
+                    config["channels"].remove(channel)
+                else:
+                    fail.append(channel)
+            return fail
+
+        return self.modify_config(remove)
+
+    @classmethod
+    def load_all(cls, sections: tuple = ("alerts", "config")) -> dict[str, dict]:
+        """
+        Load the given sections of every whitelisted user
+
+        :param sections: "alerts" and/or "config"
+        :return: {user_id: {section: data}}
+        """
+        users = {}
+        for user_id in get_whitelist():
+            configuration = cls(user_id)
+            users[user_id] = {}
+            if "alerts" in sections:
+                users[user_id]["alerts"] = configuration.load_alerts()
+            if "config" in sections:
+                users[user_id]["config"] = configuration.load_config()
+        return users
+
+    @classmethod
+    def write_all(cls, updates: dict[str, dict]) -> None:
+        """
+        Replace sections of many users
+
+        :param updates: {user_id: {"alerts": data, "config": data}} (either section may be left out)
+        """
+        for user_id, sections in updates.items():
+            configuration = cls(user_id)
+            if "alerts" in sections:
+                configuration.update_alerts(sections["alerts"])
+            if "config" in sections:
+                configuration.update_config(sections["config"])
+
+    @classmethod
+    def load_versions(cls) -> dict[str, int]:
+        """
+        Get a version of every whitelisted user's alerts that changes whenever they are written,
+        so that changes made by other bot instances can be detected
+
+        :return: {user_id: version}
+        """
+        versions = {}
+        for user_id in get_whitelist():
+            try:
+                versions[user_id] = stat(cls(user_id).alerts_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return versions
 
 
 class MongoDBUserConfiguration(LocalUserConfiguration):
@@ -123,7 +234,7 @@ class MongoDBUserConfiguration(LocalUserConfiguration):
         """OVERRIDES SUPER - Add necessary files and directories to database for TG user ID"""
 
         # Return if user data directory already exists
-        if self.user_id in get_whitelist():
+        if is_whitelisted(self.user_id):
             return
 
         # Prepare default user document
@@ -146,13 +257,19 @@ class MongoDBUserConfiguration(LocalUserConfiguration):
 
         # Push new user document to MongoDB
         db_connection.collection.insert_one(user_document)
+        whitelist_registry.add(self.user_id)
+        event_bus.publish(
+            USER_WHITELISTED, user_id=self.user_id, alerts=user_document["alerts"]
+        )
 
     def blacklist_user(self):
         """OVERRIDES SUPER - Remove TG user from whitelist"""
         db_connection.collection.delete_one(self.filter)
+        whitelist_registry.discard(self.user_id)
+        event_bus.publish(USER_REMOVED, user_id=self.user_id)
 
     def _load_document(self) -> dict:
-        if self.user_id not in get_whitelist():
+        if not is_whitelisted(self.user_id):
             raise Exception(
                 f"Cannot load document - user {self.user_id} is not yet whitelisted"
             )
@@ -161,7 +278,7 @@ class MongoDBUserConfiguration(LocalUserConfiguration):
 
     def load_alerts(self) -> dict:
         """OVERRIDES SUPER - Load the database alert contents and return it in JSON format"""
-        if self.user_id not in get_whitelist():
+        if not is_whitelisted(self.user_id):
             raise Exception(
                 f"Cannot load alerts - user {self.user_id} is not yet whitelisted"
             )
@@ -171,12 +288,14 @@ class MongoDBUserConfiguration(LocalUserConfiguration):
     def update_alerts(self, data: dict) -> None:
         """OVERRIDES SUPER - Update the contents of the 'alerts' section of the user document"""
         db_connection.collection.update_one(
-            self.filter, {"$set": {"alerts": data}}, upsert=True
+            self.filter,
+            {"$set": {"alerts": data}, "$inc": {"version": 1}},
+            upsert=True,
         )
 
     def load_config(self) -> dict:
         """OVERRIDES SUPER - Load the config section of the user document"""
-        if self.user_id not in get_whitelist():
+        if not is_whitelisted(self.user_id):
             raise Exception(
                 f"Cannot load config - user {self.user_id} is not yet whitelisted"
             )
@@ -186,17 +305,428 @@ class MongoDBUserConfiguration(LocalUserConfiguration):
     def update_config(self, data: dict) -> None:
         """OVERRIDES SUPER - Update the config section of the user document"""
         db_connection.collection.update_one(
-            self.filter, {"$set": {"config": data}}, upsert=True
+            self.filter,
+            {"$set": {"config": data}, "$inc": {"version": 1}},
+            upsert=True,
         )
 
+    def modify_alerts(self, mutator):
+        """OVERRIDES SUPER - Compare-and-swap on the document version, retrying on conflict"""
+        return self._modify("alerts", mutator)
 
-def get_whitelist() -> list:
-    if not USE_MONGO_DB:
-        if not isdir(WHITELIST_ROOT):
-            mkdir(WHITELIST_ROOT)
+    def modify_config(self, mutator):
+        """OVERRIDES SUPER - Compare-and-swap on the document version, retrying on conflict"""
+        return self._modify("config", mutator)
+
+    def _modify(self, section: str, mutator):
+        for _ in range(CAS_MAX_RETRIES):
+            document = db_connection.collection.find_one(
+                self.filter, {section: 1, "version": 1}
+            )
+            if document is None:
+                raise Exception(
+                    f"Cannot modify {section} - user {self.user_id} is not yet whitelisted"
+                )
+            data = document[section]
+            result = mutator(data)
+            # Documents written before versioning have no version field
+            version = document.get("version", {"$exists": False})
+            update = db_connection.collection.update_one(
+                {**self.filter, "version": version},
+                {"$set": {section: data}, "$inc": {"version": 1}},
+            )
+            if update.matched_count == 1:
+                return result
+        raise ConflictError(
+            f"Could not update the {section} of user {self.user_id} after {CAS_MAX_RETRIES} conflicting writes"
+        )
 
-        return [
-            _id for _id in listdir(WHITELIST_ROOT) if isdir(join(WHITELIST_ROOT, _id))
+    @classmethod
+    def load_all(cls, sections: tuple = ("alerts", "config")) -> dict[str, dict]:
+        """OVERRIDES SUPER - Stream every user document once, projected to the requested sections"""
+        projection = {"_id": 0, "user_id": 1, **{section: 1 for section in sections}}
+        return {
+            document.pop("user_id"): document
+            for document in db_connection.collection.find({}, projection)
+        }
+
+    @classmethod
+    def write_all(cls, updates: dict[str, dict]) -> None:
+        """OVERRIDES SUPER - Write every user's sections in a single bulk_write"""
+        from pymongo import UpdateOne
+
+        operations = [
+            UpdateOne({"user_id": user_id}, {"$set": sections, "$inc": {"version": 1}})
+            for user_id, sections in updates.items()
+            if len(sections) > 0
         ]
-    else:
-        return [user["user_id"] for user in db_connection.collection.find()]
+        if len(operations) > 0:
+            db_connection.collection.bulk_write(operations, ordered=False)
+
+    @classmethod
+    def load_versions(cls) -> dict[str, int]:
+        """OVERRIDES SUPER - The version field of every user document, incremented by every write"""
+        return {
+            document["user_id"]: document.get("version", 0)
+            for document in db_connection.collection.find(
+                {}, {"_id": 0, "user_id": 1, "version": 1}
+            )
+        }
+
+
+class SQLiteUserConfiguration(LocalUserConfiguration):
+    """
+    Simplifies interaction with the SQLite database system - overrides methods from LocalUserConfiguration
+
+    Users, channels and alerts are stored in normalized tables. The trigger columns of the alerts hold the
+    trigger as of the alert's definition (e.g. migrated from another backend), not the live trigger state,
+    which is kept by the TriggerStore.
+    """
+
+    def __init__(self, tg_user_id: str, database: SQLiteConnection = None):
+        """
+        :param tg_user_id: The Telegram user ID of the bot user to locate their configuration
+        :param database: The database to use (defaults to the one at SQLITE_DB_PATH)
+        """
+        super().__init__(tg_user_id=tg_user_id)
+        self.database = database if database is not None else sqlite_connection
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection, so that a configuration can be shared between threads"""
+        return self.database.connection()
+
+    def whitelist_user(self, is_admin: bool = False):
+        """OVERRIDES SUPER - Add the user with the default configuration and alerts"""
+
+        # Return if user already exists
+        if is_whitelisted(self.user_id):
+            return
+
+        with open(self.default_config_path, "r") as _in:
+            default_config = json.loads(_in.read())
+        default_config["channels"].append(self.user_id)
+        if is_admin:
+            default_config["is_admin"] = True
+        with open(self.default_alerts_path, "r") as _in:
+            default_alerts = json.loads(_in.read())
+
+        self.import_user(default_config, default_alerts)
+        whitelist_registry.add(self.user_id)
+        event_bus.publish(USER_WHITELISTED, user_id=self.user_id, alerts=default_alerts)
+
+    def import_user(self, config: dict, alerts: dict) -> None:
+        """Create or replace the user with the given configuration and alerts in a single transaction"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO users (user_id) VALUES (?)", (self.user_id,)
+            )
+            self._write_config(config)
+            self._write_alerts(alerts)
+
+    def blacklist_user(self):
+        """OVERRIDES SUPER - Remove the user, their channels and alerts"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM users WHERE user_id = ?", (self.user_id,)
+            )
+        whitelist_registry.discard(self.user_id)
+        event_bus.publish(USER_REMOVED, user_id=self.user_id)
+
+    def load_alerts(self) -> dict:
+        """OVERRIDES SUPER - Load the user's alerts in the same format as the other backends"""
+        alerts = {}
+        for row in self.connection.execute(
+            "SELECT pair, definition, cooldown_seconds, last_triggered FROM alerts "
+            "WHERE user_id = ? ORDER BY id",
+            (self.user_id,),
+        ):
+            alerts.setdefault(row["pair"], []).append(self._to_alert(row))
+        return alerts
+
+    def update_alerts(self, data: dict) -> None:
+        """OVERRIDES SUPER - Replace all of the user's alerts"""
+        with self.connection:
+            self._write_alerts(data)
+
+    def modify_alerts(self, mutator):
+        """OVERRIDES SUPER - Read-modify-write within a single write transaction"""
+        with self._write_transaction():
+            alerts = self.load_alerts()
+            result = mutator(alerts)
+            self._write_alerts(alerts)
+        return result
+
+    def modify_config(self, mutator):
+        """OVERRIDES SUPER - Read-modify-write within a single write transaction"""
+        with self._write_transaction():
+            config = self.load_config()
+            result = mutator(config)
+            self._write_config(config)
+        return result
+
+    @contextmanager
+    def _write_transaction(self):
+        """BEGIN IMMEDIATE takes the database's write lock up front, so that the read cannot go stale"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    @classmethod
+    def load_versions(cls) -> dict[str, int]:
+        """OVERRIDES SUPER - The version column of every user, incremented by triggers on the alerts table"""
+        return {
+            row["user_id"]: row["version"]
+            for row in sqlite_connection.connection().execute(
+                "SELECT user_id, version FROM users"
+            )
+        }
+
+    def load_config(self) -> dict:
+        """OVERRIDES SUPER - Load the user's configuration in the same format as the other backends"""
+        user = self.connection.execute(
+            "SELECT is_admin, settings FROM users WHERE user_id = ?", (self.user_id,)
+        ).fetchone()
+        if user is None:
+            raise Exception(
+                f"Cannot load config - user {self.user_id} is not yet whitelisted"
+            )
+        channels = self.connection.execute(
+            "SELECT channel_id FROM channels WHERE user_id = ? ORDER BY position",
+            (self.user_id,),
+        )
+        return {
+            "settings": json.loads(user["settings"]),
+            "channels": [row["channel_id"] for row in channels],
+            "is_admin": bool(user["is_admin"]),
+        }
+
+    def update_config(self, data: dict) -> None:
+        """OVERRIDES SUPER - Update the user's configuration"""
+        with self.connection:
+            self._write_config(data)
+
+    @staticmethod
+    def _to_alert(row) -> dict:
+        alert = json.loads(row["definition"])
+        alert["trigger"] = {
+            "cooldown_seconds": row["cooldown_seconds"],
+            "last_triggered": row["last_triggered"],
+        }
+        return alert
+
+    def _write_alerts(self, data: dict) -> None:
+        """Replace all of the user's alerts (must be called within a transaction)"""
+        self.connection.execute("DELETE FROM alerts WHERE user_id = ?", (self.user_id,))
+        rows = []
+        for pair, alerts in data.items():
+            for position, alert in enumerate(alerts):
+                trigger = alert.get("trigger", {})
+                rows.append(
+                    (
+                        self.user_id,
+                        pair,
+                        position,
+                        alert["type"],
+                        alert["indicator"],
+                        alert.get("comparison"),
+                        alert.get("target"),
+                        json.dumps({k: v for k, v in alert.items() if k != "trigger"}),
+                        trigger.get("cooldown_seconds"),
+                        trigger.get("last_triggered", 0),
+                    )
+                )
+        self.connection.executemany(
+            "INSERT INTO alerts (user_id, pair, position, type, indicator, comparison, target, "
+            "definition, cooldown_seconds, last_triggered) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def _write_config(self, data: dict) -> None:
+        """Replace the user's configuration (must be called within a transaction)"""
+        self.connection.execute(
+            "UPDATE users SET is_admin = ?, settings = ? WHERE user_id = ?",
+            (
+                int(data.get("is_admin", False)),
+                json.dumps(data.get("settings", {})),
+                self.user_id,
+            ),
+        )
+        self.connection.execute(
+            "DELETE FROM channels WHERE user_id = ?", (self.user_id,)
+        )
+        self.connection.executemany(
+            "INSERT INTO channels (user_id, position, channel_id) VALUES (?, ?, ?)",
+            [
+                (self.user_id, position, channel)
+                for position, channel in enumerate(data.get("channels", []))
+            ],
+        )
+
+
+class ConflictError(Exception):
+    """A compare-and-swap update kept conflicting with concurrent writes"""
+
+
+_user_locks = {}  # {user_id: threading.RLock}
+_user_locks_lock = threading.Lock()
+
+
+def _user_lock(user_id: str) -> threading.RLock:
+    with _user_locks_lock:
+        if user_id not in _user_locks:
+            _user_locks[user_id] = threading.RLock()
+        return _user_locks[user_id]
+
+
+class WhitelistRegistry:
+    """
+    In-memory set of the whitelisted user IDs, so that membership checks do not hit the disk or database.
+
+    The set is updated directly by whitelist_user/blacklist_user, and picks up changes made outside the bot:
+    the local backend rescans WHITELIST_ROOT when its modification time changes, the SQLite backend rescans
+    when its whitelist version counter (bumped by triggers on the users table) changes, and the MongoDB backend
+    follows a change stream on the collection (falling back to a rescan every WHITELIST_REFRESH_PERIOD seconds
+    when change streams are unavailable, e.g. on a standalone server).
+    """
+
+    def __init__(self):
+        self._users = None  # Loaded on first use
+        self._mtime = None  # WHITELIST_ROOT mtime (local) or whitelist version (SQLite) of the last scan
+        self._scanned = 0.0  # Time of the last scan (MongoDB)
+        # MongoDB change stream: "closed", "open" or "unavailable"
+        self._stream = "closed"
+        self._lock = threading.Lock()
+
+    def contains(self, user_id: str) -> bool:
+        return user_id in self._current()
+
+    def users(self) -> list[str]:
+        return list(self._current())
+
+    def add(self, user_id: str) -> None:
+        with self._lock:
+            if self._users is not None:
+                self._users = self._users | {user_id}
+
+    def discard(self, user_id: str) -> None:
+        with self._lock:
+            if self._users is not None:
+                self._users = self._users - {user_id}
+
+    def refresh(self) -> None:
+        """Rescan the backend on the next access"""
+        with self._lock:
+            self._users = None
+
+    def _current(self) -> frozenset:
+        if USE_SQLITE_DB:
+            version = sqlite_connection.whitelist_version()
+            with self._lock:
+                if self._users is not None and version == self._mtime:
+                    return self._users
+            users = frozenset(
+                row["user_id"]
+                for row in sqlite_connection.connection().execute(
+                    "SELECT user_id FROM users"
+                )
+            )
+            with self._lock:
+                self._users, self._mtime = users, version
+            return users
+
+        if not USE_MONGO_DB:
+            if not isdir(WHITELIST_ROOT):
+                mkdir(WHITELIST_ROOT)
+            mtime = stat(WHITELIST_ROOT).st_mtime_ns
+            with self._lock:
+                if self._users is not None and mtime == self._mtime:
+                    return self._users
+            users = frozenset(
+                _id
+                for _id in listdir(WHITELIST_ROOT)
+                if isdir(join(WHITELIST_ROOT, _id))
+            )
+            with self._lock:
+                self._users, self._mtime = users, mtime
+            return users
+
+        self._watch()
+        with self._lock:
+            if self._users is not None and (
+                self._stream == "open"
+                or monotonic() - self._scanned < WHITELIST_REFRESH_PERIOD
+            ):
+                return self._users
+        return self._scan_mongo()
+
+    def _scan_mongo(self) -> frozenset:
+        users = frozenset(
+            user["user_id"]
+            for user in db_connection.collection.find({}, {"user_id": 1, "_id": 0})
+        )
+        with self._lock:
+            self._users, self._scanned = users, monotonic()
+        return users
+
+    def _watch(self) -> None:
+        """Open the MongoDB change stream if it is not open yet"""
+        with self._lock:
+            if self._stream != "closed":
+                return
+            try:
+                stream = db_connection.collection.watch(
+                    [
+                        {
+                            "$match": {
+                                "operationType": {
+                                    "$in": ["insert", "delete", "replace"]
+                                }
+                            }
+                        }
+                    ]
+                )
+            except Exception as exc:
+                logger.warn(
+                    f"MongoDB change streams are unavailable - rescanning the whitelist every "
+                    f"{WHITELIST_REFRESH_PERIOD} seconds ({exc})"
+                )
+                self._stream = "unavailable"
+                return
+            # Changes made before the stream was opened are picked up by a rescan
+            self._stream, self._users = "open", None
+        threading.Thread(target=self._follow, args=(stream,), daemon=True).start()
+
+    def _follow(self, stream) -> None:
+        try:
+            for _ in stream:
+                # Users are rarely added or removed, so a rescan keeps this simple
+                self._scan_mongo()
+        except Exception as exc:
+            logger.warn(f"MongoDB whitelist change stream closed - {exc}")
+        finally:
+            with self._lock:
+                self._stream, self._users = "closed", None
+
+
+whitelist_registry = WhitelistRegistry()
+
+
+def is_whitelisted(user_id: str) -> bool:
+    return whitelist_registry.contains(user_id)
+
+
+def get_whitelist() -> list:
+    return whitelist_registry.users()
+
+
+if USE_SQLITE_DB:
+    BaseConfig = SQLiteUserConfiguration
+elif USE_MONGO_DB:
+    BaseConfig = MongoDBUserConfiguration
+else:
+    BaseConfig = LocalUserConfiguration
@@ -15,6 +15,11 @@ def get_ratelimits() -> tuple:
     return SUBSCRIPTION_TIERS[getenv("TAAPIIO_TIER", "free").lower()]
 
 
+def get_bulk_limits() -> tuple:
+    """Get the bulk query limits (constructs per query, indicators per construct) for the current tier"""
+    return BULK_QUERY_LIMITS[getenv("TAAPIIO_TIER", "free").lower()]
+
+
 def get_logfile() -> str:
     """Get logfile path & create logs dir if it doesn't exist in the current working directory"""
     log_dir = join(getcwd(), "logs")
@@ -75,6 +80,35 @@ def get_binance_price_url() -> str:
     )
 
 
+def get_binance_bulk_price_url() -> str:
+    """Get the multi-symbol binance price url for the location"""
+    location = getenv("LOCATION")
+    assert (
+        location in BINANCE_LOCATIONS
+    ), f"Location must be in {BINANCE_LOCATIONS} for the Binance exchange."
+
+    return (
+        BINANCE_BULK_PRICE_URL_US
+        if location.lower() == "us"
+        else BINANCE_BULK_PRICE_URL_GLOBAL
+    )
+
+
+def get_binance_stream_url() -> str:
+    """Get the binance websocket stream url for the location (can be overridden with BINANCE_STREAM_URL)"""
+    if getenv("BINANCE_STREAM_URL"):
+        return getenv("BINANCE_STREAM_URL")
+
+    location = getenv("LOCATION")
+    assert (
+        location in BINANCE_LOCATIONS
+    ), f"Location must be in {BINANCE_LOCATIONS} for the Binance exchange."
+
+    return (
+        BINANCE_STREAM_URL_US if location.lower() == "us" else BINANCE_STREAM_URL_GLOBAL
+    )
+
+
 def parse_trigger_cooldown(cooldown_str: str = None) -> dict:
     """
     Parses a cooldown string like '30s', '5m', '1h' into seconds.
@@ -0,0 +1,159 @@
+"""
+Measures the alerts per second of the threaded and the asyncio polling engines at the same polling period, against
+a local stand-in for the Binance API that answers every request after a fixed latency.
+
+Every user has cooldown alerts that are satisfied by every snapshot, so each engine fires all of them once per cycle
+and the throughput only depends on how long it takes to fetch a snapshot. Each engine runs in its own process:
+
+    python -m tests.benchmark_engines --pairs 2000 --latency 0.25 --period 2 --duration 30
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--pairs", type=int, default=2000, help="Distinct pairs with alerts"
+    )
+    parser.add_argument(
+        "--users", type=int, default=200, help="Users, with 10 alerts each"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.25, help="Binance response latency (s)"
+    )
+    parser.add_argument(
+        "--period", type=float, default=2, help="CEX_POLLING_PERIOD of both engines (s)"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Measured time per engine (s)"
+    )
+    parser.add_argument("--engine", choices=["thread", "async"], help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_engine(args: argparse.Namespace) -> dict:
+    """Run a single engine against the stand-in server and measure the triggered alerts"""
+    os.environ.setdefault("LOCATION", "global")
+    root = tempfile.mkdtemp()
+
+    # The polling period is read by the engines when they are imported
+    from src import config
+
+    config.CEX_POLLING_PERIOD = args.period
+
+    from src import events, user_configuration
+    from src.alert_processes import CEXAlertProcess
+    from src.alert_store import AlertStore
+    from src.delivery import DeliveryQueue
+    from src.events import ALERT_TRIGGERED
+    from src.price_cache import PriceCache
+    from src.trigger_store import SQLiteTriggerBackend, TriggerStore
+    from tests.fakes import FakeBinanceAPI, FakeTelegramBot
+
+    user_configuration.WHITELIST_ROOT = os.path.join(root, "whitelist")
+    user_configuration.whitelist_registry.refresh()
+    pairs = [f"P{i:05d}/USDT" for i in range(args.pairs)]
+    for user in range(args.users):
+        configuration = user_configuration.LocalUserConfiguration(str(10000 + user))
+        configuration.whitelist_user()
+        alerts = {}
+        for alert in range(10):
+            pair = pairs[(user * 10 + alert) % len(pairs)]
+            alerts.setdefault(pair, []).append(
+                {
+                    "type": "s",
+                    "indicator": "PRICE",
+                    "comparison": "ABOVE",
+                    "target": 50 + alert,
+                    "params": {},
+                    "trigger": {"cooldown_seconds": 1, "last_triggered": 0},
+                }
+            )
+        configuration.update_alerts(alerts)
+
+    server = FakeBinanceAPI(latency=args.latency)
+    price_cache = PriceCache(ttl=0)
+    server.patch(price_cache)
+    alert_store = AlertStore()
+    alert_store.load()
+    threading.Thread(target=alert_store.run, daemon=True).start()
+    trigger_store = TriggerStore(
+        backend=SQLiteTriggerBackend(os.path.join(root, "triggers.db"))
+    )
+    threading.Thread(target=trigger_store.run, daemon=True).start()
+    bot = FakeTelegramBot()
+    process = CEXAlertProcess(
+        telegram_bot=bot,
+        price_cache=price_cache,
+        alert_store=alert_store,
+        delivery_queue=DeliveryQueue(bot, global_rate=10**6, chat_rate=10**6),
+        trigger_store=trigger_store,
+    )
+
+    triggered = []  # monotonic() times of the triggered alerts
+    events.event_bus.subscribe(
+        ALERT_TRIGGERED, lambda **payload: triggered.append(monotonic())
+    )
+
+    if args.engine == "async":
+        from src.async_engine import AsyncEngine
+
+        target = AsyncEngine(process).run
+    else:
+        target = process.run
+    threading.Thread(target=target, daemon=True).start()
+
+    # Measure from the end of the first cycle, once the users are loaded and indexed
+    while len(triggered) < args.users * 10:
+        sleep(0.05)
+    start, count = monotonic(), len(triggered)
+    sleep(args.duration)
+    alerts = len(triggered) - count
+    return {
+        "engine": args.engine,
+        "alerts": alerts,
+        "alerts_per_second": round(alerts / args.duration, 1),
+        "requests": server.requests,
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    if args.engine is not None:
+        print(json.dumps(run_engine(args)))
+        return
+
+    print(
+        f"{args.pairs} pairs, {args.users * 10} alerts, {args.latency}s Binance latency, "
+        f"{args.period}s polling period, {args.duration}s per engine"
+    )
+    for engine in ("thread", "async"):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "tests.benchmark_engines",
+                *sys.argv[1:],
+                "--engine",
+                engine,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{engine:>6}: {result['alerts_per_second']} alerts/s ({result['alerts']} alerts)"
+        )
+
+
+if __name__ == "__main__":
+    main()
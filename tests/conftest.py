@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+os.environ.setdefault("LOCATION", "global")
+
+from src import events, user_configuration
+from src.events import EventBus
+from src.trigger_store import SQLiteTriggerBackend, TriggerStore
+
+from .fakes import FakeTelegramBot
+
+
+@pytest.fixture
+def event_bus(monkeypatch) -> EventBus:
+    """A bus of its own for the test, also used by the user configurations"""
+    bus = EventBus()
+    monkeypatch.setattr(events, "event_bus", bus)
+    monkeypatch.setattr(user_configuration, "event_bus", bus)
+    return bus
+
+
+@pytest.fixture
+def whitelist(tmp_path, monkeypatch, event_bus):
+    """An empty local whitelist in the test's temporary directory"""
+    monkeypatch.setattr(
+        user_configuration, "WHITELIST_ROOT", str(tmp_path / "whitelist")
+    )
+    user_configuration.whitelist_registry.refresh()
+    yield
+    user_configuration.whitelist_registry.refresh()
+
+
+@pytest.fixture
+def trigger_store(tmp_path, event_bus) -> TriggerStore:
+    store = TriggerStore(
+        backend=SQLiteTriggerBackend(str(tmp_path / "triggers.db")), event_bus=event_bus
+    )
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def telegram_bot() -> FakeTelegramBot:
+    return FakeTelegramBot()
+
+
+def make_user(user_id: str, alerts: dict) -> user_configuration.LocalUserConfiguration:
+    """Whitelist a user of the local backend with the given alerts database"""
+    configuration = user_configuration.LocalUserConfiguration(user_id)
+    configuration.whitelist_user()
+    configuration.update_alerts(alerts)
+    return configuration
+
+
+def simple_alert(comparison: str, target: float, cooldown: int = None) -> dict:
+    return {
+        "type": "s",
+        "indicator": "PRICE",
+        "comparison": comparison,
+        "target": target,
+        "params": {},
+        "trigger": {"cooldown_seconds": cooldown, "last_triggered": 0},
+    }
+
+
+def rsi_alert(comparison: str, target: float) -> dict:
+    return {
+        "type": "t",
+        "indicator": "RSI",
+        "interval": "1h",
+        "params": {"period": 14},
+        "output_value": "value",
+        "comparison": comparison,
+        "target": target,
+        "trigger": {"cooldown_seconds": None, "last_triggered": 0},
+    }
@@ -0,0 +1,234 @@
+"""
+Local stand-ins for the upstream services (Binance WebSocket streams & REST API, Telegram), so that the bot
+can be exercised without network access or API keys.
+"""
+
+import asyncio
+import json
+import threading
+from os.path import dirname, join
+from time import monotonic, sleep
+
+from aiohttp import web
+
+FIXTURES_ROOT = join(dirname(__file__), "fixtures")
+
+
+def wait_until(predicate, timeout: float = 5, interval: float = 0.01) -> bool:
+    """Poll predicate() until it is truthy or timeout seconds have passed, and return its last result"""
+    deadline = monotonic() + timeout
+    while True:
+        result = predicate()
+        if result or monotonic() >= deadline:
+            return result
+        sleep(interval)
+
+
+class FakeTelegramBot:
+    """Stands in for the TeleBot of the delivery queue, recording the sent messages"""
+
+    def __init__(self):
+        self.sent = []  # [(chat_id, text)]
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text: str, **kwargs):
+        with self._lock:
+            self.sent.append((str(chat_id), text))
+        return text
+
+    def texts(self) -> list[str]:
+        with self._lock:
+            return [text for _, text in self.sent]
+
+
+class _AiohttpServer:
+    """An aiohttp application served on 127.0.0.1 from its own event loop thread"""
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self.port = self.call(self._start())
+
+    def routes(self, app: web.Application) -> None:
+        raise NotImplementedError
+
+    def call(self, coroutine):
+        """Run a coroutine on the server's loop and return its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(10)
+
+    async def _start(self) -> int:
+        app = web.Application()
+        self.routes(app)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def close(self) -> None:
+        self.call(self._runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class FakeBinanceStream(_AiohttpServer):
+    """
+    Stand-in for the Binance WebSocket API (wss://stream.binance.com:9443/ws).
+
+    Answers SUBSCRIBE / UNSUBSCRIBE requests like Binance does, and replays a recorded file of raw miniTicker or
+    bookTicker events (one JSON event per line) to the streams subscribed by the connected client.
+    """
+
+    def __init__(self, ticks: str = "miniticker.jsonl"):
+        """:param ticks: The recorded events, relative to tests/fixtures"""
+        with open(join(FIXTURES_ROOT, ticks)) as infile:
+            self.ticks = [json.loads(line) for line in infile if line.strip()]
+        self.requests = []  # [(connection number, method, params)] received
+        self.subscriptions = (
+            set()
+        )  # Streams of the current connection (e.g. "btcusdt@miniTicker")
+        self.attempts = (
+            []
+        )  # monotonic() times of the connection attempts, including the refused ones
+        self.refuse = 0  # Number of upcoming connection attempts to answer with 503
+        self.accepted = 0  # Number of accepted connections
+        self._sockets = set()
+        super().__init__()
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_get("/ws", self._handle)
+
+    async def _handle(self, request: web.Request):
+        self.attempts.append(monotonic())
+        if self.refuse > 0:
+            self.refuse -= 1
+            return web.Response(status=503)
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.accepted += 1
+        connection = self.accepted
+        self.subscriptions = set()  # Subscriptions do not survive a reconnection
+        self._sockets.add(ws)
+        try:
+            async for message in ws:
+                data = json.loads(message.data)
+                self.requests.append((connection, data["method"], data["params"]))
+                if data["method"] == "SUBSCRIBE":
+                    self.subscriptions.update(data["params"])
+                elif data["method"] == "UNSUBSCRIBE":
+                    self.subscriptions.difference_update(data["params"])
+                await ws.send_json({"result": None, "id": data["id"]})
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+    @staticmethod
+    def stream_of(tick: dict) -> str:
+        stream_type = (
+            "miniTicker" if tick.get("e") == "24hrMiniTicker" else "bookTicker"
+        )
+        return f"{tick['s'].lower()}@{stream_type}"
+
+    def replay(self, delay: float = 0.0) -> int:
+        """
+        Send the recorded events of the subscribed streams, in order
+
+        :param delay: Seconds between two events
+        :return: The number of events sent
+        """
+
+        async def send():
+            sent = 0
+            for tick in self.ticks:
+                if self.stream_of(tick) not in self.subscriptions:
+                    continue
+                for ws in list(self._sockets):
+                    await ws.send_str(json.dumps(tick))
+                sent += 1
+                if delay:
+                    await asyncio.sleep(delay)
+            return sent
+
+        return self.call(send())
+
+    def drop(self) -> None:
+        """Close the client connections, as Binance does e.g. every 24 hours"""
+
+        async def close():
+            for ws in list(self._sockets):
+                await ws.close()
+
+        self.call(close())
+
+    def methods(self, connection: int = None) -> list[tuple[str, list[str]]]:
+        """:return: The (method, params) of the requests received, on a single connection if given"""
+        return [
+            (method, params)
+            for number, method, params in self.requests
+            if connection is None or number == connection
+        ]
+
+
+class FakeBinanceAPI(_AiohttpServer):
+    """
+    Stand-in for the Binance rolling window ticker endpoint (GET /api/v3/ticker), answering single and
+    multi-symbol requests after a fixed latency.
+    """
+
+    def __init__(self, latency: float = 0.0, prices: dict = None, price: float = 100.0):
+        """
+        :param latency: Seconds before each response is sent
+        :param prices: {symbol: last price}, for the symbols that are not quoted at the default price
+        :param price: The last price of every other symbol
+        """
+        self.latency = latency
+        self.prices = prices if prices is not None else {}
+        self.price = price
+        self.requests = 0
+        # Statuses to answer the next requests with, before answering normally again
+        self.errors = []
+        super().__init__()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api/v3/ticker?symbol={{}}&windowSize={{}}"
+
+    @property
+    def bulk_endpoint(self) -> str:
+        return (
+            f"http://127.0.0.1:{self.port}/api/v3/ticker?symbols={{}}&windowSize={{}}"
+        )
+
+    def patch(self, price_cache) -> None:
+        """Point a src.price_cache.PriceCache (and the engines using its endpoints) at this server"""
+        price_cache.endpoint = self.endpoint
+        price_cache.bulk_endpoint = self.bulk_endpoint
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_get("/api/v3/ticker", self._handle)
+
+    def ticker(self, symbol: str, window: str) -> dict:
+        price = self.prices.get(symbol, self.price)
+        return {
+            "symbol": symbol,
+            "lastPrice": f"{price}",
+            "openPrice": f"{price / 1.02}",
+            "priceChange": f"{price - price / 1.02}",
+            "priceChangePercent": "2.0",
+            "window": window,
+        }
+
+    async def _handle(self, request: web.Request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.errors:
+            return web.Response(status=self.errors.pop(0))
+        window = request.query.get("windowSize", "1d")
+        if "symbols" in request.query:
+            symbols = json.loads(request.query["symbols"])
+            return web.json_response([self.ticker(s, window) for s in symbols])
+        return web.json_response(self.ticker(request.query["symbol"], window))
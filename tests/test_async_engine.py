@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from time import monotonic, time
+from types import SimpleNamespace
+
+import pytest
+
+from src import resilience
+from src.async_engine import AsyncEngine, AsyncHTTPClient
+from src.indicators import TaapiioProcess
+from src.price_cache import PriceCache
+from src.resilience import CircuitBreaker, RetryPolicy, Upstream
+
+from .fakes import FakeBinanceAPI
+
+
+@pytest.fixture
+def engine(event_bus) -> AsyncEngine:
+    taapiio = TaapiioProcess(taapiio_apikey="", event_bus=event_bus)
+    taapiio.aggregate_changed.clear()
+    return AsyncEngine(cex_process=None, taapiio_process=taapiio)
+
+
+def waited(engine: AsyncEngine) -> float:
+    start = monotonic()
+    asyncio.run(engine.wait_for_schedule())
+    return monotonic() - start
+
+
+def test_waits_until_the_next_indicator_is_due(engine):
+    engine.taapiio.next_due = time() + 1.5
+    assert 1.4 <= waited(engine) < 1.9
+
+
+def test_wakes_up_when_technical_alerts_are_added(engine):
+    engine.taapiio.next_due = None
+    threading.Timer(0.3, engine.taapiio.aggregate_changed.set).start()
+    assert 0.2 <= waited(engine) < 0.6
+
+
+@pytest.fixture
+def binance(monkeypatch):
+    """The Binance stand-in, and the upstream shared by both engines with short retry delays"""
+    server = FakeBinanceAPI()
+    upstream = Upstream(
+        "binance",
+        policy=RetryPolicy(attempts=3, base_delay=0.01),
+        breaker=CircuitBreaker("binance", failure_threshold=2),
+    )
+    monkeypatch.setattr(resilience, "_upstreams", {"binance": upstream})
+    yield server, upstream
+    server.close()
+
+
+def fetch(server: FakeBinanceAPI, symbols: set[str]) -> dict:
+    price_cache = PriceCache(ttl=0)
+    server.patch(price_cache)
+    engine = AsyncEngine(cex_process=SimpleNamespace(price_cache=price_cache))
+
+    async def main():
+        async with AsyncHTTPClient() as engine.http:
+            return await engine.fetch_tickers(symbols, "1d")
+
+    return asyncio.run(main())
+
+
+def test_requests_are_retried_through_the_upstream(binance):
+    server, upstream = binance
+    server.errors = [503]
+    assert list(fetch(server, {"BTCUSDT"})) == ["BTCUSDT"]
+    assert server.requests == 2
+    assert upstream.breaker.state == "closed"
+    assert upstream.budget._remaining == upstream.budget.retries - 1
+
+
+def test_client_errors_are_not_retried(binance):
+    server, upstream = binance
+    server.errors = [400]
+    assert fetch(server, {"BTCUSDT"}) == {}
+    assert server.requests == 1
+    assert upstream.breaker.state == "closed"
+
+
+def test_open_circuit_fails_fast(binance):
+    server, upstream = binance
+    server.errors = [503] * 3
+    assert fetch(server, {"BTCUSDT"}) == {}
+    assert upstream.breaker.state == "open"
+
+    # No request is sent until the circuit half-opens
+    assert fetch(server, {"BTCUSDT"}) == {}
+    assert server.requests == 2
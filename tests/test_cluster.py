@@ -0,0 +1,61 @@
+import threading
+from time import sleep
+
+import pytest
+
+from src import cluster
+from src.cluster import ClusterMember, SQLiteLeaseStore
+
+from .fakes import wait_until
+
+
+class _FlakyLeases(SQLiteLeaseStore):
+    """Leases whose heartbeat fails or is slow on demand"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.failing = False
+        self.delay = 0.0
+
+    def heartbeat(self, instance_id: str, ttl: float) -> None:
+        if self.failing:
+            raise ConnectionError("The lease store is unreachable")
+        sleep(self.delay)
+        super().heartbeat(instance_id, ttl)
+
+
+@pytest.fixture
+def member(whitelist, event_bus, tmp_path):
+    changes = []
+    member = ClusterMember(
+        leases=_FlakyLeases(str(tmp_path / "cluster.db")),
+        partitions=4,
+        event_bus=event_bus,
+        on_leader_change=changes.append,
+    )
+    member.changes = changes
+    yield member
+    member.close()
+
+
+def test_failed_heartbeat_gives_up_the_leadership(member, monkeypatch):
+    monkeypatch.setattr(cluster, "CLUSTER_HEARTBEAT_PERIOD", 0.01)
+    member.heartbeat()
+    assert member.is_leader and member.changes == [True]
+
+    member.leases.failing = True
+    threading.Thread(target=member.run, daemon=True).start()
+    assert wait_until(lambda: member.changes == [True, False])
+    assert not member.is_leader
+
+
+def test_lapsed_lease_gives_up_the_leadership(member, monkeypatch):
+    member.heartbeat()
+    assert member.is_leader
+
+    # The heartbeat completes after the leases it renewed have expired
+    monkeypatch.setattr(cluster, "CLUSTER_LEASE_TTL", 0.05)
+    member.leases.delay = 0.1
+    member.heartbeat()
+    assert not member.is_leader and member.changes == [True, False]
+    assert not member.owns("1001")
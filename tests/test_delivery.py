@@ -0,0 +1,50 @@
+from time import sleep
+
+from src.config import TELEGRAM_MAX_MESSAGE_LENGTH, TELEGRAM_MESSAGE_SEPARATOR
+from src.delivery import DeliveryQueue, split_message
+
+from .fakes import wait_until
+
+
+def test_alerts_of_a_cycle_are_coalesced_per_chat(telegram_bot):
+    queue = DeliveryQueue(telegram_bot)
+    with queue.cycle():
+        for i in range(3):
+            queue.submit("1001", f"alert {i}")
+        queue.broadcast(["1001", "-2002"], "alert 3")
+        sleep(0.2)
+        # Held until the end of the cycle
+        assert telegram_bot.sent == []
+
+    assert wait_until(lambda: len(telegram_bot.sent) == 2)
+    sleep(0.2)
+    assert sorted(telegram_bot.sent) == [
+        ("-2002", "alert 3"),
+        ("1001", TELEGRAM_MESSAGE_SEPARATOR.join(f"alert {i}" for i in range(4))),
+    ]
+
+
+def test_messages_outside_a_cycle_are_sent_right_away(telegram_bot):
+    queue = DeliveryQueue(telegram_bot)
+    future = queue.submit("1001", "alert")
+    assert future.result(timeout=0.5) == "alert"
+
+
+def test_long_messages_are_split(telegram_bot):
+    queue = DeliveryQueue(telegram_bot, chat_rate=1000)
+    lines = [f"{i} " + "x" * 1500 for i in range(5)]
+    future = queue.submit("1001", "\n".join(lines))
+    future.result(timeout=5)
+
+    texts = telegram_bot.texts()
+    assert len(texts) == 3
+    assert all(len(text) <= TELEGRAM_MAX_MESSAGE_LENGTH for text in texts)
+    # Split at line breaks, in order
+    assert "\n".join(texts) == "\n".join(lines)
+
+
+def test_split_message():
+    assert split_message("short") == ["short"]
+    # A line longer than the limit is cut at the limit
+    assert split_message("a" * 10, limit=4) == ["aaaa", "aaaa", "aa"]
+    assert split_message("aaa\nbbb\nccc", limit=8) == ["aaa\nbbb", "ccc"]
@@ -0,0 +1,64 @@
+from src.indicators import TaapiioProcess, indicator_key
+
+
+def rsi(period: int, last_update: float) -> dict:
+    return {
+        "indicator": "rsi",
+        "period": period,
+        "values": {"value": 50.0},
+        "last_update": last_update,
+    }
+
+
+def test_refresh_periods_are_tracked_per_indicator(event_bus, monkeypatch):
+    # The free tier: one single-construct query per period
+    monkeypatch.delenv("TAAPIIO_TIER", raising=False)
+    taapiio = TaapiioProcess(taapiio_apikey="", event_bus=event_bus)
+    now = 1_700_000_000
+    aggregate = {
+        "BTC/USDT": {"1h": [rsi(14, now - 300), rsi(21, now - 900)]},
+        "ETH/USDT": {"1h": [rsi(14, now - 600)]},
+    }
+
+    queries = taapiio.schedule(aggregate, now=now)
+
+    # The BTC/USDT construct holds the most overdue indicator, so ETH/USDT is left for the next period
+    assert [len(indicators) for indicators, _ in queries] == [2]
+    assert taapiio.overdue == 1
+    assert taapiio.refresh_periods == {
+        indicator_key("BTC/USDT", "1h", rsi(14, 0)): 300,
+        indicator_key("BTC/USDT", "1h", rsi(21, 0)): 900,
+    }
+    assert taapiio.format_refresh_periods() == "1h 900s (max 900s, 2 indicators)"
+
+
+def test_paid_tiers_pack_many_constructs_per_query(event_bus, monkeypatch):
+    # 10 constructs per query, 20 indicators per construct
+    monkeypatch.setenv("TAAPIIO_TIER", "pro")
+    taapiio = TaapiioProcess(taapiio_apikey="", event_bus=event_bus)
+    due = [
+        (0, f"T{symbol}/USDT", "1h", rsi(period, 0))
+        for symbol in range(10)
+        for period in range(2, 7)
+    ]
+    # A construct with more indicators than allowed is split in two
+    due += [(1, "BTC/USDT", "1h", rsi(period, 0)) for period in range(2, 27)]
+
+    queries = taapiio.build_bulk_queries(due)
+
+    constructs = [query["construct"] for _, query in queries]
+    assert [len(c) if isinstance(c, list) else 1 for c in constructs] == [10, 2]
+    assert [len(c["indicators"]) for c in constructs[0]] == [5] * 10
+    assert [len(c["indicators"]) for c in constructs[1]] == [20, 5]
+
+    # Results are assigned back by their ID, whatever their order in the response
+    indicators, query = queries[1]
+    ids = [i["id"] for c in query["construct"] for i in c["indicators"]]
+    response = {
+        "data": [{"id": id, "result": {"value": float(id)}} for id in reversed(ids)]
+    }
+    taapiio.update_indicators(indicators, response)
+    assert [indicator["values"]["value"] for indicator in indicators] == [
+        float(position) for position in range(25)
+    ]
+    assert [indicator["period"] for indicator in indicators] == list(range(2, 27))
@@ -0,0 +1,145 @@
+import threading
+from time import monotonic
+
+import pytest
+
+from src import price_stream
+from src.alert_processes import CEXAlertProcess
+from src.delivery import DeliveryQueue
+from src.price_stream import BinancePriceStream
+
+from .conftest import make_user, simple_alert
+from .fakes import FakeBinanceStream, wait_until
+
+
+@pytest.fixture
+def server():
+    server = FakeBinanceStream()
+    yield server
+    server.close()
+
+
+def start(stream: BinancePriceStream) -> threading.Thread:
+    thread = threading.Thread(target=stream.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_subscriptions_follow_refcounts(server):
+    stream = BinancePriceStream(on_tick=lambda symbol, ticker: None, url=server.url)
+    start(stream)
+    try:
+        # The server accepts the connection before the stream starts using it
+        assert wait_until(lambda: server.accepted == 1 and stream.connected)
+
+        stream.acquire("BTCUSDT")
+        stream.acquire("BTCUSDT", 2)
+        stream.acquire("ETHUSDT")
+        assert wait_until(lambda: len(server.requests) == 2)
+        stream.release("BTCUSDT", 2)
+        stream.release("BTCUSDT")
+        # Tracked again by the sync, and ETHUSDT released by it
+        stream.sync({"BTCUSDT": 1, "XRPUSDT": 2})
+        assert wait_until(lambda: len(server.requests) == 6)
+
+        assert server.methods() == [
+            ("SUBSCRIBE", ["btcusdt@miniTicker"]),
+            ("SUBSCRIBE", ["ethusdt@miniTicker"]),
+            ("UNSUBSCRIBE", ["btcusdt@miniTicker"]),
+            ("UNSUBSCRIBE", ["ethusdt@miniTicker"]),
+            ("SUBSCRIBE", ["btcusdt@miniTicker"]),
+            ("SUBSCRIBE", ["xrpusdt@miniTicker"]),
+        ]
+        assert server.subscriptions == {"btcusdt@miniTicker", "xrpusdt@miniTicker"}
+        assert stream.refcounts == {"BTCUSDT": 1, "XRPUSDT": 2}
+    finally:
+        stream.stop()
+
+
+def test_reconnects_with_backoff(server, monkeypatch):
+    monkeypatch.setattr(price_stream, "BINANCE_STREAM_BACKOFF", (0.2, 1))
+    stream = BinancePriceStream(on_tick=lambda symbol, ticker: None, url=server.url)
+    stream.acquire("BTCUSDT")  # Tracked before the first connection
+    start(stream)
+    try:
+        assert wait_until(lambda: server.subscriptions == {"btcusdt@miniTicker"})
+
+        # The server drops the connection, then refuses the next two attempts
+        server.refuse = 2
+        dropped = monotonic()
+        server.drop()
+        assert wait_until(lambda: server.accepted == 2, timeout=10)
+
+        # Every tracked symbol is subscribed again on the new connection
+        assert wait_until(lambda: server.subscriptions == {"btcusdt@miniTicker"})
+        assert server.methods(connection=2) == [("SUBSCRIBE", ["btcusdt@miniTicker"])]
+
+        # The delay (jittered between half and all of it) doubles after each failed attempt
+        first = server.attempts[1] - dropped
+        second, third = (server.attempts[i + 1] - server.attempts[i] for i in (1, 2))
+        assert 0.1 <= first < 0.4
+        assert 0.2 <= second < 0.6
+        assert 0.4 <= third < 1.0
+    finally:
+        stream.stop()
+
+
+@pytest.mark.parametrize(
+    "ticks, stream_type, btc_price, eth_price",
+    [
+        ("miniticker.jsonl", "miniTicker", "30010.5", "1998.7"),
+        # bookTicker events are evaluated at the mid price
+        ("bookticker.jsonl", "bookTicker", "30010.5", "1998.7"),
+    ],
+)
+def test_alerts_fire_on_crossing_tick(
+    whitelist,
+    event_bus,
+    trigger_store,
+    telegram_bot,
+    ticks,
+    stream_type,
+    btc_price,
+    eth_price,
+):
+    server = FakeBinanceStream(ticks)
+    make_user(
+        "1001",
+        {
+            "BTC/USDT": [simple_alert("ABOVE", 30000)],
+            "ETH/USDT": [simple_alert("BELOW", 2000)],
+        },
+    )
+    process = CEXAlertProcess(
+        telegram_bot=telegram_bot,
+        streaming=True,
+        delivery_queue=DeliveryQueue(telegram_bot),
+        event_bus=event_bus,
+        trigger_store=trigger_store,
+    )
+    process.build_index()
+    process.stream = BinancePriceStream(
+        on_tick=process.on_tick, url=server.url, stream_type=stream_type
+    )
+    process.sync_stream()
+    start(process.stream)
+    try:
+        assert wait_until(
+            lambda: server.subscriptions
+            == {f"btcusdt@{stream_type}", f"ethusdt@{stream_type}"}
+        )
+        server.replay()
+
+        assert wait_until(lambda: "".join(telegram_bot.texts()).count("TARGET") == 2)
+        # The triggered alerts were removed, and their streams unsubscribed
+        assert wait_until(lambda: server.subscriptions == set())
+        assert process.stream.refcounts == {}
+
+        # Each alert fired once, at the first tick across its target
+        messages = "".join(telegram_bot.texts())
+        assert f"BTC/USDT ABOVE 30000 TARGET AT {btc_price}" in messages
+        assert f"ETH/USDT BELOW 2000 TARGET AT {eth_price}" in messages
+        assert messages.count("TARGET") == 2
+    finally:
+        process.stream.stop()
+        server.close()
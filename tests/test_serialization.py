@@ -0,0 +1,25 @@
+import os
+import stat
+
+from src import serialization
+from src.serialization import read_json, write_json
+
+
+def mode(path) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_write_json_keeps_the_file_permissions(tmp_path):
+    path = str(tmp_path / "alerts.json")
+    write_json(path, {"BTC/USDT": []})
+    os.chmod(path, 0o640)
+
+    assert write_json(path, {"ETH/USDT": []})
+    assert mode(path) == 0o640
+    assert read_json(path) == {"ETH/USDT": []}
+
+
+def test_write_json_creates_files_with_the_default_permissions(tmp_path):
+    path = str(tmp_path / "config.json")
+    write_json(path, {"channels": []})
+    assert mode(path) == 0o666 & ~serialization._umask
@@ -0,0 +1,91 @@
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+import pytest
+
+from src import trigger_store
+from src.events import EventBus
+from src.indicators import TAAggregate, TAAggregateClient, TaapiioProcess
+from src.sharding import ShardCoordinator, ShardWorker
+
+from .conftest import make_user, rsi_alert
+
+
+class _FakeDelivery:
+    """Records the broadcasts of the coordinator instead of sending them"""
+
+    def __init__(self):
+        self.sent = []
+
+    def cycle(self):
+        return nullcontext()
+
+    def broadcast(self, chat_ids, text, **kwargs):
+        self.sent.append((chat_ids, text))
+        future = Future()
+        future.set_result((chat_ids, []))
+        return future
+
+
+@pytest.fixture
+def coordinator(whitelist, event_bus, tmp_path, monkeypatch):
+    """
+    A coordinator of a single shard, whose worker runs in a thread and publishes on the test's event bus,
+    while the coordinator and its Taapi.io process use a bus of their own (as in separate processes)
+    """
+    monkeypatch.setattr(trigger_store, "TRIGGER_DB_PATH", str(tmp_path / "triggers.db"))
+    taapiio = TaapiioProcess(taapiio_apikey="", event_bus=EventBus())
+    taapiio.agg_cli = TAAggregateClient(
+        aggregate=TAAggregate(path=str(tmp_path / "aggregate.json"))
+    )
+    coordinator = ShardCoordinator(
+        1,
+        _FakeDelivery(),
+        taapiio_process=taapiio,
+        event_bus=taapiio.event_bus,
+    )
+
+    def spawn(shard):
+        coordinator.tasks[shard] = queue.Queue()
+        worker = ShardWorker(
+            shard,
+            coordinator.shards,
+            coordinator.snapshot.name,
+            coordinator.tasks[shard],
+            coordinator.results,
+            True,
+        )
+        coordinator.processes[shard] = threading.Thread(target=worker.run, daemon=True)
+        coordinator.processes[shard].start()
+
+    monkeypatch.setattr(coordinator, "_spawn", spawn)
+    yield coordinator
+    coordinator.close()
+
+
+def test_removed_alerts_leave_the_coordinators_aggregate(coordinator):
+    make_user(
+        "1001",
+        {"BTC/USDT": [rsi_alert("ABOVE", 70)], "ETH/USDT": [rsi_alert("BELOW", 30)]},
+    )
+    taapiio = coordinator.taapiio_process
+    taapiio.refresh_aggregate()
+    assert len(taapiio.agg_cli.refcounts) == 2
+
+    # Only the BTC/USDT RSI crosses its target
+    aggregate = taapiio.agg_cli.copy_agg()
+    aggregate["BTC/USDT"]["1h"][0]["values"]["value"] = 75.0
+    aggregate["ETH/USDT"]["1h"][0]["values"]["value"] = 45.0
+    taapiio.agg_cli.dump_agg(aggregate)
+
+    coordinator.start()
+    coordinator.cycle()
+
+    assert len(coordinator.delivery_queue.sent) == 1
+    assert "BTC/USDT" in coordinator.delivery_queue.sent[0][1]
+    # The worker's ALERT_REMOVED reached the Taapi.io process through the coordinator's bus
+    assert taapiio.refresh_aggregate()
+    assert list(taapiio.agg_cli.load_agg()) == ["ETH/USDT"]
+    assert [key[0] for key in taapiio.agg_cli.refcounts] == ["ETH/USDT"]
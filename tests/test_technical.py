@@ -0,0 +1,50 @@
+from src.alert_processes import TechnicalAlertProcess
+from src.delivery import DeliveryQueue
+from src.events import ALERT_ADDED
+from src.indicators import TAAggregate, TAAggregateClient, TaapiioProcess
+
+from .conftest import make_user, rsi_alert
+from .fakes import wait_until
+
+
+def test_alert_added_between_two_refreshes(
+    whitelist, event_bus, trigger_store, telegram_bot, tmp_path
+):
+    configuration = make_user("1001", {"BTC/USDT": [rsi_alert("ABOVE", 70)]})
+    taapiio = TaapiioProcess(taapiio_apikey="", event_bus=event_bus)
+    taapiio.agg_cli = TAAggregateClient(
+        aggregate=TAAggregate(path=str(tmp_path / "aggregate.json"))
+    )
+    taapiio.refresh_aggregate()
+    aggregate = taapiio.agg_cli.copy_agg()
+    aggregate["BTC/USDT"]["1h"][0]["values"]["value"] = 75.0
+    taapiio.agg_cli.dump_agg(aggregate)
+
+    process = TechnicalAlertProcess(
+        telegram_bot=telegram_bot,
+        delivery_queue=DeliveryQueue(telegram_bot),
+        event_bus=event_bus,
+        trigger_store=trigger_store,
+    )
+    process.ta_agg_cli = TAAggregateClient(aggregate=taapiio.agg_cli.ta_aggregate)
+    process.load_technical_pairs()
+
+    # The new alert reaches the alert process before the Taapi.io process refreshes the aggregate
+    alert = rsi_alert("BELOW", 30)
+
+    def add_alert(alerts):
+        alerts["ETH/USDT"] = [alert]
+        return alerts["ETH/USDT"]
+
+    pair_alerts = configuration.modify_alerts(add_alert)
+    event_bus.publish(
+        ALERT_ADDED, user_id="1001", pair="ETH/USDT", alert=alert, alerts=pair_alerts
+    )
+    process.poll_all_alerts()
+    assert wait_until(lambda: "BTC/USDT" in "".join(telegram_bot.texts()))
+
+    # Once refreshed, the new indicator has no value until it is polled
+    assert taapiio.refresh_aggregate()
+    assert taapiio.agg_cli.find("ETH/USDT", alert) is not None
+    process.poll_all_alerts()
+    assert "ETH/USDT" in configuration.load_alerts()
@@ -0,0 +1,97 @@
+from itertools import count
+
+import pytest
+
+from src.cluster import ClusterMember, SQLiteLeaseStore, _preferred
+from src.events import USER_REMOVED, EventBus
+from src.sharding import shard_of
+from src.trigger_store import SQLiteTriggerBackend, TriggerStore
+
+from .conftest import make_user, simple_alert
+
+ALERT = simple_alert("ABOVE", 30000, cooldown=60)
+
+
+@pytest.fixture
+def backend(tmp_path) -> SQLiteTriggerBackend:
+    return SQLiteTriggerBackend(str(tmp_path / "triggers.db"))
+
+
+def test_states_are_written_in_batches_and_reloaded(whitelist, event_bus, backend):
+    store = TriggerStore(backend=backend, event_bus=event_bus)
+    store.record("1001", "BTC/USDT", ALERT, 100, 30001.0)
+    store.record("1001", "BTC/USDT", ALERT, 200, 30002.0)
+    assert backend.load() == {}
+
+    store.flush()
+    # e.g. the worker of another shard, after a change of SHARDS
+    restarted = TriggerStore(backend=backend, event_bus=event_bus)
+    assert restarted.get("1001", "BTC/USDT", ALERT) == {
+        "last_triggered": 200,
+        "fire_count": 2,
+        "last_value": 30002.0,
+    }
+    assert restarted.last_triggered("1001", "ETH/USDT", ALERT) == 0
+
+
+def test_states_follow_a_user_handed_over(whitelist, event_bus, backend, tmp_path):
+    make_user("1001", {"BTC/USDT": [ALERT]})
+    # Two cluster instances, each with its own bus and trigger store
+    leases = str(tmp_path / "cluster.db")
+    giving = ClusterMember(
+        leases=SQLiteLeaseStore(leases), instance_id="giving", event_bus=EventBus()
+    )
+    giving_store = TriggerStore(backend=backend, event_bus=giving.event_bus)
+    giving.heartbeat()
+    giving_store.record("1001", "BTC/USDT", ALERT, 100)
+
+    # An instance that the partition of the user moves to joins
+    partition = shard_of("1001", giving.partition_count)
+    taking_id = next(
+        f"taking-{i}"
+        for i in count()
+        if _preferred(partition, ["giving", f"taking-{i}"]) == f"taking-{i}"
+    )
+    taking = ClusterMember(
+        leases=SQLiteLeaseStore(leases), instance_id=taking_id, event_bus=EventBus()
+    )
+    taking_store = TriggerStore(
+        backend=SQLiteTriggerBackend(str(tmp_path / "triggers.db")),
+        event_bus=taking.event_bus,
+    )
+    taking.heartbeat()
+    assert not taking.owns("1001")
+
+    # The taking instance heartbeats as soon as the partition is released
+    release = giving.leases.release
+
+    def release_and_take_over(name: str, owner: str) -> None:
+        release(name, owner)
+        if name == f"partition:{partition}":
+            taking.heartbeat()
+
+    giving.leases.release = release_and_take_over
+    giving.heartbeat()
+    assert not giving.owns("1001") and taking.owns("1001")
+    assert taking_store.last_triggered("1001", "BTC/USDT", ALERT) == 100
+
+    giving.close()
+    taking.close()
+
+
+def test_forgotten_states_are_deleted(whitelist, event_bus, backend):
+    store = TriggerStore(backend=backend, event_bus=event_bus)
+    store.record("1001", "BTC/USDT", ALERT, 100)
+    store.record("1001", "ETH/USDT", ALERT, 100)
+    store.record("1002", "BTC/USDT", ALERT, 100)
+    store.flush()
+
+    store.forget("1001", "ETH/USDT", ALERT)
+    store.flush()
+    assert len(backend.load("1001")) == 1
+
+    # Blacklisted
+    event_bus.publish(USER_REMOVED, user_id="1001")
+    assert backend.load("1001") == {}
+    assert store.get("1001", "BTC/USDT", ALERT) == {}
+    assert len(backend.load()) == 1